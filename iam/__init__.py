@@ -0,0 +1,89 @@
+# the interactive activation model as an importable package. importing it
+# only defines things: nothing is loaded or run until you ask for it, e.g.
+#
+#   from iam import load_model, word_stimulus
+#   model = load_model()
+#   letter_trace, word_trace = model.run(word_stimulus("work"), 40)
+
+from .cache import TrialCache, trial_key
+from .constants import DEFAULT_PARAMETERS, MASK, MASK_START, alphabet, letter_to_index, letters, parameter_batch_size, resolve_parameters
+from .core import IAPool, compute_activation, compute_effect, compute_inhibition, compute_net_input, per_trial, pool_step, propagate
+from .experiments import RecognitionResult, degraded_variants, recognition_sweep
+from .fitting import FitResult, fit_parameters
+from .lengths import LengthBucketedModel, LengthBucketedResult, MixedLexicon
+from .lexicon import DEFAULT_WORDS_PATH, Lexicon, encode_words, read_words
+from .model import IAModel, load_model
+from .montecarlo import MonteCarloResult, normal_noise, run_monte_carlo
+from .precision import PrecisionReport, check_precision, check_pruning, compare_models
+from .profiling import Profiler
+from .schedule import CompiledSchedule, Schedule
+from .snapshot import Snapshot, load_snapshot
+from .steady_state import SteadyStateResult, solve_steady_state
+from .stimulus import blank_stimulus, mask_stimulus, word_stimulus
+from .sweep import SweepResult, parameter_grid, run_sweep
+from .threads import ThreadedRunner, run_trials
+from .trace import TraceRecorder
+from .weights import CompiledWeights, LexiconConnectivity, compile_feature_weights, compile_weights, load_weights
+
+__all__ = [
+    "DEFAULT_PARAMETERS",
+    "DEFAULT_WORDS_PATH",
+    "MASK",
+    "MASK_START",
+    "CompiledSchedule",
+    "CompiledWeights",
+    "FitResult",
+    "IAModel",
+    "IAPool",
+    "LengthBucketedModel",
+    "LengthBucketedResult",
+    "Lexicon",
+    "LexiconConnectivity",
+    "MixedLexicon",
+    "MonteCarloResult",
+    "PrecisionReport",
+    "Profiler",
+    "RecognitionResult",
+    "Schedule",
+    "Snapshot",
+    "SteadyStateResult",
+    "SweepResult",
+    "ThreadedRunner",
+    "TraceRecorder",
+    "TrialCache",
+    "alphabet",
+    "blank_stimulus",
+    "check_precision",
+    "check_pruning",
+    "compare_models",
+    "compile_feature_weights",
+    "compile_weights",
+    "compute_activation",
+    "compute_effect",
+    "compute_inhibition",
+    "compute_net_input",
+    "degraded_variants",
+    "encode_words",
+    "fit_parameters",
+    "letter_to_index",
+    "letters",
+    "load_model",
+    "load_snapshot",
+    "load_weights",
+    "mask_stimulus",
+    "normal_noise",
+    "parameter_batch_size",
+    "parameter_grid",
+    "per_trial",
+    "pool_step",
+    "propagate",
+    "read_words",
+    "recognition_sweep",
+    "resolve_parameters",
+    "run_monte_carlo",
+    "run_sweep",
+    "run_trials",
+    "solve_steady_state",
+    "trial_key",
+    "word_stimulus",
+]
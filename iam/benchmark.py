@@ -0,0 +1,280 @@
+# timing and memory benchmarks for the model, on the real words.csv lexicon and
+# on synthetic lexicons of increasing size. run it with
+#
+#   python -m iam.benchmark
+#
+# to time everything and compare against the stored baseline in
+# benchmarks/baseline.json. any step that got slower (or uses more memory) by
+# more than the tolerance is flagged and the exit status is 1. use
+# --save-baseline to replace the baseline with the current results.
+# --threads 1 2 4 also shows how the throughput of the ThreadedRunner scales
+# with the number of threads on words.csv (this depends on the number of
+# cores, so it is not compared against the baseline).
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from .constants import alphabet, resolve_parameters
+from .core import IAPool, compute_activation, compute_effect, compute_net_input
+from .lexicon import DEFAULT_WORDS_PATH, Lexicon
+from .model import IAModel
+from .stimulus import word_stimulus
+from .threads import ThreadedRunner
+from .weights import compile_weights
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'baseline.json')
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+
+# IAPool needs the dense letter->word weights, which take
+# 4 x 26 x num_words floats. lexicons that would need more than this are only
+# benchmarked with IAModel.
+MAX_DENSE_BYTES = 512 * 1024 * 1024
+
+# the prune_margin the pruned trial is run with.
+PRUNE_MARGIN = 0.05
+
+
+# a random lexicon of num_words words, for measuring how things scale. the
+# letters and frequencies are drawn from a fixed seed, so the same size
+# always gives the same lexicon.
+def synthetic_lexicon(num_words, positions=4, seed=0):
+    rng = np.random.default_rng(seed)
+    word_letters = rng.integers(0, len(alphabet), size=(num_words, positions))
+    frequencies = -rng.random(num_words)
+
+    # turn the letter indices back into strings through their code points.
+    codes = (word_letters + ord(alphabet[0])).astype(np.uint32)
+    words = codes.view('<U%d' % positions).ravel().tolist()
+
+    return Lexicon(words, frequencies, word_letters.astype(np.intp))
+
+
+# time a function: it is called enough times to take at least min_time
+# seconds, and this is repeated `repeat` times. returns the best time per call
+# (the least disturbed by everything else running on the machine).
+def time_call(function, min_time=0.2, repeat=3):
+    function()
+
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed == 0 else max(2, int(min_time / elapsed) + 1)
+
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, (time.perf_counter() - start) / number)
+
+    return best
+
+
+# the most memory allocated at once during one call of function, in bytes.
+def peak_memory(function):
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(function, **timing):
+    return {'seconds': time_call(function, **timing), 'peak_bytes': peak_memory(function)}
+
+
+# the benchmarks for one lexicon. returns a dictionary of
+# {benchmark name: {'seconds': ..., 'peak_bytes': ...}}. a full trial is
+# reported per cycle.
+def benchmark_lexicon(lexicon, cycles=40, params=None, **timing):
+    params = resolve_parameters(params)
+    weights = compile_weights(lexicon, params)
+    num_words = len(lexicon)
+    results = {}
+
+    # a mid-trial state: some words are active, most are below zero.
+    rng = np.random.default_rng(1)
+    word_state = rng.uniform(params["MIN_ACTIVATION"], 0.1, num_words)
+    letter_states = [rng.uniform(params["MIN_ACTIVATION"], 1.0, len(alphabet)) for _ in range(lexicon.positions)]
+
+    if lexicon.positions * len(alphabet) * num_words * 8 <= MAX_DENSE_BYTES:
+        w_from_letters_to_words, w_from_words_to_letters = weights.connectivity.dense()
+        pool = IAPool(num_words, weights=w_from_letters_to_words, decay_rate=params["DECAY_RATE"], min_value=params["MIN_ACTIVATION"], inhibition_strength=params["WORD_WORD_INHIBITION"], resting_state=weights.word_resting_state)
+        pool.state = word_state
+        net_input = pool.compute_net_input(letter_states)
+        effect = pool.compute_effect(net_input)
+
+        results['compute_net_input'] = measure(lambda: compute_net_input(letter_states, w_from_letters_to_words, params["WORD_WORD_INHIBITION"], word_state), **timing)
+        results['compute_effect'] = measure(lambda: compute_effect(net_input, word_state, params["MIN_ACTIVATION"], 1.0), **timing)
+        results['compute_activation'] = measure(lambda: compute_activation(effect, word_state, params["DECAY_RATE"], weights.word_resting_state, params["MIN_ACTIVATION"], 1.0), **timing)
+
+        def pool_step():
+            pool.state = word_state
+            pool.step(letter_states)
+        results['IAPool.step'] = measure(pool_step, **timing)
+
+    model = IAModel.from_weights(weights)
+    stimulus = word_stimulus(lexicon.words[0])
+    recorder = model.recorder(cycles, words=[lexicon.words[0]], letters=[])
+
+    def trial():
+        model.run(stimulus, cycles, recorder=recorder)
+    result = measure(trial, **timing)
+    results['IAModel trial (per cycle)'] = {'seconds': result['seconds'] / cycles, 'peak_bytes': result['peak_bytes']}
+
+    # the same trial with the approximate word update (see
+    # IAModel.prune_margin), which only pays for the active set each cycle.
+    pruned = IAModel.from_weights(weights, prune_margin=PRUNE_MARGIN)
+
+    def pruned_trial():
+        pruned.run(stimulus, cycles, recorder=recorder)
+    result = measure(pruned_trial, **timing)
+    results['pruned trial (per cycle)'] = {'seconds': result['seconds'] / cycles, 'peak_bytes': result['peak_bytes']}
+
+    return results
+
+
+# run every benchmark on words.csv and on synthetic lexicons of each size.
+def run_benchmarks(sizes=DEFAULT_SIZES, cycles=40, words_path=DEFAULT_WORDS_PATH, **timing):
+    lexicons = [('words.csv', lambda: Lexicon.from_csv(words_path))]
+    lexicons += [('synthetic %d' % size, lambda size=size: synthetic_lexicon(size)) for size in sizes]
+
+    results = {}
+    for name, make_lexicon in lexicons:
+        print('benchmarking ' + name, file=sys.stderr)
+        results[name] = benchmark_lexicon(make_lexicon(), cycles=cycles, **timing)
+
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cycles': cycles,
+        },
+        'results': results,
+    }
+
+
+# the throughput of a ThreadedRunner on a lexicon with each number of
+# threads: {threads: trials per second}, for trials trials of cycles cycles
+# (each one showing one of the lexicon's words).
+def thread_scaling(lexicon, thread_counts, trials=1024, cycles=40, batch_size=64, **timing):
+    model = IAModel.from_weights(compile_weights(lexicon))
+    words = [lexicon.words[i % len(lexicon)] for i in range(trials)]
+    stimuli = word_stimulus(words)
+
+    results = {}
+    for threads in thread_counts:
+        with ThreadedRunner(model, threads=threads, batch_size=batch_size) as runner:
+            results[threads] = trials / time_call(lambda: runner.run(stimuli, cycles), **timing)
+
+    return results
+
+
+def format_thread_scaling(results):
+    lines = ['%-8s %14s %8s' % ('threads', 'trials/s', 'speedup')]
+    base = results[min(results)]
+    for threads, throughput in sorted(results.items()):
+        lines.append('%-8d %14.1f %8.2f' % (threads, throughput, throughput / base))
+
+    return '\n'.join(lines)
+
+
+# compare results against a baseline. returns a list of
+# (lexicon, benchmark, measure, baseline value, current value, ratio) for
+# every measurement (with None for the baseline value and the ratio of the
+# ones the baseline doesn't have yet), and a list of the ones that got worse
+# by more than tolerance (0.25 = 25%).
+def compare(current, baseline, tolerance=0.25):
+    rows = []
+    regressions = []
+    for lexicon, benchmarks in current['results'].items():
+        for benchmark, measures in benchmarks.items():
+            for measure_name, value in measures.items():
+                base = baseline['results'].get(lexicon, {}).get(benchmark, {}).get(measure_name)
+                if base is None:
+                    rows.append((lexicon, benchmark, measure_name, None, value, None))
+                    continue
+                ratio = value / base if base else float('inf')
+                row = (lexicon, benchmark, measure_name, base, value, ratio)
+                rows.append(row)
+                if ratio > 1 + tolerance:
+                    regressions.append(row)
+
+    return rows, regressions
+
+
+def format_comparison(rows, regressions):
+    lines = ['%-20s %-26s %-10s %12s %12s %8s' % ('lexicon', 'benchmark', 'measure', 'baseline', 'current', 'ratio')]
+    for row in rows:
+        lexicon, benchmark, measure_name, base, value, ratio = row
+        if base is None:
+            lines.append('%-20s %-26s %-10s %12s %12.4g %8s' % (lexicon, benchmark, measure_name, '-', value, '-'))
+            continue
+        flag = '  <-- REGRESSION' if row in regressions else ''
+        lines.append('%-20s %-26s %-10s %12.4g %12.4g %8.2f%s' % (lexicon, benchmark, measure_name, base, value, ratio, flag))
+
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark the interactive activation model")
+    parser.add_argument('--sizes', type=int, nargs='*', default=DEFAULT_SIZES, help="sizes of the synthetic lexicons")
+    parser.add_argument('--cycles', type=int, default=40, help="cycles per full trial")
+    parser.add_argument('--output', help="write the results to this json file")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_PATH, help="the baseline json file to compare against")
+    parser.add_argument('--save-baseline', action='store_true', help="store the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown before a regression is flagged")
+    parser.add_argument('--threads', type=int, nargs='*', help="also measure the threaded runner with these numbers of threads")
+    args = parser.parse_args(argv)
+
+    if args.threads:
+        print('threaded runner on words.csv (%d cores)' % os.cpu_count())
+        print(format_thread_scaling(thread_scaling(Lexicon.from_csv(DEFAULT_WORDS_PATH), args.threads, cycles=args.cycles)))
+
+    results = run_benchmarks(args.sizes, cycles=args.cycles)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('saved baseline to ' + args.baseline)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(json.dumps(results, indent=2))
+        print('no baseline at %s, run with --save-baseline to create one' % args.baseline)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    rows, regressions = compare(results, baseline, args.tolerance)
+    print(format_comparison(rows, regressions))
+    if regressions:
+        print('%d regression(s) over %d%%' % (len(regressions), round(args.tolerance * 100)))
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
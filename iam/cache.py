@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+from .schedule import Schedule
+
+
+# a content hash of everything that determines the result of a trial: the
+# feature input, every parameter and weight of the model (which covers the
+# lexicon, since the words enter the model through the connectivity and the
+# resting states) and the number of cycles. two trials with the same key
+# always produce the same traces.
+def trial_key(model, stimulus, cycles):
+    digest = hashlib.sha256()
+
+    def add_array(array):
+        array = np.ascontiguousarray(array)
+        digest.update(str((array.shape, array.dtype.str)).encode())
+        digest.update(array.tobytes())
+
+    # a Schedule is hashed segment by segment (a blank segment only adds its
+    # length).
+    if isinstance(stimulus, Schedule):
+        segments = stimulus.segments
+    else:
+        segments = [(cycles, stimulus)]
+    for segment_cycles, segment_stimulus in segments:
+        digest.update(str(segment_cycles).encode())
+        if segment_stimulus is not None:
+            add_array(np.asarray(segment_stimulus[0], dtype=float))
+            add_array(np.asarray(segment_stimulus[1], dtype=float))
+
+    connectivity = model.connectivity
+    scalars = {
+        'decay_rate': model.decay_rate,
+        'max_value': model.max_value,
+        'min_value': model.min_value,
+        'letter_inhibition': model.letter_inhibition,
+        'word_inhibition': model.word_inhibition,
+        'letter_word_excitation': connectivity.letter_word_excitation,
+        'letter_word_inhibition': connectivity.letter_word_inhibition,
+        'word_letter_excitation': connectivity.word_letter_excitation,
+        'word_letter_inhibition': connectivity.word_letter_inhibition,
+        'batch_size': model.batch_size,
+        'prune_margin': model.prune_margin,
+        'cycles': cycles,
+    }
+    # (parameters with one value per trial are listed in full.)
+    scalars = {name: np.asarray(value).tolist() if np.ndim(value) > 0 else value for name, value in scalars.items()}
+    digest.update(json.dumps(scalars, sort_keys=True).encode())
+    add_array(model.w_features)
+    add_array(model.word_resting_state)
+    add_array(connectivity.word_letters)
+
+    return digest.hexdigest()
+
+
+# remembers the traces of trials that have already been run, so that running
+# an identical trial again (e.g. a baseline condition that several
+# experiments share) returns the stored traces instead of simulating.
+# results are kept in memory, up to max_bytes, and the least recently used
+# ones are dropped first. if path is given, every result is also written
+# there, so it can be found again after it has been dropped from memory or by
+# a later process.
+class TrialCache:
+    def __init__(self, max_bytes=256 * 1024 * 1024, path=None):
+        self.max_bytes = max_bytes
+        self.path = path
+        self.entries = OrderedDict()
+        self.size = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    # run a trial through the cache: the same as model.run(stimulus, cycles),
+    # but only simulated if this trial has not been seen before. the returned
+    # traces are shared with the cache, so they are read-only. the stimulus
+    # can be a Schedule, in which case cycles can be left out.
+    def run(self, model, stimulus, cycles=None):
+        key = trial_key(model, stimulus, cycles)
+
+        traces = self.get(key)
+        if traces is None:
+            letter_trace, word_trace = model.run(stimulus, cycles)
+            traces = self.put(key, letter_trace, word_trace)
+
+        return traces
+
+    # the stored traces for a key, or None.
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        if self.path is not None:
+            file = os.path.join(self.path, key + '.npz')
+            if os.path.exists(file):
+                with np.load(file) as data:
+                    traces = self._store(key, data['letter_trace'], data['word_trace'])
+                self.disk_hits += 1
+                return traces
+
+        self.misses += 1
+        return None
+
+    def put(self, key, letter_trace, word_trace):
+        if self.path is not None:
+            # write to a temporary file and rename it, so that other
+            # processes never read a half-written file.
+            fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.npz')
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, letter_trace=letter_trace, word_trace=word_trace)
+            os.replace(tmp, os.path.join(self.path, key + '.npz'))
+
+        return self._store(key, letter_trace, word_trace)
+
+    def _store(self, key, letter_trace, word_trace):
+        letter_trace.flags.writeable = False
+        word_trace.flags.writeable = False
+        traces = (letter_trace, word_trace)
+
+        self.entries[key] = traces
+        self.size += letter_trace.nbytes + word_trace.nbytes
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            _, (old_letter_trace, old_word_trace) = self.entries.popitem(last=False)
+            self.size -= old_letter_trace.nbytes + old_word_trace.nbytes
+            self.evictions += 1
+
+        return traces
+
+    # drop everything held in memory. files on disk are kept.
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    # how well the cache is doing: hits (from memory), disk_hits, misses,
+    # evictions from memory, the number of entries and bytes held in memory,
+    # and the share of lookups that were answered without simulating.
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self.entries),
+            'bytes': self.size,
+            'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,109 @@
+import numpy as np
+
+
+# the visual features of each letter. each row is a letter and each column is
+# one of the 14 line segments used to draw letters in the model: 1 means the
+# letter contains that segment.
+letters = np.array([
+    [1, 1, 1, 0, 1, 0, 1, 1, 0, 1, 0, 0, 0, 0], # A
+    [1, 0, 1, 1, 0, 1, 1, 0, 1, 1, 0, 0, 0, 0], # B
+    [1, 0, 0, 1, 1, 0, 0, 1, 0, 0, 0, 0, 0, 0], # C
+    [1, 0, 0, 1, 0, 1, 1, 0, 1, 1, 0, 0, 0, 0], # D
+    [1, 1, 0, 1, 1, 0, 0, 1, 0, 0, 0, 0, 0, 0], # E
+    [1, 1, 0, 0, 1, 0, 0, 1, 0, 0, 0, 0, 0, 0], # F
+    [1, 0, 1, 1, 1, 0, 0, 1, 0, 1, 0, 0, 0, 0], # G
+    [0, 1, 1, 0, 1, 0, 1, 1, 0, 1, 0, 0, 0, 0], # H
+    [1, 0, 0, 1, 0, 1, 0, 0, 1, 0, 0, 0, 0, 0], # I
+    [0, 0, 0, 1, 0, 0, 1, 1, 0, 1, 0, 0, 0, 0], # J
+    [0, 1, 0, 0, 1, 0, 0, 1, 0, 0, 0, 1, 0, 1], # K
+    [0, 0, 0, 1, 1, 0, 0, 1, 0, 0, 0, 0, 0, 0], # L
+    [0, 0, 0, 0, 1, 0, 1, 1, 0, 1, 1, 1, 0, 0], # M
+    [0, 0, 0, 0, 1, 0, 1, 1, 0, 1, 1, 0, 0, 1], # N
+    [1, 0, 0, 1, 1, 0, 1, 1, 0, 1, 0, 0, 0, 0], # O
+    [1, 1, 1, 0, 1, 0, 1, 1, 0, 0, 0, 0, 0, 0], # P
+    [1, 0, 0, 1, 1, 0, 1, 1, 0, 1, 0, 0, 0, 1], # Q
+    [1, 1, 1, 0, 1, 0, 1, 1, 0, 0, 0, 0, 0, 1], # R
+    [1, 1, 1, 1, 1, 0, 0, 0, 0, 1, 0, 0, 0, 0], # S
+    [1, 0, 0, 0, 0, 1, 0, 0, 1, 0, 0, 0, 0, 0], # T
+    [0, 0, 0, 1, 1, 0, 1, 1, 0, 1, 0, 0, 0, 0], # U
+    [0, 0, 0, 0, 1, 0, 0, 1, 0, 0, 0, 1, 1, 0], # V
+    [0, 0, 0, 0, 1, 0, 1, 1, 0, 1, 0, 0, 1, 1], # W
+    [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1], # X
+    [0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 1, 1, 0, 0], # Y
+    [1, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 1, 1, 0]  # Z
+])
+
+# the default mask: the features of O and X drawn on top of each other, shown
+# after the stimulus in masking experiments (the same as the mask in
+# model-config.json). MASK_START is the cycle on which it replaces the
+# stimulus by default.
+MASK = np.array([1, 0, 0, 1, 1, 0, 1, 1, 0, 1, 1, 1, 1, 1])
+MASK_START = 20
+
+alphabet = 'abcdefghijklmnopqrstuvwxyz'
+letter_to_index = {letter: index for index, letter in enumerate(alphabet)}
+
+FEATURE_LETTER_EXCITATION = 0.005
+FEATURE_LETTER_INHIBITION = 0.15
+
+LETTER_WORD_EXCITATION = 0.07
+LETTER_WORD_INHIBITION = 0.04
+
+WORD_LETTER_EXCITATION = 0.3
+WORD_LETTER_INHIBITION = 0.0 # None in the initial models in the paper
+
+WORD_WORD_INHIBITION = 0.21
+LETTER_LETTER_INHIBITION = 0.0
+
+MIN_ACTIVATION = -0.2
+DECAY_RATE = 0.07
+
+# we use this value to scale the resting states. the resting data is in the range
+# 0 to -1. we multiply those values by this gain factor to get the resting state.
+# making this larger will increase the impact that word frequency has in the model.
+REST_GAIN = 0.05
+
+# all of the constants above, by name. functions that build or run the model
+# take a dictionary of overrides keyed by these same names (e.g.
+# {"DECAY_RATE": 0.05}) and fill in everything else from here.
+DEFAULT_PARAMETERS = {
+    "FEATURE_LETTER_EXCITATION": FEATURE_LETTER_EXCITATION,
+    "FEATURE_LETTER_INHIBITION": FEATURE_LETTER_INHIBITION,
+    "LETTER_WORD_EXCITATION": LETTER_WORD_EXCITATION,
+    "LETTER_WORD_INHIBITION": LETTER_WORD_INHIBITION,
+    "WORD_LETTER_EXCITATION": WORD_LETTER_EXCITATION,
+    "WORD_LETTER_INHIBITION": WORD_LETTER_INHIBITION,
+    "WORD_WORD_INHIBITION": WORD_WORD_INHIBITION,
+    "LETTER_LETTER_INHIBITION": LETTER_LETTER_INHIBITION,
+    "MIN_ACTIVATION": MIN_ACTIVATION,
+    "DECAY_RATE": DECAY_RATE,
+    "REST_GAIN": REST_GAIN,
+}
+
+
+# fill in any parameters that aren't given with their default values. this
+# also catches typos in parameter names, which would otherwise be silently
+# ignored.
+def resolve_parameters(params=None):
+    resolved = dict(DEFAULT_PARAMETERS)
+    if params is None:
+        return resolved
+
+    for name, value in params.items():
+        if name not in DEFAULT_PARAMETERS:
+            raise ValueError("unknown parameter: " + name)
+        resolved[name] = value
+
+    return resolved
+
+
+# the number of parameter sets in params: any parameter can be given as a
+# list or array with one value per trial of a batch instead of a single
+# number (see compile_weights), e.g. to run many candidate parameter sets at
+# once. returns None when every parameter is a single number.
+def parameter_batch_size(params):
+    sizes = {len(value) for value in params.values() if np.ndim(value) > 0}
+    if len(sizes) > 1:
+        raise ValueError("parameters with one value per trial must all have the same length")
+
+    return sizes.pop() if sizes else None
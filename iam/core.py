@@ -0,0 +1,433 @@
+import numpy as np
+
+from . import profiling
+
+
+# a parameter that can take a different value in every trial of a batch. a
+# single number is returned as it is. an array with one value per trial is
+# reshaped so that it broadcasts against states with unit_dims axes of units
+# after the batch axis: 1 for a pool or the word layer, 2 for the
+# (positions, 26) letter layer.
+def per_trial(value, unit_dims=1, dtype=None):
+    if np.ndim(value) == 0:
+        return value
+
+    return np.asarray(value, dtype=dtype).reshape((-1,) + (1,) * unit_dims)
+
+
+def compute_net_input(list_of_inputs, list_of_excitatory_weights, inhibition_strength, current_activation, sparse_density=None):
+    # current_activation is either a single state vector of length num_units or
+    # a (batch_size, num_units) matrix holding one state vector per trial. the
+    # inputs follow the same rule, so np.dot below does one matrix-matrix
+    # product per weight set for the whole batch. an input without a batch
+    # dimension (e.g. a stimulus shared by every trial) is simply broadcast.
+    # everything is computed in the dtype of current_activation (float64
+    # normally, or float32 to halve the memory traffic), so the inputs are
+    # converted to it as they are clipped.
+
+    # create a variable to store the total input signal.
+    # we need this because we may have multiple different inputs (bottom-up
+    # & top-down) to this layer, so we have to get the total input
+    # across all of them
+    input_signal = np.zeros(np.shape(current_activation), dtype=np.result_type(current_activation))
+
+    # loop through each input...
+    for i in range(len(list_of_inputs)):
+        # if any of the incoming signals are negative, we use this function
+        # to set them to 0. this reflects the fact that nodes with <=0 activation
+        # are considered inactive in this simulation.
+        clipped_input = np.clip(np.asarray(list_of_inputs[i], dtype=input_signal.dtype), 0, None)
+
+        # calculate the contribution to the input_signal from this input, using
+        # the weights that correspond to this input. with a sparse_density
+        # the inputs that are mostly 0 only use the rows of the weights for
+        # the units that are above 0 (see propagate). weights with a leading
+        # batch dimension give every trial its own weights (one
+        # matrix-vector product per trial).
+        if np.ndim(list_of_excitatory_weights[i]) == 3:
+            input_signal += np.matmul(clipped_input[..., np.newaxis, :], list_of_excitatory_weights[i])[..., 0, :]
+        elif sparse_density is None:
+            input_signal += np.dot(clipped_input, list_of_excitatory_weights[i])
+        else:
+            input_signal += propagate(clipped_input, list_of_excitatory_weights[i], sparse_density)
+
+    # when there is no inhibition in this layer (e.g. the letter pools) there
+    # is nothing left to add, so we can skip the rest of the work entirely.
+    if np.all(np.equal(inhibition_strength, 0)):
+        return input_signal
+
+    # the input is all of the inputs to the layer plus the layer's own
+    # inhibition. total_input has the same shape as current_activation.
+    total_input = input_signal + compute_inhibition(inhibition_strength, current_activation)
+
+    return total_input
+
+
+# the product of a clipped input with its weights. when less than
+# sparse_density of the input units are above 0 (in any trial of a batch),
+# only those units and their rows of the weights are used: after clipping
+# most of the word layer is exactly 0, so this skips most of the work.
+# otherwise it is the same np.dot as without a sparse_density. the units that
+# are left out would only have added 0, but the BLAS library adds up the
+# rest in an order of its own, so the sparse way can differ from the full
+# product in the last bits: by a few times the machine epsilon of the dtype
+# times the sum of the sizes of the terms (|input| . |weights|).
+def propagate(clipped_input, weights, sparse_density, out=None):
+    num_units = clipped_input.shape[-1]
+    if clipped_input.ndim > 1:
+        active = np.flatnonzero(np.any(clipped_input.reshape(-1, num_units), axis=0))
+    else:
+        active = np.flatnonzero(clipped_input)
+
+    if len(active) < sparse_density * num_units:
+        return np.dot(clipped_input[..., active], weights[active], out=out)
+
+    return np.dot(clipped_input, weights, out=out)
+
+
+# the inhibitory input each node gets from the rest of the nodes in its
+# layer. if out is given the result is written into it, using total (an
+# array with the shape of current_activation minus its last axis, plus a
+# trailing axis of 1) and spread (an array with the shape of
+# current_activation) as scratch space, so that nothing is allocated.
+def compute_inhibition(inhibition_strength, current_activation, out=None, total=None, spread=None):
+    if out is not None:
+        np.clip(current_activation, 0, None, out=out)
+        np.sum(out, axis=-1, keepdims=True, out=total)
+        # subtracting the (batch_size, 1) totals from out directly would make
+        # numpy allocate a buffer for the broadcast on every call, so they
+        # are copied out to every unit first. (clipped - total) * strength
+        # is exactly -strength * (total - clipped), as below.
+        np.copyto(spread, total)
+        np.subtract(out, spread, out=out)
+        np.multiply(out, inhibition_strength, out=out)
+
+        return out
+
+    # the same rule about signals <= 0 applies here, so we start by creating
+    # a clipped version of the state of this layer.
+    clipped_state = np.clip(current_activation, 0, None)
+
+    # every node inhibits every other node (but not itself) by the same amount,
+    # so instead of building a num_units x num_units weight matrix we can take
+    # the sum of all the positive activations and subtract each node's own
+    # contribution. this gives the same answer as the full matrix product but
+    # only needs O(num_units) time and memory.
+    # the sum is taken along the last axis so that each trial in a batch only
+    # inhibits itself.
+    return -inhibition_strength * (np.sum(clipped_state, axis=-1, keepdims=True) - clipped_state)
+
+
+# if out is given the result is written into it, using mask (a boolean array
+# with the same shape) as scratch space, so that nothing is allocated.
+def compute_effect(net_input, current_activation, min_value, max_value, out=None, mask=None):
+    if out is not None:
+        # the same two formulas as below, but instead of adding two masked
+        # arrays we start from (max_value - current_activation) everywhere and
+        # overwrite it with (current_activation - min_value) where the
+        # net_input is <= 0, then multiply by the net_input.
+        np.less_equal(net_input, 0, out=mask)
+        np.subtract(max_value, current_activation, out=out)
+        np.subtract(current_activation, min_value, out=out, where=mask)
+        np.multiply(out, net_input, out=out)
+
+        return out
+
+    # this next step is basically the activation function.
+    # the idea is to scale the input activation so that if we are close
+    # to the maximum or minimum value of the neuron then the activation is
+    # lessend. the difficult part of this step is that we have two different
+    # forumlas to follow: one when the input signal for a node is positive
+    # and one when it is negative.
+    # this is a tricky way to do this: basically we create two arrays and add
+    # them together. one of the arrays follows the rule for positive
+    # net_input and the other follows the rule for negative net_input.
+    # we use the `net_input > 0` to create a "mask" - this will produce an
+    # array with 1s in all of the spots that net_input > 0, and 0s
+    # everywhere else. by multiplying the computed values times this mask,
+    # we zero out everything that doesn't match. then we add this to the
+    # other array, which has the opposite mask.
+    input_activity = (
+        ((net_input > 0) * (net_input) * (max_value - current_activation)) +
+        ((net_input <= 0) * (net_input) * (current_activation - min_value))
+    )
+
+    return input_activity
+
+
+# if out is given the result is written into it. out must not be
+# current_activation itself, since that is still needed while out is being
+# filled in (see IAPool's double-buffered state).
+def compute_activation(effect, current_activation, decay_rate, resting_state, min_value, max_value, out=None):
+    if out is not None:
+        # the same steps as below, in the same order, with out holding the
+        # decay and then the new activation.
+        np.subtract(current_activation, resting_state, out=out)
+        np.multiply(decay_rate, out, out=out)
+        np.subtract(current_activation, out, out=out)
+        np.add(out, effect, out=out)
+        np.clip(out, min_value, max_value, out=out)
+
+        return out
+
+    # we can compute the amount of decay in the state following
+    # the formula given in the paper. this formula creates more decay when
+    # we are further from the resting_state.
+    decay = decay_rate * (current_activation - resting_state)
+
+    # update the state by subtracting the decay and adding the input_activity
+    activation = current_activation - decay + effect
+
+    # make sure the state does not exceed the min and max values.
+    activation = np.clip(activation, min_value, max_value)
+
+    return activation
+
+
+# one cycle of a pool as a pure function: the state after state, given the
+# inputs (one per weight array, as for IAPool.step), the parameters of the
+# pool (a dictionary with decay_rate, resting_state, max_value, min_value,
+# inhibition_strength and sparse_density, see IAPool.parameters()) and the
+# weights. nothing is changed, neither the state nor the parameters and
+# weights, so any number of threads can step their own states with the same
+# parameters and weights at once. IAPool.step() is this applied to the
+# pool's own state.
+def pool_step(state, inputs, params, weights):
+    net_input = compute_net_input(inputs, weights, params['inhibition_strength'], state, params['sparse_density'])
+    effect = compute_effect(net_input, state, params['min_value'], params['max_value'])
+
+    return compute_activation(effect, state, params['decay_rate'], params['resting_state'], params['min_value'], params['max_value'])
+
+
+class IAPool:
+    # the __init__ function is a special python constructor function. it is what is
+    # called when you create a new instance of a class
+    def __init__(self, size, weights=None, decay_rate=0.1, resting_state=0.0, max_value=1.0, min_value = -1.0, inhibition_strength=1.0, batch_size=None, name="IAPool", in_place=False, dtype=np.float64, sparse_density=None):
+        # the number of units in this layer/pool
+        self.size = size
+
+        # the name this pool is reported under when profiling
+        self.name = name
+
+        # the floating point type of the state and of all the computations.
+        # float32 halves the memory needed for the weights and the state
+        # (see iam.precision for checking that it gives the same results).
+        self.dtype = np.dtype(dtype)
+
+        # the number of independent trials this pool runs at once. None means
+        # the pool holds a single state vector, which is how the model has
+        # always been run. with a batch_size the state is a
+        # (batch_size, size) matrix and the inputs given to .step() can carry
+        # the same leading batch dimension.
+        self.batch_size = batch_size
+
+        # decay_rate, max_value, min_value and inhibition_strength are either
+        # a single number, or (in a batched pool) an array with one value per
+        # trial, e.g. to run many candidate parameter sets at once. per-trial
+        # values are kept as a (batch_size, 1) column (see per_trial).
+        for name, value in [('decay_rate', decay_rate), ('max_value', max_value), ('min_value', min_value), ('inhibition_strength', inhibition_strength)]:
+            if np.ndim(value) > 0 and (batch_size is None or len(value) != batch_size):
+                raise ValueError("%s must be a single number or have one value per trial" % name)
+
+        # the rate of decay back to the resting state
+        self.decay_rate = per_trial(decay_rate, 1, self.dtype)
+
+        # the maximum possible activation
+        self.max_value = per_trial(max_value, 1, self.dtype)
+
+        # the minimum possible activation
+        self.min_value = per_trial(min_value, 1, self.dtype)
+
+        # the self-inhibition strength between all nodes in this pool
+        self.inhibition_strength = per_trial(inhibition_strength, 1, self.dtype)
+
+        # a list of weights. the weights are given as a list to allow
+        # for inputs from more than one pool. when .step() is called
+        # the inputs will be a list with the same number of items in this list.
+        # therefore the order of the weights should be the same as the order
+        # of the inputs in .step(). each weight array is converted to a
+        # C-contiguous array of dtype (this is not a copy when it already is
+        # one), since transposed or Fortran-ordered weights make every
+        # product slower. in a batched
+        # pool a weight array can also have shape (batch_size, inputs, size),
+        # one weight matrix per trial.
+        if weights is not None:
+            weights = [np.ascontiguousarray(w, dtype=self.dtype) for w in weights]
+        self.weights = weights
+
+        # the resting state for each node. if a single number is given
+        # the value is used for all nodes. if an array is given the
+        # resting state can be customized per node (shape (size,)) or per
+        # trial and node (shape (batch_size, size)).
+        if isinstance(resting_state, float):
+            self.resting_state = np.full(size, resting_state, dtype=self.dtype)
+        else:
+            self.resting_state = np.asarray(resting_state, dtype=self.dtype)
+
+        # with a sparse_density, inputs that have less than this fraction of
+        # their units above 0 are propagated using only those units (see
+        # propagate). the sparse way can differ in the last bits from the
+        # full np.dot product.
+        # (the sparse way picks out the rows it needs, so with in_place=True
+        # those steps are not allocation-free.)
+        self.sparse_density = sparse_density
+
+        # with in_place=True, .step() works entirely in buffers that are
+        # allocated once: the work arrays for each phase, and two state
+        # arrays that take turns being the current and the next state. each
+        # step writes the next state into the buffer that isn't current and
+        # then swaps them, so the previous state stays untouched until the
+        # step after. this means the state of every pool can be read at the
+        # start of a cycle and passed to the other pools' .step() without
+        # copying it first. (it will be overwritten two steps later, so copy
+        # it if you need to keep it.)
+        self.in_place = in_place
+        self._next_state = None
+        self._work = None
+
+        # initializing the state of the network to be the resting state.
+        self.state = self.initial_state()
+
+    # the state the pool starts from: a copy of the resting state (repeated
+    # once per trial when the pool is batched). it is a copy so that updating
+    # the state can never change the resting state.
+    def initial_state(self):
+        if self.batch_size is None:
+            return np.array(self.resting_state, dtype=self.dtype)
+
+        return np.broadcast_to(self.resting_state, (self.batch_size, self.size)).astype(self.dtype, order='C')
+
+    # this resets the layer to its initial state
+    def reset(self):
+        if self.in_place and self.state is not None:
+            self.state[...] = self.resting_state
+        else:
+            self.state = self.initial_state()
+
+    # the parameters of the pool as a dictionary, for pool_step.
+    def parameters(self):
+        return {
+            'decay_rate': self.decay_rate,
+            'resting_state': self.resting_state,
+            'max_value': self.max_value,
+            'min_value': self.min_value,
+            'inhibition_strength': self.inhibition_strength,
+            'sparse_density': self.sparse_density,
+        }
+
+    def compute_net_input(self, inputs):
+
+        return compute_net_input(inputs, self.weights, self.inhibition_strength, self.state, self.sparse_density)
+
+    def compute_effect(self, net_input):
+
+        return compute_effect(net_input, self.state, self.min_value, self.max_value)
+
+    def compute_activation(self, effect):
+
+        return compute_activation(effect, self.state, self.decay_rate, self.resting_state, self.min_value, self.max_value)
+
+    # the step function takes a set of inputs, applies the rules for updating
+    # the state of the network (see pool_step), and stores the resulting
+    # state.
+    def step(self, inputs):
+        # these two if() statements just check to make sure that the weights
+        # and inputs have the right kind of shape before trying to compute
+        # the signal
+        if(self.weights is None):
+            raise ValueError("weights cannot be None")
+        if(len(inputs) != len(self.weights)):
+            raise ValueError("inputs must have the same number of top-level items as weights")
+
+        # when a profiler is running, take the instrumented path instead.
+        if profiling.active is not None:
+            return self._profiled_step(inputs, profiling.active)
+
+        if self.in_place:
+            return self._step_in_place(inputs)
+
+        self.state = pool_step(self.state, inputs, self.parameters(), self.weights)
+
+        return self.state
+
+    # the work buffers for a set of inputs. they are made the first time the
+    # pool is stepped (and again only if the shapes of the inputs change).
+    def _work_buffers(self, inputs):
+        shapes = [np.shape(input) for input in inputs]
+        if self._work is not None and self._work['shapes'] == shapes:
+            return self._work
+
+        state_shape = self.state.shape
+        self._work = {
+            'shapes': shapes,
+            'clipped': [np.empty(shape, dtype=self.dtype) for shape in shapes],
+            'products': [np.empty(np.shape(input)[:-1] + (self.size,), dtype=self.dtype) for input in inputs],
+            'net_input': np.empty(state_shape, dtype=self.dtype),
+            'inhibition': np.empty(state_shape, dtype=self.dtype),
+            'total': np.empty(state_shape[:-1] + (1,), dtype=self.dtype),
+            'spread': np.empty(state_shape, dtype=self.dtype),
+            'effect': np.empty(state_shape, dtype=self.dtype),
+            'mask': np.empty(state_shape, dtype=bool),
+            # numpy allocates a buffer whenever it broadcasts a per-node
+            # resting state, or a per-trial parameter, against a batched
+            # state, so those are broadcast once here.
+            'resting_state': np.broadcast_to(self.resting_state, state_shape).copy(),
+        }
+        for name in ('decay_rate', 'max_value', 'min_value', 'inhibition_strength'):
+            value = getattr(self, name)
+            self._work[name] = value if np.ndim(value) == 0 else np.broadcast_to(value, state_shape).copy()
+        self._work['inhibits'] = bool(np.any(np.not_equal(self.inhibition_strength, 0)))
+        self._next_state = np.empty(state_shape, dtype=self.dtype)
+
+        return self._work
+
+    # step() with in_place=True: the same computation as compute_net_input,
+    # compute_effect and compute_activation, done with out= operations in
+    # preallocated buffers.
+    def _step_in_place(self, inputs):
+        work = self._work_buffers(inputs)
+        net_input = work['net_input']
+
+        for i in range(len(inputs)):
+            np.clip(inputs[i], 0, None, out=work['clipped'][i])
+            if self.weights[i].ndim == 3:
+                np.matmul(work['clipped'][i][:, np.newaxis, :], self.weights[i], out=work['products'][i][:, np.newaxis, :])
+            elif self.sparse_density is None:
+                np.dot(work['clipped'][i], self.weights[i], out=work['products'][i])
+            else:
+                propagate(work['clipped'][i], self.weights[i], self.sparse_density, out=work['products'][i])
+            if i == 0:
+                np.copyto(net_input, work['products'][i])
+            else:
+                np.add(net_input, work['products'][i], out=net_input)
+
+        if work['inhibits']:
+            compute_inhibition(work['inhibition_strength'], self.state, out=work['inhibition'], total=work['total'], spread=work['spread'])
+            np.add(net_input, work['inhibition'], out=net_input)
+
+        effect = compute_effect(net_input, self.state, work['min_value'], work['max_value'], out=work['effect'], mask=work['mask'])
+        compute_activation(effect, self.state, work['decay_rate'], work['resting_state'], work['min_value'], work['max_value'], out=self._next_state)
+
+        self.state, self._next_state = self._next_state, self.state
+
+        return self.state
+
+    # the same as step(), but timing each phase separately: the excitatory
+    # inputs, the lateral inhibition, compute_effect and compute_activation.
+    def _profiled_step(self, inputs, profiler):
+        token = profiler.begin_step()
+
+        t = profiler.now()
+        net_input = compute_net_input(inputs, self.weights, 0, self.state, self.sparse_density)
+        t = profiler.lap(self.name, 'input', t)
+        if np.any(np.not_equal(self.inhibition_strength, 0)):
+            net_input = net_input + compute_inhibition(self.inhibition_strength, self.state)
+            t = profiler.lap(self.name, 'inhibition', t)
+        effect = self.compute_effect(net_input)
+        t = profiler.lap(self.name, 'effect', t)
+        self.state = self.compute_activation(effect)
+        profiler.lap(self.name, 'activation', t)
+
+        profiler.end_step(token, self.name, [(self.name, self.state)])
+
+        return self.state
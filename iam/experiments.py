@@ -0,0 +1,131 @@
+import numpy as np
+
+from .lexicon import DEFAULT_WORDS_PATH
+from .model import load_model
+from .stimulus import word_stimulus
+
+
+# every single-feature-degraded variant of a set of stimuli. for each feature
+# that is present in a letter, a variant is made in which that feature is
+# unknown: it is neither present nor absent, like the ambiguous R/K in the
+# reference demo. returns the variant inputs together with, for each variant,
+# the stimulus it came from and the (position, feature) that was degraded.
+def degraded_variants(input_present, input_absence):
+    source, position, feature = np.nonzero(input_present)
+
+    degraded_present = input_present[source].copy()
+    degraded_absence = input_absence[source].copy()
+    variant = np.arange(len(source))
+    degraded_present[variant, position, feature] = 0
+    degraded_absence[variant, position, feature] = 0
+
+    return degraded_present, degraded_absence, source, np.stack([position, feature], axis=-1)
+
+
+# the results of recognition_sweep, one entry per trial:
+#   sources[t]: index of the word that was presented.
+#   degraded[t]: the (position, feature) that was degraded, or (-1, -1) for
+#     the intact word.
+#   winners[t]: index of the most active word when the trial ended.
+#   latencies[t]: the cycle on which a word reached the threshold, or the
+#     number of cycles if none did.
+#   recognized[t]: whether a word reached the threshold.
+#   margins[t]: how far the winner was ahead of the runner-up at the end.
+class RecognitionResult:
+    def __init__(self, words, sources, degraded, winners, latencies, recognized, margins):
+        self.words = words
+        self.sources = sources
+        self.degraded = degraded
+        self.winners = winners
+        self.latencies = latencies
+        self.recognized = recognized
+        self.margins = margins
+
+    # the confusions as (presented, winner, count) arrays: how often each
+    # presented word ended with each winning word. only the pairs that
+    # actually happened are listed, so this stays small for any lexicon size.
+    def confusions(self):
+        pairs, counts = np.unique(np.stack([self.sources, self.winners], axis=-1), axis=0, return_counts=True)
+
+        return pairs[:, 0], pairs[:, 1], counts
+
+    # the confusions as a sparse num_words x num_words scipy matrix, with the
+    # presented words as rows and the winning words as columns.
+    def confusion_matrix(self):
+        try:
+            from scipy import sparse
+        except ImportError:
+            raise ImportError("confusion_matrix() needs scipy, use confusions() instead") from None
+
+        presented, winners, counts = self.confusions()
+
+        return sparse.csr_matrix((counts, (presented, winners)), shape=(len(self.words), len(self.words)))
+
+    # the latency of each word when it is presented intact.
+    def word_latencies(self):
+        intact = self.degraded[:, 0] < 0
+        latencies = np.zeros(len(self.words), dtype=self.latencies.dtype)
+        latencies[self.sources[intact]] = self.latencies[intact]
+
+        return latencies
+
+    # the share of trials that ended with the presented word as the winner.
+    def accuracy(self):
+        return np.mean(self.winners == self.sources)
+
+    # one row per trial.
+    def to_dataframe(self):
+        import pandas as pd
+
+        words = np.array(self.words, dtype=object)
+
+        return pd.DataFrame({
+            'word': words[self.sources],
+            'degraded_position': self.degraded[:, 0],
+            'degraded_feature': self.degraded[:, 1],
+            'winner': words[self.winners],
+            'latency': self.latencies,
+            'recognized': self.recognized,
+            'margin': self.margins,
+        })
+
+
+# present every word in the lexicon to the model and record which word wins,
+# when, and by what margin. with degraded=True every single-feature-degraded
+# variant of every word is presented as well. this is the main check of a
+# lexicon and parameter set: ideally every word is recognized as itself.
+# trials are run batch_size at a time and stop as soon as a word reaches the
+# threshold (see IAModel.run_until). dtype is the floating point type the
+# model computes in.
+def recognition_sweep(params=None, cycles=40, threshold=0.7, degraded=False, batch_size=512, words_path=DEFAULT_WORDS_PATH, dtype=np.float64):
+    model = load_model(params, words_path, dtype=dtype)
+    lexicon = model.lexicon
+
+    input_present, input_absence = word_stimulus(lexicon.words)
+    sources = np.arange(len(lexicon))
+    degraded_features = np.full((len(lexicon), 2), -1)
+
+    if degraded:
+        degraded_present, degraded_absence, degraded_sources, degraded_positions = degraded_variants(input_present, input_absence)
+        input_present = np.concatenate([input_present, degraded_present])
+        input_absence = np.concatenate([input_absence, degraded_absence])
+        sources = np.concatenate([sources, degraded_sources])
+        degraded_features = np.concatenate([degraded_features, degraded_positions])
+
+    num_trials = len(sources)
+    winners = np.zeros(num_trials, dtype=np.intp)
+    latencies = np.zeros(num_trials, dtype=int)
+    recognized = np.zeros(num_trials, dtype=bool)
+    margins = np.zeros(num_trials)
+
+    for start in range(0, num_trials, batch_size):
+        stop = min(start + batch_size, num_trials)
+        batch = model.with_batch_size(stop - start)
+        stimulus = (input_present[start:stop], input_absence[start:stop])
+        latencies[start:stop], recognized[start:stop] = batch.run_until(stimulus, cycles, threshold=threshold)
+
+        top_two = np.partition(batch.word_state, -2, axis=-1)[:, -2:]
+        winners[start:stop] = np.argmax(batch.word_state, axis=-1)
+        margins[start:stop] = top_two[:, 1] - top_two[:, 0]
+
+    return RecognitionResult(lexicon.words, sources, degraded_features, winners, latencies, recognized, margins)
@@ -0,0 +1,158 @@
+import numpy as np
+
+from .constants import resolve_parameters
+from .lexicon import DEFAULT_WORDS_PATH, Lexicon
+from .model import IAModel
+from .stimulus import word_stimulus
+from .weights import compile_weights
+
+
+# the results of fit_parameters, one entry per candidate parameter set:
+#   scores[c]: how far the candidate is from the data (lower is better):
+#     the mean squared error of the traces plus that of the latencies.
+#   latencies[c, s]: the cycle on which the target of stimulus s reached the
+#     threshold, counting from 1, or cycles + 1 if it never did.
+#   target_activations[c, s, t]: the activation of the target of stimulus s
+#     after cycle t.
+#   latency_fits[c]: the (intercept, slope) that map the candidate's
+#     latencies onto the target latencies, when they are scaled.
+class FitResult:
+    def __init__(self, candidates, stimuli, scores, latencies, target_activations, latency_fits=None):
+        self.candidates = candidates
+        self.stimuli = stimuli
+        self.scores = scores
+        self.latencies = latencies
+        self.target_activations = target_activations
+        self.latency_fits = latency_fits
+
+    # the candidates from best to worst.
+    def ranking(self):
+        return np.argsort(self.scores, kind='stable')
+
+    # the full parameters of the best candidate.
+    def best(self):
+        return resolve_parameters(self.candidates[self.ranking()[0]])
+
+    # one row per candidate, with a column for every parameter that was
+    # varied.
+    def to_dataframe(self):
+        import pandas as pd
+
+        names = sorted({name for candidate in self.candidates for name in candidate})
+        resolved = [resolve_parameters(candidate) for candidate in self.candidates]
+
+        columns = {name: [params[name] for params in resolved] for name in names}
+        columns['score'] = self.scores
+        columns['mean_latency'] = np.mean(self.latencies, axis=-1)
+        if self.latency_fits is not None:
+            columns['latency_intercept'] = self.latency_fits[:, 0]
+            columns['latency_slope'] = self.latency_fits[:, 1]
+
+        return pd.DataFrame(columns)
+
+    # a plain text table of the best candidates.
+    def summary(self, top=5):
+        names = sorted({name for candidate in self.candidates for name in candidate})
+        resolved = [resolve_parameters(candidate) for candidate in self.candidates]
+
+        lines = ['%-6s %12s ' % ('rank', 'score') + ' '.join('%26s' % name for name in names)]
+        for rank, index in enumerate(self.ranking()[:top]):
+            lines.append('%-6d %12.4g ' % (rank + 1, self.scores[index]) + ' '.join('%26.4g' % resolved[index][name] for name in names))
+
+        return '\n'.join(lines)
+
+
+# score many candidate parameter sets against behavioral data in one
+# vectorized run: every candidate is run on every stimulus as one big batch,
+# each trial with its own parameters (see compile_weights), instead of
+# building and running a model per candidate.
+#   candidates: a list of parameter dictionaries (see parameter_grid).
+#   stimuli: a list of words, or a (input_present, input_absence) pair of
+#     (num_stimuli, positions, 14) arrays together with targets.
+#   targets: the word each stimulus is expected to activate. defaults to the
+#     stimuli themselves when they are words.
+#   target_traces: the activation of each stimulus' target that the model
+#     should produce after each cycle, as a (num_stimuli, cycles) array (or
+#     (cycles,) for the same trace for every stimulus).
+#   target_latencies: the observed latency of each stimulus (e.g. mean
+#     reaction times), as an array of num_stimuli values. a candidate's
+#     latency is the cycle on which the target reaches threshold. with
+#     scale_latencies the latencies are compared after the best linear map
+#     from cycles to the units of target_latencies (e.g. milliseconds),
+#     found separately for every candidate.
+#   batch_size: at most this many trials (candidates x stimuli) are run at
+#     once.
+# at least one of target_traces and target_latencies must be given.
+def fit_parameters(candidates, stimuli, cycles, targets=None, target_traces=None, target_latencies=None, threshold=0.7, scale_latencies=True, words_path=DEFAULT_WORDS_PATH, batch_size=256, dtype=np.float64):
+    if target_traces is None and target_latencies is None:
+        raise ValueError("at least one of target_traces and target_latencies must be given")
+
+    candidates = [dict(candidate) for candidate in candidates]
+    for candidate in candidates:
+        resolve_parameters(candidate)
+
+    lexicon = Lexicon.from_csv(words_path)
+    if isinstance(stimuli, tuple):
+        input_present, input_absence = stimuli
+        stimulus_names = list(range(len(input_present)))
+    else:
+        input_present, input_absence = word_stimulus(list(stimuli))
+        stimulus_names = list(stimuli)
+        if targets is None:
+            targets = stimulus_names
+    if targets is None:
+        raise ValueError("targets must be given for stimuli that are not words")
+    target_indices = lexicon.indices(list(targets))
+
+    num_stimuli = len(input_present)
+    names = sorted({name for candidate in candidates for name in candidate})
+    resolved = [resolve_parameters(candidate) for candidate in candidates]
+
+    target_activations = np.zeros((len(candidates), num_stimuli, cycles))
+
+    # the candidates are run a chunk at a time, with every stimulus.
+    chunk = max(1, batch_size // num_stimuli)
+    for start in range(0, len(candidates), chunk):
+        stop = min(start + chunk, len(candidates))
+        params = {name: np.repeat([params[name] for params in resolved[start:stop]], num_stimuli) for name in names}
+        model = IAModel.from_weights(compile_weights(lexicon, params, dtype), batch_size=(stop - start) * num_stimuli)
+
+        stimulus = (np.tile(input_present, (stop - start, 1, 1)), np.tile(input_absence, (stop - start, 1, 1)))
+        trial_targets = np.tile(target_indices, stop - start)
+        trials = np.arange(len(trial_targets))
+
+        activations = np.zeros((len(trials), cycles))
+        feature_input = model.feature_input(*stimulus)
+        model.reset()
+        for i in range(cycles):
+            model.step_from_input(feature_input)
+            activations[:, i] = model.word_state[trials, trial_targets]
+
+        target_activations[start:stop] = activations.reshape(stop - start, num_stimuli, cycles)
+
+    reached = target_activations >= threshold
+    latencies = np.where(np.any(reached, axis=-1), np.argmax(reached, axis=-1) + 1, cycles + 1)
+
+    scores = np.zeros(len(candidates))
+    if target_traces is not None:
+        target_traces = np.broadcast_to(target_traces, (num_stimuli, cycles))
+        scores += np.mean((target_activations - target_traces) ** 2, axis=(-2, -1))
+
+    latency_fits = None
+    if target_latencies is not None:
+        target_latencies = np.asarray(target_latencies, dtype=float)
+        predicted = latencies.astype(float)
+        if scale_latencies:
+            # the least squares intercept and slope for every candidate at
+            # once. a candidate whose latencies are all the same can only
+            # match the mean.
+            mean_latency = np.mean(predicted, axis=-1, keepdims=True)
+            centered = predicted - mean_latency
+            variance = np.sum(centered ** 2, axis=-1)
+            slopes = np.divide(centered @ (target_latencies - np.mean(target_latencies)), variance, out=np.zeros(len(candidates)), where=variance > 0)
+            intercepts = np.mean(target_latencies) - slopes * mean_latency[:, 0]
+            latency_fits = np.stack([intercepts, slopes], axis=-1)
+            predicted = intercepts[:, np.newaxis] + slopes[:, np.newaxis] * predicted
+        scores += np.mean((predicted - target_latencies) ** 2, axis=-1)
+
+    return FitResult(candidates, stimulus_names, scores, latencies, target_activations, latency_fits)
@@ -0,0 +1,276 @@
+import numpy as np
+
+from .constants import parameter_batch_size, resolve_parameters
+from .core import compute_activation, compute_effect, compute_inhibition
+from .lexicon import DEFAULT_WORDS_PATH, Lexicon, read_words
+from .stimulus import word_stimulus
+from .weights import LexiconConnectivity, compile_feature_weights
+
+
+# a lexicon of words of different lengths (e.g. 2 to 10 letters), kept as
+# one Lexicon per length (its bucket) instead of padding every word to the
+# longest length. buckets[length] is the Lexicon of the words with that many
+# letters, in the order they were given.
+class MixedLexicon:
+    def __init__(self, words, frequencies):
+        words = list(words)
+        frequencies = np.asarray(frequencies, dtype=float)
+        if len(frequencies) != len(words):
+            raise ValueError("words and frequencies must have the same length")
+
+        lengths = np.array([len(word) for word in words])
+        self.buckets = {}
+        for length in np.unique(lengths).tolist():
+            members = np.flatnonzero(lengths == length)
+            self.buckets[length] = Lexicon([words[i] for i in members], frequencies[members])
+
+    # read the lexicon from a csv file, see read_words.
+    @classmethod
+    def from_csv(cls, path=DEFAULT_WORDS_PATH):
+        return cls(*read_words(path))
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.buckets.values())
+
+    # the word lengths in the lexicon, shortest first.
+    @property
+    def lengths(self):
+        return sorted(self.buckets)
+
+
+# the results of LengthBucketedModel.run_words(), one entry per stimulus:
+#   winners[s]: the most active word after the last cycle, over all the
+#     buckets the stimulus was routed to.
+#   winner_activations[s]: its activation.
+#   target_activations[s, t]: the activation of the stimulus word itself
+#     after cycle t, or NaN when it is not in the lexicon.
+class LengthBucketedResult:
+    def __init__(self, stimuli, winners, winner_activations, target_activations):
+        self.stimuli = stimuli
+        self.winners = winners
+        self.winner_activations = winner_activations
+        self.target_activations = target_activations
+
+    # the share of stimuli whose winner is the stimulus word itself.
+    def accuracy(self):
+        return np.mean([winner == stimulus for winner, stimulus in zip(self.winners, self.stimuli)])
+
+    # one row per stimulus.
+    def to_dataframe(self):
+        import pandas as pd
+
+        return pd.DataFrame({
+            'stimulus': self.stimuli,
+            'length': [len(stimulus) for stimulus in self.stimuli],
+            'winner': self.winners,
+            'winner_activation': self.winner_activations,
+            'final_target_activation': self.target_activations[:, -1],
+        })
+
+    # a plain text table of the accuracy for each word length.
+    def summary(self):
+        lengths = np.array([len(stimulus) for stimulus in self.stimuli])
+        correct = np.array([winner == stimulus for winner, stimulus in zip(self.winners, self.stimuli)])
+
+        lines = ['%-8s %8s %10s' % ('length', 'stimuli', 'accuracy')]
+        for length in np.unique(lengths):
+            lines.append('%-8d %8d %10.3f' % (length, np.sum(lengths == length), np.mean(correct[lengths == length])))
+
+        return '\n'.join(lines)
+
+
+# the model for a MixedLexicon. the words of each length form their own
+# bucket, with a LexiconConnectivity and resting states of their own, and a
+# stimulus has a letter pool for each of its positions and no more. a
+# stimulus of length L is routed to the buckets of the lengths within
+# length_tolerance of L: only those buckets are run, so the work and memory
+# of a cycle grow with the letters of the words that are actually run,
+# rather than with the longest length times the whole lexicon. with the
+# default length_tolerance=0 only the words of the same length as the
+# stimulus take part. the words of a bucket of another length are connected
+# to the letter positions the stimulus and the word share, from the left.
+# within a bucket the words inhibit each other with WORD_WORD_INHIBITION; a
+# word is inhibited by the words of the other buckets that are run with
+# cross_length_inhibition, which defaults to the same strength (all the
+# routed words compete as one word layer). 0 lets each bucket settle on its
+# own.
+# with a lexicon of a single length this computes exactly what IAModel does
+# (to the last bit).
+class LengthBucketedModel:
+    def __init__(self, lexicon, params=None, length_tolerance=0, cross_length_inhibition=None, dtype=np.float64):
+        params = resolve_parameters(params)
+        if parameter_batch_size(params) is not None:
+            raise ValueError("the length-bucketed model does not support parameters that vary per trial")
+
+        self.lexicon = lexicon
+        self.params = params
+        self.dtype = np.dtype(dtype)
+        self.length_tolerance = length_tolerance
+
+        self.decay_rate = params["DECAY_RATE"]
+        self.max_value = 1.0
+        self.min_value = params["MIN_ACTIVATION"]
+        self.letter_inhibition = params["LETTER_LETTER_INHIBITION"]
+        self.word_inhibition = params["WORD_WORD_INHIBITION"]
+        if cross_length_inhibition is None:
+            cross_length_inhibition = self.word_inhibition
+        self.cross_length_inhibition = cross_length_inhibition
+
+        # the feature weights are the same for every position, so one stacked
+        # (present, absent) matrix serves every length (see IAModel).
+        w_from_features_to_letters, w_from_features_to_letters_absence = compile_feature_weights(params, self.dtype)
+        self.w_features = np.concatenate([w_from_features_to_letters, w_from_features_to_letters_absence], axis=-2)
+
+        self.word_resting_states = {length: bucket.resting_state(params["REST_GAIN"]).astype(self.dtype, copy=False) for length, bucket in lexicon.buckets.items()}
+
+        # the connectivity of each bucket to the first `positions` letter
+        # positions, keyed by (length, positions). a bucket is connected to
+        # all its positions unless it is run with a shorter stimulus; those
+        # connectivities are built the first time they are needed.
+        self._connectivities = {(length, length): LexiconConnectivity.from_lexicon(bucket, params) for length, bucket in lexicon.buckets.items()}
+
+    # the lengths of the buckets a stimulus of the given length is routed to.
+    def routes(self, length):
+        lengths = [bucket for bucket in self.lexicon.lengths if abs(bucket - length) <= self.length_tolerance]
+        if not lengths:
+            raise ValueError("there are no words of length %d in the lexicon" % length)
+
+        return lengths
+
+    # the connectivity of the words of length `length` to the letters of a
+    # stimulus of length `positions` (see __init__).
+    def connectivity(self, length, positions):
+        positions = min(length, positions)
+        if (length, positions) not in self._connectivities:
+            full = self._connectivities[(length, length)]
+            self._connectivities[(length, positions)] = LexiconConnectivity(full.word_letters[:, :positions], full.letter_word_excitation, full.letter_word_inhibition, full.word_letter_excitation, full.word_letter_inhibition, num_letters=full.num_letters, sparse_density=full.sparse_density)
+
+        return self._connectivities[(length, positions)]
+
+    # the net input from the features to the letters, as in
+    # IAModel.feature_input(). the stimulus has as many positions as it has
+    # letters.
+    def feature_input(self, input_present, input_absence):
+        features = np.clip(np.concatenate([input_present, input_absence], axis=-1, dtype=self.dtype), 0, None)
+
+        return np.matmul(features, self.w_features)
+
+    # the initial states for num_trials trials (None for a single trial) of
+    # a stimulus of the given length: the letters at 0 and the words of
+    # every routed bucket at their resting states, as a dictionary from
+    # length to word states.
+    def initial_states(self, length, num_trials=None):
+        batch_shape = () if num_trials is None else (num_trials,)
+        letter_state = np.zeros(batch_shape + (length, self.w_features.shape[-1]), dtype=self.dtype)
+        word_states = {bucket: np.broadcast_to(self.word_resting_states[bucket], batch_shape + (len(self.word_resting_states[bucket]),)).copy() for bucket in self.routes(length)}
+
+        return letter_state, word_states
+
+    # compute the states one cycle later without changing the model, as in
+    # IAModel.update_from_input(). word_states is a dictionary from length
+    # to the states of the words of that length, for the routed buckets.
+    def update_from_input(self, letter_state, word_states, feature_input):
+        positions = letter_state.shape[-2]
+        clipped_letters = np.clip(letter_state, 0, None)
+        clipped_words = {length: np.clip(state, 0, None) for length, state in word_states.items()}
+
+        # the top-down input of every bucket goes to the positions it is
+        # connected to.
+        top_down = np.zeros(letter_state.shape, dtype=self.dtype)
+        for length, clipped in clipped_words.items():
+            shared = min(length, positions)
+            top_down[..., :shared, :] += self.connectivity(length, positions).words_to_letters(clipped)
+        letter_net_input = feature_input + top_down
+
+        word_net_inputs = {length: self.connectivity(length, positions).letters_to_words(clipped_letters[..., :min(length, positions), :]) for length, clipped in clipped_words.items()}
+
+        # lateral inhibition within each letter position, within each
+        # bucket, and between the buckets.
+        if self.letter_inhibition != 0:
+            letter_net_input = letter_net_input + compute_inhibition(self.letter_inhibition, clipped_letters)
+        if self.word_inhibition != 0:
+            for length, clipped in clipped_words.items():
+                word_net_inputs[length] = word_net_inputs[length] + compute_inhibition(self.word_inhibition, clipped)
+        if self.cross_length_inhibition != 0 and len(clipped_words) > 1:
+            totals = {length: np.sum(clipped, axis=-1, keepdims=True) for length, clipped in clipped_words.items()}
+            total = sum(totals.values())
+            for length in clipped_words:
+                word_net_inputs[length] = word_net_inputs[length] - self.cross_length_inhibition * (total - totals[length])
+
+        letter_effect = compute_effect(letter_net_input, letter_state, self.min_value, self.max_value)
+        letter_state = compute_activation(letter_effect, letter_state, self.decay_rate, 0.0, self.min_value, self.max_value)
+
+        updated = {}
+        for length, state in word_states.items():
+            word_effect = compute_effect(word_net_inputs[length], state, self.min_value, self.max_value)
+            updated[length] = compute_activation(word_effect, state, self.decay_rate, self.word_resting_states[length], self.min_value, self.max_value)
+
+        return letter_state, updated
+
+    # run a stimulus (an (input_present, input_absence) pair with one row per
+    # letter, with or without a batch dimension, all of the same length) for
+    # a number of cycles from the resting state. returns the letter trace,
+    # with shape (cycles, [batch_size,] length, 26), and the word traces of
+    # the routed buckets as a dictionary from length to an array of shape
+    # (cycles, [batch_size,] words of that length).
+    def run(self, stimulus, cycles):
+        input_present, input_absence = stimulus
+        length = np.shape(input_present)[-2]
+        num_trials = len(input_present) if np.ndim(input_present) == 3 else None
+
+        feature_input = self.feature_input(input_present, input_absence)
+        letter_state, word_states = self.initial_states(length, num_trials)
+
+        letter_trace = np.zeros((cycles,) + letter_state.shape, dtype=self.dtype)
+        word_traces = {bucket: np.zeros((cycles,) + state.shape, dtype=self.dtype) for bucket, state in word_states.items()}
+        for i in range(cycles):
+            letter_state, word_states = self.update_from_input(letter_state, word_states, feature_input)
+            letter_trace[i] = letter_state
+            for bucket, state in word_states.items():
+                word_traces[bucket][i] = state
+
+        return letter_trace, word_traces
+
+    # show each of a list of words of any lengths for a number of cycles.
+    # the words are grouped by length and every group is run as one batch
+    # (batch_size at a time) through its own buckets. see
+    # LengthBucketedResult.
+    def run_words(self, words, cycles, batch_size=256):
+        words = list(words)
+        lengths = np.array([len(word) for word in words])
+
+        winners = [None] * len(words)
+        winner_activations = np.zeros(len(words))
+        target_activations = np.full((len(words), cycles), np.nan)
+
+        for length in np.unique(lengths).tolist():
+            members = np.flatnonzero(lengths == length)
+            for start in range(0, len(members), batch_size):
+                trials = members[start:start + batch_size]
+                group = [words[i] for i in trials]
+                feature_input = self.feature_input(*word_stimulus(group))
+                letter_state, word_states = self.initial_states(length, len(group))
+
+                # the position of each stimulus word in its bucket, if it is
+                # in the lexicon.
+                bucket = self.lexicon.buckets.get(length)
+                known = np.array([bucket is not None and word in bucket.word_index for word in group])
+                targets = np.array([bucket.index(word) if is_known else 0 for word, is_known in zip(group, known)], dtype=np.intp)
+
+                for i in range(cycles):
+                    letter_state, word_states = self.update_from_input(letter_state, word_states, feature_input)
+                    if length in word_states:
+                        target_activations[trials[known], i] = word_states[length][np.flatnonzero(known), targets[known]]
+
+                # the winner over every routed bucket.
+                best_activation = np.full(len(group), -np.inf)
+                for bucket_length, state in word_states.items():
+                    best = np.argmax(state, axis=-1)
+                    activation = state[np.arange(len(group)), best]
+                    better = activation > best_activation
+                    best_activation[better] = activation[better]
+                    for k in np.flatnonzero(better):
+                        winners[trials[k]] = self.lexicon.buckets[bucket_length].words[best[k]]
+                winner_activations[trials] = best_activation
+
+        return LengthBucketedResult(words, winners, winner_activations, target_activations)
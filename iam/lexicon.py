@@ -0,0 +1,218 @@
+import csv
+import os
+
+import numpy as np
+
+from .constants import alphabet
+
+
+# words.csv lives at the top of the repository, next to this package.
+DEFAULT_WORDS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'words.csv')
+
+
+# read the words and frequencies from a csv file with `word` and `frequency`
+# columns, like words.csv. the csv module is used instead of pandas so that
+# loading does not depend on pandas (and so that words like "null" are not
+# read as missing values).
+def read_words(path=DEFAULT_WORDS_PATH):
+    words = []
+    frequencies = []
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            words.append(row['word'].strip().lower())
+            frequencies.append(float(row['frequency']))
+
+    return words, frequencies
+
+
+# turn a list of words into a (num_words, positions) array of letter
+# indices. the words are converted in one go through numpy's fixed-width
+# unicode strings instead of looping over every letter of every word.
+def encode_words(words):
+    codes = np.array(words, dtype=str)
+    if codes.ndim != 1 or len(codes) == 0:
+        raise ValueError("words must be a non-empty list of strings")
+
+    lengths = np.char.str_len(codes)
+    word_length = int(lengths[0])
+    if np.any(lengths != word_length):
+        raise ValueError("all words must have the same length")
+
+    # each character of a fixed-width unicode string is stored as a 32 bit
+    # code point, so viewing the array as uint32 gives one column per letter.
+    word_letters = codes.view(np.uint32).reshape(len(codes), -1)[:, :word_length].astype(np.intp) - ord(alphabet[0])
+    if np.any((word_letters < 0) | (word_letters >= len(alphabet))):
+        raise ValueError("words may only contain the letters " + alphabet[0] + "-" + alphabet[-1])
+
+    return word_letters
+
+
+# append rows to the first size rows of buffer (along axis). the buffer
+# keeps room to spare, so it only has to grow (to twice what is needed) once
+# in a while. returns the buffer, which is a new array when it had to grow.
+def append_rows(buffer, size, rows, axis=0):
+    rows = np.moveaxis(np.asarray(rows, dtype=buffer.dtype), axis, 0)
+    needed = size + len(rows)
+
+    if needed > buffer.shape[axis]:
+        shape = list(buffer.shape)
+        shape[axis] = 2 * needed
+        grown = np.empty(shape, dtype=buffer.dtype)
+        np.moveaxis(grown, axis, 0)[:size] = np.moveaxis(buffer, axis, 0)[:size]
+        buffer = grown
+
+    np.moveaxis(buffer, axis, 0)[size:needed] = rows
+
+    return buffer
+
+
+# remove the rows with the given indices from the first size rows of buffer
+# (along axis), moving the rows after them up so that the order of the
+# others is kept. this is done in place. returns the new number of rows.
+def delete_rows(buffer, size, indices, axis=0):
+    keep = np.ones(size, dtype=bool)
+    keep[indices] = False
+
+    rows = np.moveaxis(buffer, axis, 0)
+    kept = np.count_nonzero(keep)
+    rows[:kept] = rows[:size][keep]
+
+    return kept
+
+
+# the Lexicon holds the words the model knows about, their frequencies (which
+# set their resting states) and the letter each word has at each position.
+class Lexicon:
+    def __init__(self, words, frequencies, word_letters=None):
+        self.words = list(words)
+        self.frequencies = np.asarray(frequencies, dtype=float)
+
+        if len(self.frequencies) != len(self.words):
+            raise ValueError("words and frequencies must have the same length")
+
+        # word_letters[i, j] is the index of the letter word i has at
+        # position j.
+        if word_letters is None:
+            word_letters = encode_words(self.words)
+        self.word_letters = word_letters
+
+        # looking a word up by name is done through a dictionary, which is
+        # only built the first time it is needed.
+        self._word_index = None
+
+        # the arrays that hold the frequencies and word_letters (which are
+        # views of their first len(words) rows) once words are added or
+        # removed. until then the arrays that were passed in are used as they
+        # are, and they are only copied the first time the lexicon changes,
+        # since they may be shared or read-only (e.g. memory-mapped).
+        self._buffers = None
+
+    # read the lexicon from a csv file, see read_words.
+    @classmethod
+    def from_csv(cls, path=DEFAULT_WORDS_PATH):
+        return cls(*read_words(path))
+
+    def __len__(self):
+        return len(self.words)
+
+    # the number of letter positions in each word
+    @property
+    def positions(self):
+        return self.word_letters.shape[1]
+
+    @property
+    def word_index(self):
+        if self._word_index is None:
+            self._word_index = {word: index for index, word in enumerate(self.words)}
+
+        return self._word_index
+
+    # the position of a word in the lexicon (and in the word layer)
+    def index(self, word):
+        return self.word_index[word]
+
+    # the resting state of every word node. the frequencies are in the range
+    # 0 to -1 and are scaled by rest_gain.
+    def resting_state(self, rest_gain):
+        return self.frequencies * rest_gain
+
+    # a copy of the lexicon that can be changed without changing this one.
+    # the arrays are only copied once the copy is changed.
+    def copy(self):
+        return Lexicon(self.words, self.frequencies, self.word_letters)
+
+    # the positions of a list of words in the lexicon, as an array.
+    def indices(self, words):
+        missing = [word for word in words if word not in self.word_index]
+        if missing:
+            raise ValueError("not in the lexicon: " + ", ".join(missing))
+
+        return np.array([self.word_index[word] for word in words], dtype=np.intp)
+
+    # add words with their frequencies at the end of the lexicon. returns the
+    # positions of the new words. only the new words are encoded, and the
+    # arrays grow in place (see append_rows), so this takes about as long
+    # however large the lexicon is.
+    def add_words(self, words, frequencies):
+        words = list(words)
+        frequencies = np.asarray(frequencies, dtype=float)
+        if len(frequencies) != len(words):
+            raise ValueError("words and frequencies must have the same length")
+        if len(set(words)) != len(words) or any(word in self.word_index for word in words):
+            raise ValueError("words can only be in the lexicon once")
+
+        word_letters = encode_words(words)
+        if word_letters.shape[1] != self.positions:
+            raise ValueError("the words must have %d letters" % self.positions)
+
+        frequency_buffer, letter_buffer = self._writable_buffers()
+        start = len(self.words)
+        self._buffers = (append_rows(frequency_buffer, start, frequencies), append_rows(letter_buffer, start, word_letters))
+
+        self.words.extend(words)
+        for offset, word in enumerate(words):
+            self.word_index[word] = start + offset
+        self._update_views()
+
+        return np.arange(start, len(self.words))
+
+    # remove words from the lexicon. the words after them move up, so the
+    # lexicon is the same as one that never had them. returns the positions
+    # the words had.
+    def remove_words(self, words):
+        indices = np.unique(self.indices(words))
+
+        frequency_buffer, letter_buffer = self._writable_buffers()
+        delete_rows(frequency_buffer, len(self.words), indices)
+        delete_rows(letter_buffer, len(self.words), indices)
+
+        removed = set(indices.tolist())
+        self.words = [word for index, word in enumerate(self.words) if index not in removed]
+        self._word_index = None
+        self._update_views()
+
+        return indices
+
+    # change the frequencies of words already in the lexicon, in place.
+    # returns the positions of the words.
+    def set_frequencies(self, words, frequencies):
+        indices = self.indices(words)
+
+        self._writable_buffers()
+        self.frequencies[indices] = frequencies
+
+        return indices
+
+    # the frequency and word_letters buffers, copied into arrays of the
+    # lexicon's own the first time it is changed.
+    def _writable_buffers(self):
+        if self._buffers is None:
+            self._buffers = (np.array(self.frequencies, dtype=float), np.array(self.word_letters, dtype=np.intp))
+            self._update_views()
+
+        return self._buffers
+
+    def _update_views(self):
+        frequency_buffer, letter_buffer = self._buffers
+        self.frequencies = frequency_buffer[:len(self.words)]
+        self.word_letters = letter_buffer[:len(self.words)]
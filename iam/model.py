@@ -0,0 +1,826 @@
+import copy
+
+import numpy as np
+
+from .constants import DECAY_RATE, LETTER_LETTER_INHIBITION, MIN_ACTIVATION, WORD_WORD_INHIBITION
+from . import profiling
+from .core import compute_activation, compute_effect, compute_inhibition, per_trial
+from .lexicon import DEFAULT_WORDS_PATH, append_rows, delete_rows
+from .schedule import Schedule
+from .snapshot import Snapshot
+from .trace import TraceRecorder
+from .weights import load_weights
+
+
+# the IAModel class runs the whole network (one letter pool per position plus
+# the word pool) as a single object. instead of keeping a separate IAPool for
+# each letter position, all of the letter states are stored together in one
+# (positions x 26) array, so each cycle only needs a few large array
+# operations: features->letters for every position at once, and one
+# gather (letters->words) and one scatter (words->letters) through the
+# LexiconConnectivity. the update is synchronous, exactly like the hand-written
+# loops: every net input is computed from the states at the start of the
+# cycle before any state is changed.
+class IAModel:
+    def __init__(self, w_from_features_to_letters, w_from_features_to_letters_absence, connectivity, word_resting_state, decay_rate=DECAY_RATE, max_value=1.0, min_value=MIN_ACTIVATION, letter_inhibition=LETTER_LETTER_INHIBITION, word_inhibition=WORD_WORD_INHIBITION, batch_size=None, lexicon=None, dtype=np.float64, prune_margin=None, rest_gain=None):
+        # the floating point type of the weights, the states and all the
+        # computations (see IAPool).
+        self.dtype = np.dtype(dtype)
+
+        # the LexiconConnectivity between the letter and word layers
+        self.connectivity = connectivity
+        self.positions = connectivity.positions
+        self.num_letters = connectivity.num_letters
+        self.num_words = connectivity.num_words
+
+        # the present and absent feature weights are stacked on top of each
+        # other, so a single product with the stacked (present, absent) input
+        # gives the bottom-up input for all positions.
+        self.w_features = np.concatenate([w_from_features_to_letters, w_from_features_to_letters_absence], axis=-2).astype(self.dtype, copy=False)
+
+        self.word_resting_state = np.asarray(word_resting_state, dtype=self.dtype)
+        self.decay_rate = decay_rate
+        self.max_value = max_value
+        self.min_value = min_value
+        self.letter_inhibition = letter_inhibition
+        self.word_inhibition = word_inhibition
+
+        # the same batching rule as IAPool: None means a single trial, otherwise
+        # every state gets a leading dimension of this size.
+        self.batch_size = batch_size
+
+        # in a batched model every parameter can have one value per trial
+        # instead of a single number (see compile_weights): the scalars above
+        # and the connection strengths as arrays of batch_size values, the
+        # feature weights with shape (batch_size, 14, 26) and the resting
+        # states with shape (batch_size, num_words).
+        per_trial_values = [self.decay_rate, self.max_value, self.min_value, self.letter_inhibition, self.word_inhibition, connectivity.letter_word_excitation, connectivity.letter_word_inhibition, connectivity.word_letter_excitation, connectivity.word_letter_inhibition]
+        batch_sizes = {len(value) for value in per_trial_values if np.ndim(value) > 0}
+        if self.w_features.ndim == 3:
+            batch_sizes.add(len(self.w_features))
+        if self.word_resting_state.ndim == 2:
+            batch_sizes.add(len(self.word_resting_state))
+        if batch_sizes and batch_sizes != {batch_size}:
+            raise ValueError("parameters with one value per trial must have batch_size values")
+        self.parameters_vary = len(batch_sizes) > 0
+
+        # the Lexicon the word layer was built from, if known. this is used
+        # to look up words by name, and to change the words (see add_words).
+        self.lexicon = lexicon
+
+        # the REST_GAIN the resting states were worked out with, if known.
+        # it is needed to add words or change their frequencies.
+        self.rest_gain = rest_gain
+        self._resting_buffer = None
+        self._owns_words = False
+
+        # with a prune_margin the word layer is updated approximately: only
+        # the words that are above 0, or whose net input is above
+        # -prune_margin, get the full update (the active set). every other
+        # word gets the net input of a word with no active letters (the same
+        # for every such word in a trial), so it only decays toward its
+        # resting state under the inhibition, ignoring whatever little support
+        # its letters give it. a word is back in the active set as soon as the
+        # letters give it enough support. a larger margin keeps more words in
+        # the active set and gets closer to the exact update (see
+        # iam.precision.check_pruning for measuring the error). the number of
+        # words in the active set on the last update is kept in active_words.
+        # when the model steps its own states, the words outside the active
+        # set are only brought up to date when they are needed (see
+        # _LazyWordState), so a cycle costs about as much as the active set.
+        self.prune_margin = prune_margin
+        self.active_words = None
+        self._lazy_words = None
+
+        self.reset()
+
+    # build a model from CompiledWeights (see load_weights), using the
+    # parameters and the dtype the weights were compiled with.
+    # weights compiled with one parameter set per trial give a batched model
+    # with that many trials. prune_margin turns on the approximate word
+    # update (see __init__).
+    @classmethod
+    def from_weights(cls, weights, batch_size=None, prune_margin=None):
+        params = weights.params
+        if batch_size is None:
+            batch_size = weights.batch_size
+
+        return cls(weights.w_from_features_to_letters, weights.w_from_features_to_letters_absence, weights.connectivity, weights.word_resting_state, decay_rate=params["DECAY_RATE"], min_value=params["MIN_ACTIVATION"], letter_inhibition=params["LETTER_LETTER_INHIBITION"], word_inhibition=params["WORD_WORD_INHIBITION"], batch_size=batch_size, lexicon=weights.lexicon, dtype=weights.dtype, prune_margin=prune_margin, rest_gain=params["REST_GAIN"])
+
+    # this resets the letters (resting state 0) and the words (their
+    # frequency based resting states) to their initial states.
+    def reset(self):
+        batch_shape = () if self.batch_size is None else (self.batch_size,)
+        self.letter_state = np.zeros(batch_shape + (self.positions, self.num_letters), dtype=self.dtype)
+        self.word_state = np.broadcast_to(self.word_resting_state, batch_shape + (self.num_words,)).copy()
+
+        # the number of cycles run since the last reset (or restore).
+        self.cycle = 0
+
+    # change the lexicon of the model in place: add words with their
+    # frequencies at the end of the lexicon, remove words, or change the
+    # frequencies (and so the resting states) of words. the lexicon, the
+    # connectivity and the resting states are updated directly rather than
+    # compiled again, so each change only costs about as much as copying the
+    # word layer once, and a lexicon can be changed thousands of times (e.g.
+    # to add or take away the neighbors of a word) without rebuilding the
+    # model. the words after a removed word move up, so the model is the same
+    # (to the last bit) as one built from the changed lexicon. added words
+    # start at their resting state and removed words are dropped from the
+    # states; every other word keeps its activation, so this can also be
+    # done in the middle of a trial.
+    # the lexicon, the connectivity and the resting states are shared with
+    # the CompiledWeights (and every other model built from them), so the
+    # model makes its own copies of them the first time it is changed, and
+    # the other models go on with the words they had.
+    def add_words(self, words, frequencies):
+        indices = self._lexicon().add_words(words, frequencies)
+        self.connectivity.add_words(self.lexicon.word_letters[indices])
+
+        resting_state = self._resting_states(indices)
+        self._resting_buffer = append_rows(self._writable_resting_buffer(), self.num_words, resting_state, axis=-1)
+        self._update_num_words(self.num_words + len(indices))
+        self.word_state = np.concatenate([self.word_state, np.broadcast_to(resting_state, self.word_state.shape[:-1] + (len(indices),))], axis=-1)
+
+    def remove_words(self, words):
+        indices = self._lexicon().remove_words(words)
+        self.connectivity.remove_words(indices)
+
+        self._update_num_words(delete_rows(self._writable_resting_buffer(), self.num_words, indices, axis=-1))
+        self.word_state = np.delete(self.word_state, indices, axis=-1)
+
+    def set_frequencies(self, words, frequencies):
+        indices = self._lexicon().set_frequencies(words, frequencies)
+
+        self._writable_resting_buffer()
+        self.word_resting_state[..., indices] = self._resting_states(indices)
+
+    # the lexicon of the model, which (together with the connectivity) is
+    # replaced by a copy of its own before the first change.
+    def _lexicon(self):
+        if self.lexicon is None or self.rest_gain is None:
+            raise ValueError("changing the words needs a model built with its lexicon and rest_gain (see from_weights)")
+
+        # the words of a pruned model are brought up to date while they still
+        # have the resting states they were run with.
+        self._settle_words()
+
+        if not self._owns_words:
+            self.lexicon = self.lexicon.copy()
+            self.connectivity = self.connectivity.copy()
+            self._owns_words = True
+
+        return self.lexicon
+
+    # the resting states of some of the words, worked out as in
+    # compile_weights.
+    def _resting_states(self, indices):
+        return (self.lexicon.frequencies[indices] * per_trial(self.rest_gain, 1)).astype(self.dtype, copy=False)
+
+    # the array word_resting_state is a view of, copied the first time it is
+    # changed, since it is shared with the CompiledWeights.
+    def _writable_resting_buffer(self):
+        if self._resting_buffer is None:
+            self._resting_buffer = self.word_resting_state.copy()
+            self.word_resting_state = self._resting_buffer
+
+        return self._resting_buffer
+
+    def _update_num_words(self, num_words):
+        self.num_words = num_words
+        self.word_resting_state = self._resting_buffer[..., :num_words]
+
+    # the word activations, with shape ([batch_size,] num_words). a pruned
+    # model that has been stepping its own states keeps most of its words
+    # behind (see _LazyWordState), so reading them first brings every word up
+    # to date, which costs a pass over the word layer.
+    @property
+    def word_state(self):
+        self._settle_words()
+
+        return self._word_state
+
+    @word_state.setter
+    def word_state(self, word_state):
+        self._word_state = word_state
+        self._lazy_words = None
+
+    def _settle_words(self):
+        if self._lazy_words is not None:
+            self._word_state = self._lazy_words.materialize()
+            self._lazy_words = None
+
+    # the word activations for a TraceRecorder: word_state, or for a pruned
+    # model the words that are behind, which the recorder only brings up to
+    # date for the words it records.
+    def _recorded_words(self):
+        if self._lazy_words is not None:
+            return self._lazy_words
+
+        return self._word_state
+
+    # a Snapshot of the current states. the states are copied, so the model
+    # can go on running without changing the snapshot.
+    def snapshot(self):
+        return Snapshot(self.letter_state.copy(), self.word_state.copy(), self.cycle)
+
+    # put the model back into the state of a snapshot taken from a model with
+    # the same lexicon and batch size (see Snapshot). the states are copied
+    # out of the snapshot, so it can be restored again later, and it can be
+    # a read-only, memory-mapped one (see load_snapshot).
+    def restore(self, snapshot):
+        self._check_snapshot(snapshot)
+        if snapshot.batch_size != self.batch_size:
+            raise ValueError("the snapshot has batch size %s but the model has batch size %s" % (snapshot.batch_size, self.batch_size))
+
+        self.letter_state = np.array(snapshot.letter_state, dtype=self.dtype)
+        self.word_state = np.array(snapshot.word_state, dtype=self.dtype)
+        self.cycle = snapshot.cycle
+
+    def _check_snapshot(self, snapshot):
+        letter_shape = snapshot.letter_state.shape[-2:]
+        if letter_shape != (self.positions, self.num_letters) or snapshot.word_state.shape[-1] != self.num_words:
+            raise ValueError("the snapshot has %d positions and %d words but the model has %d positions and %d words" % (letter_shape[0], snapshot.word_state.shape[-1], self.positions, self.num_words))
+
+    # advance every pool by one cycle. input_present and input_absence have
+    # shape (positions, num_features), or (batch_size, positions, num_features)
+    # to give each trial its own stimulus.
+    def step(self, input_present, input_absence):
+        if self.prune_margin is not None:
+            return self.step_from_input(self.feature_input(input_present, input_absence))
+
+        self.letter_state, self.word_state = self.update(self.letter_state, self.word_state, input_present, input_absence)
+        self.cycle += 1
+
+        return self.letter_state, self.word_state
+
+    # step() with the feature input already worked out (see feature_input).
+    def step_from_input(self, feature_input):
+        self.advance(feature_input)
+
+        return self.letter_state, self.word_state
+
+    # step_from_input() without returning the states. for a pruned model this
+    # leaves the words outside the active set behind until they are read (see
+    # word_state), so a loop that doesn't look at every word on every cycle
+    # only pays for the active set.
+    def advance(self, feature_input):
+        if self.prune_margin is None:
+            self.letter_state, self.word_state = self.update_from_input(self.letter_state, self.word_state, feature_input)
+        elif self._lazy_words is None and np.any(self.word_resting_state > 0):
+            # words resting above 0 would be sending signals while behind,
+            # so they are all updated on every cycle instead.
+            self.letter_state, self.word_state = self.update_from_input(self.letter_state, self.word_state, feature_input)
+        else:
+            if self.parameters_vary:
+                raise ValueError("the pruned update does not support parameters that vary per trial")
+            if self._lazy_words is None:
+                self._lazy_words = _LazyWordState(self, self._word_state)
+            self.letter_state = self._lazy_words.step(self.letter_state, feature_input)
+        self.cycle += 1
+
+    # the net input from the features to the letters, with shape
+    # ([batch_size,] positions, 26). it only depends on the stimulus, so a
+    # stimulus that is shown for several cycles only needs it once (see
+    # Schedule).
+    def feature_input(self, input_present, input_absence):
+        # clip everything to 0 first: only positive activations send signals.
+        # the present and absent features go through a single product with
+        # the stacked weights, for all positions at once.
+        features = np.clip(np.concatenate([input_present, input_absence], axis=-1, dtype=self.dtype), 0, None)
+
+        return np.matmul(features, self.w_features)
+
+    # compute the states one cycle after letter_state and word_state, without
+    # changing the model. step() applies this to the model's own states;
+    # run_until() applies it to only the trials that are still running.
+    def update(self, letter_state, word_state, input_present, input_absence):
+        if profiling.active is not None:
+            t = profiling.active.now()
+            feature_input = self.feature_input(input_present, input_absence)
+            profiling.active.lap('IAModel', 'features->letters', t)
+        else:
+            feature_input = self.feature_input(input_present, input_absence)
+
+        return self.update_from_input(letter_state, word_state, feature_input)
+
+    # update() with the feature input already worked out. letter_noise and
+    # word_noise, if given, are added to the net inputs of the letters and
+    # the words (see iam.montecarlo).
+    def update_from_input(self, letter_state, word_state, feature_input, letter_noise=None, word_noise=None):
+        # the pruned update is not broken down into phases by the profiler.
+        if self.prune_margin is not None:
+            if letter_noise is not None or word_noise is not None:
+                raise ValueError("the pruned update does not support noise")
+            if self.parameters_vary:
+                raise ValueError("the pruned update does not support parameters that vary per trial")
+            return self._pruned_update(letter_state, word_state, feature_input)
+
+        # when a profiler is running, take the instrumented path instead.
+        if profiling.active is not None:
+            return self._profiled_update(letter_state, word_state, feature_input, profiling.active, letter_noise, word_noise)
+
+        letter_decay, letter_min, letter_max, letter_inhibition = self._layer_parameters(2)
+        word_decay, word_min, word_max, word_inhibition = self._layer_parameters(1)
+
+        # clip the states to 0 first: only positive activations send signals.
+        clipped_letters = np.clip(letter_state, 0, None)
+        clipped_words = np.clip(word_state, 0, None)
+
+        # letter net input: bottom-up features plus top-down word feedback, for
+        # all positions at once.
+        letter_net_input = feature_input + self.connectivity.words_to_letters(clipped_words)
+
+        # word net input: every position's letters through the connectivity.
+        word_net_input = self.connectivity.letters_to_words(clipped_letters)
+
+        # lateral inhibition within each letter position and within the words.
+        if np.any(np.not_equal(letter_inhibition, 0)):
+            letter_net_input = letter_net_input + compute_inhibition(letter_inhibition, clipped_letters)
+        if np.any(np.not_equal(word_inhibition, 0)):
+            word_net_input = word_net_input + compute_inhibition(word_inhibition, clipped_words)
+
+        if letter_noise is not None:
+            letter_net_input = letter_net_input + letter_noise
+        if word_noise is not None:
+            word_net_input = word_net_input + word_noise
+
+        # both layers are updated from the net inputs computed above, so the
+        # update is synchronous without needing to copy any state.
+        letter_effect = compute_effect(letter_net_input, letter_state, letter_min, letter_max)
+        word_effect = compute_effect(word_net_input, word_state, word_min, word_max)
+        letter_state = compute_activation(letter_effect, letter_state, letter_decay, 0.0, letter_min, letter_max)
+        word_state = compute_activation(word_effect, word_state, word_decay, self.word_resting_state, word_min, word_max)
+
+        return letter_state, word_state
+
+    # decay_rate, min_value, max_value and the lateral inhibition of the
+    # letter layer (unit_dims=2) or the word layer (unit_dims=1), shaped to
+    # broadcast against the layer when they have one value per trial.
+    def _layer_parameters(self, unit_dims):
+        inhibition = self.letter_inhibition if unit_dims == 2 else self.word_inhibition
+
+        return [per_trial(value, unit_dims, self.dtype) for value in (self.decay_rate, self.min_value, self.max_value, inhibition)]
+
+    # the model for some of the trials of a batch (e.g. the ones that are
+    # still running in run_until()): the parameters that have one value per
+    # trial are narrowed down to those trials. without such parameters this
+    # is the model itself.
+    def subset(self, trials):
+        if not self.parameters_vary:
+            return self
+
+        model = copy.copy(self)
+        for name in ('decay_rate', 'max_value', 'min_value', 'letter_inhibition', 'word_inhibition'):
+            value = getattr(self, name)
+            if np.ndim(value) > 0:
+                setattr(model, name, np.asarray(value)[trials])
+        if self.w_features.ndim == 3:
+            model.w_features = self.w_features[trials]
+        if self.word_resting_state.ndim == 2:
+            model.word_resting_state = self.word_resting_state[trials]
+        model.connectivity = self.connectivity.subset(trials)
+        model.batch_size = len(np.arange(self.batch_size)[trials])
+
+        return model
+
+    # the same model for batch_size trials (None for a single trial), as a
+    # new model that shares the weights, the connectivity and the lexicon
+    # with this one but has states of its own, so running it leaves this
+    # model as it is. changing its words gives it its own copies (see
+    # add_words).
+    def with_batch_size(self, batch_size):
+        if self.parameters_vary and batch_size != self.batch_size:
+            raise ValueError("the batch size of a model whose parameters vary per trial can't be changed")
+
+        model = copy.copy(self)
+        model.batch_size = batch_size
+        model._owns_words = False
+        model._resting_buffer = None
+        model.reset()
+
+        return model
+
+    # update() with a prune_margin, see __init__.
+    def _pruned_update(self, letter_state, word_state, feature_input):
+        num_trials = int(np.prod(word_state.shape[:-1]))
+        flat_word_state = word_state.reshape(-1)
+
+        # only the words above 0 send any signal, so the words->letters input
+        # and the word inhibition only need those.
+        positive = np.flatnonzero(flat_word_state > 0)
+        letter_state, baseline, active, support = self._pruned_inputs(letter_state, feature_input, positive, flat_word_state[positive], num_trials)
+        active_state = self._update_active_words(flat_word_state[active], active, support, baseline)
+
+        # everything else gets the baseline net input of its trial, which is
+        # never positive, so it just decays toward its resting state while
+        # being pushed down by the inhibition.
+        baseline = baseline.reshape(word_state.shape[:-1] + (1,))
+        inactive_effect = baseline * (word_state - self.min_value)
+        word_state = compute_activation(inactive_effect, word_state, self.decay_rate, self.word_resting_state, self.min_value, self.max_value)
+        word_state.reshape(-1)[active] = active_state
+
+        return letter_state, word_state
+
+    # the parts of a pruned update that don't depend on the words outside the
+    # active set. words are identified by their index in the flattened word
+    # layer (trial * num_words + word); positive are the words above 0 and
+    # values their activations. returns the new letter states, the net input
+    # of a word without any active letters in each trial (baseline), the
+    # active set (in order) and the support the letters give each of its
+    # words.
+    def _pruned_inputs(self, letter_state, feature_input, positive, values, num_trials):
+        connectivity = self.connectivity
+        clipped_letters = np.clip(letter_state, 0, None)
+        positive_trials, positive_words = np.divmod(positive, self.num_words)
+
+        letter_net_input = feature_input + connectivity.sparse_words_to_letters(positive_trials, positive_words, values, num_trials).reshape(letter_state.shape)
+        if self.letter_inhibition != 0:
+            letter_net_input = letter_net_input + compute_inhibition(self.letter_inhibition, clipped_letters)
+
+        # a word that contains none of the active letters, and is not above 0
+        # itself, gets the same net input as every other such word in its
+        # trial: inhibition from all the active letters and from all the
+        # active words.
+        letter_totals = np.sum(clipped_letters.reshape(num_trials, -1), axis=-1)
+        # (np.bincount always adds up in float64, so convert back to the
+        # dtype of the model, or a float32 model would turn into float64.)
+        word_totals = np.bincount(positive_trials, weights=values, minlength=num_trials).astype(self.dtype, copy=False)
+        baseline = -connectivity.letter_word_inhibition * letter_totals - self.word_inhibition * word_totals
+
+        # the words that do contain active letters get excitation from them
+        # on top of that. the ones whose net input comes within prune_margin
+        # of 0 join the words above 0 in the active set.
+        candidates, matched = connectivity.matched_words(clipped_letters.reshape(num_trials, self.positions, self.num_letters))
+        candidate_support = (connectivity.letter_word_excitation + connectivity.letter_word_inhibition) * matched
+        close = candidate_support + baseline[candidates // self.num_words] > -self.prune_margin
+        # (both are in order, so they are merged rather than sorted again.)
+        active = np.concatenate([positive, candidates[close]])
+        active.sort(kind='stable')
+        active = active[np.concatenate([[True], active[1:] != active[:-1]])] if len(active) else active
+
+        # (the words above 0 that have none of the active letters get no
+        # support.)
+        support = np.zeros(len(active), dtype=candidate_support.dtype)
+        found = np.minimum(np.searchsorted(candidates, active), max(len(candidates) - 1, 0))
+        has_letters = candidates[found] == active if len(candidates) else np.zeros(len(active), dtype=bool)
+        support[has_letters] = candidate_support[found[has_letters]]
+        self.active_words = len(active)
+
+        letter_effect = compute_effect(letter_net_input, letter_state, self.min_value, self.max_value)
+        letter_state = compute_activation(letter_effect, letter_state, self.decay_rate, 0.0, self.min_value, self.max_value)
+
+        return letter_state, baseline, active, support
+
+    # the full update for the words of the active set, which have the
+    # activations current.
+    def _update_active_words(self, current, active, support, baseline):
+        active_trials, active_words = np.divmod(active, self.num_words)
+        net_input = support + baseline[active_trials] + self.word_inhibition * np.clip(current, 0, None)
+        effect = compute_effect(net_input, current, self.min_value, self.max_value)
+
+        return compute_activation(effect, current, self.decay_rate, self.word_resting_state[active_words], self.min_value, self.max_value)
+
+    # the same as update_from_input(), with each phase timed separately. (the
+    # feature input is timed by update(), when it is worked out there.)
+    def _profiled_update(self, letter_state, word_state, feature_input, profiler, letter_noise=None, word_noise=None):
+        token = profiler.begin_step()
+        letter_decay, letter_min, letter_max, letter_inhibition = self._layer_parameters(2)
+        word_decay, word_min, word_max, word_inhibition = self._layer_parameters(1)
+
+        t = profiler.now()
+        clipped_letters = np.clip(letter_state, 0, None)
+        clipped_words = np.clip(word_state, 0, None)
+        t = profiler.lap('IAModel', 'clip', t)
+
+        letter_net_input = feature_input + self.connectivity.words_to_letters(clipped_words)
+        t = profiler.lap('IAModel', 'words->letters', t)
+        word_net_input = self.connectivity.letters_to_words(clipped_letters)
+        t = profiler.lap('IAModel', 'letters->words', t)
+
+        if np.any(np.not_equal(letter_inhibition, 0)):
+            letter_net_input = letter_net_input + compute_inhibition(letter_inhibition, clipped_letters)
+        if np.any(np.not_equal(word_inhibition, 0)):
+            word_net_input = word_net_input + compute_inhibition(word_inhibition, clipped_words)
+        if letter_noise is not None:
+            letter_net_input = letter_net_input + letter_noise
+        if word_noise is not None:
+            word_net_input = word_net_input + word_noise
+        t = profiler.lap('IAModel', 'inhibition', t)
+
+        letter_effect = compute_effect(letter_net_input, letter_state, letter_min, letter_max)
+        word_effect = compute_effect(word_net_input, word_state, word_min, word_max)
+        t = profiler.lap('IAModel', 'effect', t)
+        letter_state = compute_activation(letter_effect, letter_state, letter_decay, 0.0, letter_min, letter_max)
+        word_state = compute_activation(word_effect, word_state, word_decay, self.word_resting_state, word_min, word_max)
+        profiler.lap('IAModel', 'activation', t)
+
+        profiler.end_step(token, 'IAModel', [('letters', letter_state), ('words', word_state)])
+
+        return letter_state, word_state
+
+    # run a whole trial from the resting state. the stimulus is a pair
+    # (input_present, input_absence), as used in the scripts, which is shown
+    # for the whole trial, or a Schedule (then cycles defaults to the length
+    # of the schedule). returns the letter activations with shape
+    # (cycles, [batch_size,] positions, 26) and the word activations with
+    # shape (cycles, [batch_size,] num_words).
+    # if a TraceRecorder is given, only the units it tracks are recorded
+    # (into the recorder, which is returned) instead of the full traces.
+    # if a Snapshot is given as start, the trial carries on from its states
+    # instead of from the resting state (the stimulus and the traces then
+    # start at the cycle of the snapshot).
+    def run(self, stimulus, cycles=None, recorder=None, start=None):
+        schedule = self.compile_schedule(stimulus, cycles)
+        if cycles is None:
+            cycles = schedule.cycles
+
+        if start is None:
+            self.reset()
+        else:
+            self.restore(start)
+        if recorder is not None:
+            for i in range(cycles):
+                self.advance(schedule.input(i))
+                recorder.record(i, self.letter_state, self._recorded_words())
+            recorder.flush()
+
+            return recorder
+
+        letter_trace = np.zeros((cycles,) + self.letter_state.shape, dtype=self.dtype)
+        word_trace = np.zeros((cycles,) + self.word_state.shape, dtype=self.dtype)
+        for i in range(cycles):
+            letter_trace[i], word_trace[i] = self.step_from_input(schedule.input(i))
+
+        return letter_trace, word_trace
+
+    # run several continuations of the same trial from a Snapshot of a single
+    # trial, all at once as one batch. continuations is a list with a
+    # stimulus or a Schedule for each one (e.g. different masks, or the same
+    # stimulus for different numbers of cycles before the mask), shown from
+    # the cycle of the snapshot onwards. cycles defaults to the longest
+    # schedule. returns traces like run() with a batch dimension of one
+    # trial per continuation. the continuations run on a batched copy of the
+    # model (see with_batch_size), so the model itself is left as it was.
+    def fork(self, snapshot, continuations, cycles=None, recorder=None):
+        self._check_snapshot(snapshot)
+        if snapshot.batch_size is not None:
+            raise ValueError("can only fork from a snapshot of a single trial")
+        if self.parameters_vary:
+            raise ValueError("can't fork a model whose parameters vary per trial")
+
+        schedules = [self.compile_schedule(continuation, cycles) for continuation in continuations]
+        if cycles is None:
+            cycles = max(schedule.cycles for schedule in schedules)
+
+        # every continuation starts from a copy of the snapshot.
+        model = self.with_batch_size(len(schedules))
+        model.letter_state = np.broadcast_to(snapshot.letter_state, (model.batch_size,) + snapshot.letter_state.shape).astype(self.dtype, order='C')
+        model.word_state = np.broadcast_to(snapshot.word_state, (model.batch_size,) + snapshot.word_state.shape).astype(self.dtype, order='C')
+        model.cycle = snapshot.cycle
+
+        if recorder is None:
+            letter_trace = np.zeros((cycles,) + model.letter_state.shape, dtype=self.dtype)
+            word_trace = np.zeros((cycles,) + model.word_state.shape, dtype=self.dtype)
+
+        # the feature inputs of the continuations are only stacked again when
+        # one of them moves on to its next segment.
+        segments = None
+        for i in range(cycles):
+            current = [schedule.segment(i) for schedule in schedules]
+            if current != segments:
+                segments = current
+                feature_input = np.stack([schedule.input(i) for schedule in schedules])
+
+            if recorder is not None:
+                model.advance(feature_input)
+                recorder.record(i, model.letter_state, model._recorded_words())
+            else:
+                letter_trace[i], word_trace[i] = model.step_from_input(feature_input)
+
+        if recorder is not None:
+            recorder.flush()
+
+            return recorder
+
+        return letter_trace, word_trace
+
+    # a CompiledSchedule for a stimulus (see run()). a single stimulus is shown
+    # for all the cycles, so its feature input is only worked out once.
+    def compile_schedule(self, stimulus, cycles=None):
+        if not isinstance(stimulus, Schedule):
+            if cycles is None:
+                raise ValueError("cycles must be given for a stimulus that is not a Schedule")
+            stimulus = Schedule([(cycles, stimulus)])
+
+        return stimulus.compile(self)
+
+    # run a trial from the resting state until it stops by itself, for at
+    # most max_cycles cycles. a trial stops on the first cycle where any of
+    # the criteria that are given is met:
+    #   tolerance: no letter or word activation changed by more than this
+    #     (the network has settled).
+    #   threshold: the target word's activation reached this value. targets
+    #     is a word, or a list with one word per trial when batched. without
+    #     targets, any word reaching the threshold counts.
+    #   margin: the most active word is ahead of the second most active word
+    #     by at least this much.
+    # in a batch, trials that have stopped are frozen and left out of the
+    # remaining cycles while the others continue.
+    # returns (latencies, stopped): the cycle on which each trial stopped
+    # (counting from 1, max_cycles if it never did) and whether it stopped.
+    # both are arrays with one entry per trial, or scalars when not batched.
+    # the final states are left in the model, and if a recorder is given every
+    # cycle that ran is recorded into it. the stimulus can also be a Schedule.
+    def run_until(self, stimulus, max_cycles, tolerance=None, threshold=None, targets=None, margin=None, recorder=None):
+        if tolerance is None and threshold is None and margin is None:
+            raise ValueError("at least one of tolerance, threshold or margin must be given")
+
+        schedule = self.compile_schedule(stimulus, max_cycles)
+
+        # a single trial is run as a batch of one.
+        self.reset()
+        batched = self.batch_size is not None
+        letter_state = self.letter_state if batched else self.letter_state[np.newaxis]
+        word_state = self.word_state if batched else self.word_state[np.newaxis]
+        num_trials = len(word_state)
+
+        if targets is not None:
+            if isinstance(targets, str):
+                targets = [targets] * num_trials
+            target_indices = np.array([self.lexicon.index(target) for target in targets], dtype=np.intp)
+
+        latencies = np.full(num_trials, max_cycles)
+        stopped = np.zeros(num_trials, dtype=bool)
+        active = np.arange(num_trials)
+
+        for cycle in range(max_cycles):
+            # a feature input with a batch dimension has one entry per trial.
+            feature_input = schedule.input(cycle)
+            if feature_input.ndim == 3:
+                feature_input = feature_input[active]
+            new_letter_state, new_word_state = self.subset(active).update_from_input(letter_state[active], word_state[active], feature_input)
+
+            done = np.zeros(len(active), dtype=bool)
+            if tolerance is not None:
+                letter_change = np.max(np.abs(new_letter_state - letter_state[active]), axis=(-2, -1))
+                word_change = np.max(np.abs(new_word_state - word_state[active]), axis=-1)
+                done |= np.maximum(letter_change, word_change) < tolerance
+            if threshold is not None:
+                if targets is None:
+                    done |= np.max(new_word_state, axis=-1) >= threshold
+                else:
+                    done |= new_word_state[np.arange(len(active)), target_indices[active]] >= threshold
+            if margin is not None:
+                top_two = np.partition(new_word_state, -2, axis=-1)[:, -2:]
+                done |= top_two[:, 1] - top_two[:, 0] >= margin
+
+            letter_state[active] = new_letter_state
+            word_state[active] = new_word_state
+            latencies[active[done]] = cycle + 1
+            stopped[active[done]] = True
+
+            if recorder is not None:
+                recorder.record(cycle, self.letter_state, self.word_state)
+
+            self.cycle = cycle + 1
+            active = active[~done]
+            if len(active) == 0:
+                break
+
+        if recorder is not None:
+            recorder.flush()
+
+        if not batched:
+            return latencies[0], stopped[0]
+
+        return latencies, stopped
+
+    # a TraceRecorder for this model, see TraceRecorder for the arguments.
+    def recorder(self, cycles, words=None, letters=None, path=None):
+        return TraceRecorder(self.lexicon, cycles, words=words, letters=letters, batch_size=self.batch_size, path=path, dtype=self.dtype)
+
+# the word layer of a pruned model (see IAModel.prune_margin) stepping its own
+# states, with the words outside the active set left behind. each cycle,
+# every such word in a trial gets the same update,
+#   s -> s - decay_rate * (s - resting_state) + baseline * (s - min_value),
+# which is the affine map a * s + decay_rate * resting_state + c with
+# a = 1 - decay_rate + baseline and c = -baseline * min_value (with a >= 0
+# it never leaves [min_value, 0], so there is nothing to clip). these maps
+# are composed as the cycles go by, per trial, and every word remembers the
+# cycle it was last brought up to date on. a word that comes back into the
+# active set, or is read, then gets all the updates it missed at once, so a
+# cycle only costs as much as the active set. (this rounds differently from
+# updating every word on every cycle, far below the error of the pruning.)
+class _LazyWordState:
+    def __init__(self, model, word_state):
+        self.model = model
+        self.shape = word_state.shape
+        self.dtype = model.dtype
+        self.values = np.array(word_state, dtype=self.dtype).reshape(-1)
+        self.num_trials = len(self.values) // model.num_words
+
+        # the words above 0, which are all up to date.
+        self.positive = np.flatnonzero(self.values > 0)
+        self._start()
+
+    # start composing the maps again from the current cycle: after n cycles
+    # a word that was at s (and has been left behind since) is at
+    #   scale[n] * s + rest[n] * resting_state + offset[n]
+    # with one value per trial.
+    def _start(self):
+        self.cycles = 0
+        self.updated = np.zeros(len(self.values), dtype=np.intp)
+        self.scale = np.ones((64, self.num_trials))
+        self.rest = np.zeros((64, self.num_trials))
+        self.offset = np.zeros((64, self.num_trials))
+
+    # the maps from every cycle since _start() to now, as (cycles + 1,
+    # num_trials) arrays: a word updated on cycle k is now at
+    #   ratio[k] * s + rest[k] * resting_state + offset[k]
+    # (which leaves the words that are up to date exactly as they are).
+    def _maps(self):
+        n = self.cycles
+        ratio = self.scale[n] / self.scale[:n + 1]
+        rest = self.rest[n] - ratio * self.rest[:n + 1]
+        offset = self.offset[n] - ratio * self.offset[:n + 1]
+
+        return ratio.reshape(-1), rest.reshape(-1), offset.reshape(-1)
+
+    # the current activations of some of the words (indices into the
+    # flattened word layer).
+    def current(self, words):
+        current = self.values[words]
+        behind = np.flatnonzero(self.updated[words] != self.cycles)
+        words = words[behind]
+        trials, word_indices = np.divmod(words, self.model.num_words)
+        maps = self.updated[words] * self.num_trials + trials
+
+        ratio, rest, offset = self._maps()
+        current[behind] = ratio[maps] * current[behind] + rest[maps] * self.model.word_resting_state[word_indices] + offset[maps]
+
+        return current
+
+    # every word brought up to date, with the shape of the word layer.
+    def materialize(self):
+        maps = self.updated.reshape(self.num_trials, -1) * self.num_trials + np.arange(self.num_trials)[:, np.newaxis]
+        ratio, rest, offset = self._maps()
+        values = ratio[maps] * self.values.reshape(self.num_trials, -1) + rest[maps] * self.model.word_resting_state + offset[maps]
+
+        return values.astype(self.dtype, copy=False).reshape(self.shape)
+
+    # ndarray.take() on the current activations, which only brings the
+    # words that are taken up to date (see TraceRecorder.record).
+    def take(self, indices, axis=-1, out=None):
+        words = np.arange(0, len(self.values), self.model.num_words)[:, np.newaxis] + indices
+        taken = self.current(words.ravel()).reshape(self.shape[:-1] + (len(indices),))
+        if out is None:
+            return taken
+        out[...] = taken
+
+        return out
+
+    # one cycle: returns the new letter states.
+    def step(self, letter_state, feature_input):
+        model = self.model
+        letter_state, baseline, active, support = model._pruned_inputs(letter_state, feature_input, self.positive, self.values[self.positive], self.num_trials)
+        active_state = model._update_active_words(self.current(active), active, support, baseline)
+
+        baseline = baseline.astype(np.float64)
+        a = 1 - model.decay_rate + baseline
+        if np.any(a < 0):
+            # strong enough inhibition can push the words below min_value,
+            # which the maps can't clip, so this cycle updates every word.
+            self.values = self.materialize().reshape(-1)
+            self._start()
+            word_state = self.values.reshape(self.num_trials, -1)
+            effect = baseline[:, np.newaxis].astype(self.dtype) * (word_state - model.min_value)
+            self.values = compute_activation(effect, word_state, model.decay_rate, model.word_resting_state, model.min_value, model.max_value).reshape(-1)
+        else:
+            if self.cycles + 1 == len(self.scale):
+                self.scale, self.rest, self.offset = [np.concatenate([maps, np.empty_like(maps)]) for maps in (self.scale, self.rest, self.offset)]
+            n = self.cycles
+            self.scale[n + 1] = a * self.scale[n]
+            self.rest[n + 1] = a * self.rest[n] + model.decay_rate
+            self.offset[n + 1] = a * self.offset[n] - baseline * model.min_value
+            self.cycles = n + 1
+
+        self.values[active] = active_state
+        self.updated[active] = self.cycles
+        self.positive = active[active_state > 0]
+
+        # the words that have been behind for long enough to have decayed
+        # away entirely are brought up to date before the scale underflows.
+        if np.min(self.scale[self.cycles]) < 1e-100:
+            self.values = self.materialize().reshape(-1)
+            self._start()
+
+        return letter_state
+
+
+# the quickest way to get a model that is ready to run: load (or compile and
+# cache) the weights for words_path and params and build an IAModel from them.
+def load_model(params=None, words_path=DEFAULT_WORDS_PATH, batch_size=None, cache_dir=None, use_cache=True, dtype=np.float64, prune_margin=None):
+    weights = load_weights(words_path, params, cache_dir=cache_dir, use_cache=use_cache, dtype=dtype)
+
+    return IAModel.from_weights(weights, batch_size=batch_size, prune_margin=prune_margin)
@@ -0,0 +1,264 @@
+import numpy as np
+
+from .schedule import CompiledSchedule, Schedule
+from .stimulus import blank_stimulus
+
+
+# the constants of the Philox4x32-10 generator, see philox4x32.
+PHILOX_M0 = np.uint64(0xD2511F53)
+PHILOX_M1 = np.uint64(0xCD9E8D57)
+PHILOX_W0 = 0x9E3779B9
+PHILOX_W1 = 0xBB67AE85
+PHILOX_ROUNDS = 10
+
+_LOW_32 = np.uint64(0xFFFFFFFF)
+_SHIFT_32 = np.uint64(32)
+
+
+# the Philox4x32-10 counter-based random number generator (Salmon et al.,
+# 2011), vectorized over numpy arrays. it turns a 128 bit counter and a 64
+# bit key into 128 random bits with no state in between, so the random
+# numbers for any (replication, cycle, unit) can be worked out directly from
+# those numbers. a replication therefore gets the same noise whether it runs
+# in a batch of 1 or of 1000, or in another process. counter is a list of 4
+# uint32 arrays (which are broadcast together) and key a pair of uint32s;
+# returns 4 uint32 arrays.
+def philox4x32(counter, key):
+    c0, c1, c2, c3 = (np.array(c) for c in np.broadcast_arrays(*(np.asarray(c, dtype=np.uint64) for c in counter)))
+    k0, k1 = int(key[0]), int(key[1])
+
+    # the 32x32 bit products are done in 64 bits, in place.
+    product0 = np.empty_like(c0)
+    product1 = np.empty_like(c0)
+    for _ in range(PHILOX_ROUNDS):
+        np.multiply(c0, PHILOX_M0, out=product0)
+        np.multiply(c2, PHILOX_M1, out=product1)
+        np.right_shift(product1, _SHIFT_32, out=c0)
+        c0 ^= c1
+        c0 ^= np.uint64(k0)
+        np.bitwise_and(product1, _LOW_32, out=c1)
+        np.right_shift(product0, _SHIFT_32, out=c2)
+        c2 ^= c3
+        c2 ^= np.uint64(k1)
+        np.bitwise_and(product0, _LOW_32, out=c3)
+        k0 = (k0 + PHILOX_W0) & 0xFFFFFFFF
+        k1 = (k1 + PHILOX_W1) & 0xFFFFFFFF
+
+    return [c.astype(np.uint32) for c in (c0, c1, c2, c3)]
+
+
+# the random streams drawn from for each cycle: the letter and word net
+# inputs and the present and absent features.
+LETTER_STREAM = 0
+WORD_STREAM = 1
+FEATURE_STREAM = 2
+
+
+# standard normal noise for a set of replications on one cycle, with shape
+# (len(replications),) + shape. the numbers only depend on the seed, the
+# stream, the replication, the cycle and the position in shape, see
+# philox4x32. four normals come from each block of 128 random bits (by the
+# Box-Muller transform).
+def normal_noise(seed, stream, replications, cycle, shape):
+    size = int(np.prod(shape))
+    blocks = (size + 3) // 4
+    replications = np.asarray(replications, dtype=np.uint64)
+
+    counter = [
+        np.arange(blocks, dtype=np.uint64),
+        np.uint64(cycle),
+        (replications & _LOW_32)[:, np.newaxis],
+        (np.uint64(stream) << np.uint64(16)) | (replications >> _SHIFT_32)[:, np.newaxis],
+    ]
+    bits = philox4x32(counter, (seed & 0xFFFFFFFF, (seed >> 32) & 0xFFFFFFFF))
+
+    # uniforms in (0, 1), never exactly 0, so the log is always finite.
+    uniform = [(b + 0.5) / 2.0 ** 32 for b in bits]
+    radius0 = np.sqrt(-2 * np.log(uniform[0]))
+    radius1 = np.sqrt(-2 * np.log(uniform[2]))
+    angle0 = 2 * np.pi * uniform[1]
+    angle1 = 2 * np.pi * uniform[3]
+    normals = np.stack([radius0 * np.cos(angle0), radius0 * np.sin(angle0), radius1 * np.cos(angle1), radius1 * np.sin(angle1)], axis=-1)
+
+    return normals.reshape(len(replications), -1)[:, :size].reshape((len(replications),) + tuple(shape))
+
+
+# the results of run_monte_carlo, one entry per replication:
+#   replications[r]: the number of the replication (its random stream).
+#   responses[r]: the index of the word that was given as the response:
+#     the first word to reach the threshold, or with no threshold the most
+#     active word at the end of the trial. -1 if no word reached the
+#     threshold.
+#   latencies[r]: the cycle on which the response word reached the
+#     threshold, counting from 1, or NaN if there was no response (or no
+#     threshold).
+# target is the index of the correct response, if any.
+class MonteCarloResult:
+    def __init__(self, words, replications, responses, latencies, target=None):
+        self.words = words
+        self.replications = replications
+        self.responses = responses
+        self.latencies = latencies
+        self.target = target
+
+    # put together the results of several runs of the same condition (e.g.
+    # separate ranges of replications run in different processes), in order
+    # of replication.
+    @classmethod
+    def combine(cls, results):
+        replications = np.concatenate([result.replications for result in results])
+        order = np.argsort(replications, kind='stable')
+        responses = np.concatenate([result.responses for result in results])[order]
+        latencies = np.concatenate([result.latencies for result in results])[order]
+
+        return cls(results[0].words, replications[order], responses, latencies, results[0].target)
+
+    # the share of replications that responded with the target word.
+    def accuracy(self):
+        if self.target is None:
+            raise ValueError("accuracy needs a target word")
+
+        return np.mean(self.responses == self.target)
+
+    # the share of replications that gave each response, as (words, shares)
+    # with the most common response first. a missing response is listed as
+    # None.
+    def response_distribution(self):
+        responses, counts = np.unique(self.responses, return_counts=True)
+        order = np.argsort(-counts, kind='stable')
+        words = [self.words[response] if response >= 0 else None for response in responses[order]]
+
+        return words, counts[order] / len(self.responses)
+
+    # the quantiles of the latencies of the replications that responded. with
+    # correct_only=True, only those that responded with the target word.
+    def latency_quantiles(self, quantiles=(0.1, 0.25, 0.5, 0.75, 0.9), correct_only=False):
+        latencies = self.latencies[self.responses >= 0]
+        if correct_only:
+            if self.target is None:
+                raise ValueError("correct_only needs a target word")
+            latencies = self.latencies[self.responses == self.target]
+        if len(latencies) == 0:
+            return np.full(len(quantiles), np.nan)
+
+        return np.quantile(latencies, quantiles)
+
+    # one row per replication.
+    def to_dataframe(self):
+        import pandas as pd
+
+        words = np.array(list(self.words) + [None], dtype=object)
+
+        return pd.DataFrame({
+            'replication': self.replications,
+            'response': words[self.responses],
+            'latency': self.latencies,
+        })
+
+    # a plain text summary: the accuracy (given a target), the latency
+    # quantiles and the most common responses.
+    def summary(self, top=5):
+        lines = ['%d replications' % len(self.replications)]
+        if self.target is not None:
+            lines.append('accuracy: %.3f (target %s)' % (self.accuracy(), self.words[self.target]))
+
+        quantiles = (0.1, 0.25, 0.5, 0.75, 0.9)
+        lines.append('latency quantiles: ' + ', '.join('%g: %.1f' % (q, latency) for q, latency in zip(quantiles, self.latency_quantiles(quantiles))))
+
+        lines.append('%-10s %8s' % ('response', 'share'))
+        words, shares = self.response_distribution()
+        for word, share in zip(words[:top], shares[:top]):
+            lines.append('%-10s %8.3f' % ('(none)' if word is None else word, share))
+
+        return '\n'.join(lines)
+
+
+# run many noisy replications of one trial and summarize them without
+# keeping any traces. on every cycle, gaussian noise with a standard
+# deviation of noise is added to the net input of every letter and word
+# unit, and with feature_noise to every present and absent feature of the
+# stimulus. the stimulus is a pair (input_present, input_absence) for a
+# single trial, or a Schedule of them.
+# replications are numbered first_replication, first_replication + 1, ...
+# and each one draws from its own random stream (see normal_noise), so the
+# replications can be split up between processes in any way and put back
+# together with MonteCarloResult.combine(), with the same result. they are
+# run batch_size at a time.
+# the response of a replication is the first word to reach threshold (or
+# target, if given, to compare with), see MonteCarloResult. a replication
+# stops once it has responded.
+def run_monte_carlo(model, stimulus, replications, cycles=None, noise=0.0, feature_noise=0.0, threshold=None, target=None, seed=0, first_replication=0, batch_size=256):
+    if model.prune_margin is not None:
+        raise ValueError("the noisy model does not support prune_margin")
+    if model.parameters_vary:
+        raise ValueError("the noisy model does not support parameters that vary per trial")
+
+    if not isinstance(stimulus, Schedule):
+        if cycles is None:
+            raise ValueError("cycles must be given for a stimulus that is not a Schedule")
+        stimulus = Schedule([(cycles, stimulus)])
+    if cycles is None:
+        cycles = stimulus.cycles
+
+    # with feature noise, the stimulus of each segment is needed rather than
+    # its feature input.
+    if feature_noise:
+        features = [blank_stimulus(model.positions) if segment is None else segment for _, segment in stimulus.segments]
+        schedule = CompiledSchedule([duration for duration, _ in stimulus.segments], [np.stack(segment).astype(model.dtype) for segment in features])
+    else:
+        schedule = stimulus.compile(model)
+
+    target_index = None if target is None else model.lexicon.index(target)
+
+    responses = np.full(replications, -1, dtype=np.intp)
+    latencies = np.full(replications, np.nan)
+
+    for start in range(0, replications, batch_size):
+        stop = min(start + batch_size, replications)
+        batch_responses, batch_latencies = _run_batch(model, schedule, np.arange(start, stop) + first_replication, cycles, noise, feature_noise, threshold, seed)
+        responses[start:stop] = batch_responses
+        latencies[start:stop] = batch_latencies
+
+    return MonteCarloResult(model.lexicon.words, np.arange(replications) + first_replication, responses, latencies, target_index)
+
+
+# run one batch of replications, see run_monte_carlo.
+def _run_batch(model, schedule, replications, cycles, noise, feature_noise, threshold, seed):
+    num_trials = len(replications)
+    letter_state = np.zeros((num_trials, model.positions, model.num_letters), dtype=model.dtype)
+    word_state = np.broadcast_to(model.word_resting_state, (num_trials, model.num_words)).copy()
+
+    responses = np.full(num_trials, -1, dtype=np.intp)
+    latencies = np.full(num_trials, np.nan)
+    active = np.arange(num_trials)
+
+    for cycle in range(cycles):
+        running = replications[active]
+
+        if feature_noise:
+            present, absence = schedule.input(cycle)
+            noisy = feature_noise * normal_noise(seed, FEATURE_STREAM, running, cycle, (2,) + present.shape).astype(model.dtype)
+            feature_input = model.feature_input(present + noisy[:, 0], absence + noisy[:, 1])
+        else:
+            feature_input = schedule.input(cycle)
+
+        letter_noise = word_noise = None
+        if noise:
+            letter_noise = noise * normal_noise(seed, LETTER_STREAM, running, cycle, letter_state.shape[1:]).astype(model.dtype)
+            word_noise = noise * normal_noise(seed, WORD_STREAM, running, cycle, word_state.shape[1:]).astype(model.dtype)
+
+        letter_state[active], word_state[active] = model.update_from_input(letter_state[active], word_state[active], feature_input, letter_noise, word_noise)
+
+        if threshold is not None:
+            states = word_state[active]
+            done = np.max(states, axis=-1) >= threshold
+            responses[active[done]] = np.argmax(states[done], axis=-1)
+            latencies[active[done]] = cycle + 1
+            active = active[~done]
+            if len(active) == 0:
+                break
+
+    if threshold is None:
+        responses = np.argmax(word_state, axis=-1)
+
+    return responses, latencies
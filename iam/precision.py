@@ -0,0 +1,125 @@
+import numpy as np
+
+from .lexicon import DEFAULT_WORDS_PATH
+from .model import load_model
+from .stimulus import word_stimulus
+
+
+# the results of check_precision and check_pruning, one entry per cycle:
+#   letter_deviations[t]: the largest difference between any letter
+#     activation of the two models after cycle t (over all trials).
+#   word_deviations[t]: the same for the word activations.
+#   winner_changes[t]: the number of trials whose most active word differs
+#     between the two models after cycle t.
+#   reference_winners and winners: the most active word of each trial after
+#     each cycle, as (cycles, num_trials) arrays, for the float64 reference
+#     and for the model being checked.
+#   active_words[t]: for a pruned model, the number of words (over all
+#     trials) that got the full update on cycle t.
+# name says which model was checked, e.g. "float32".
+class PrecisionReport:
+    def __init__(self, name, words, letter_deviations, word_deviations, reference_winners, winners, active_words=None):
+        self.name = name
+        self.words = words
+        self.letter_deviations = letter_deviations
+        self.word_deviations = word_deviations
+        self.reference_winners = reference_winners
+        self.winners = winners
+        self.active_words = active_words
+        self.winner_changes = np.sum(reference_winners != winners, axis=-1)
+
+    # the largest activation difference seen on any cycle, in either layer.
+    def max_deviation(self):
+        return max(np.max(self.letter_deviations), np.max(self.word_deviations))
+
+    # whether the two models agree: no trial ever has a different winner and
+    # (if a tolerance is given) no activation ever differs by more than it.
+    def equivalent(self, tolerance=None):
+        if np.any(self.winner_changes):
+            return False
+
+        return tolerance is None or self.max_deviation() <= tolerance
+
+    # one row per cycle.
+    def to_dataframe(self):
+        import pandas as pd
+
+        columns = {
+            'timestep': np.arange(len(self.word_deviations)),
+            'letter_deviation': self.letter_deviations,
+            'word_deviation': self.word_deviations,
+            'winner_changes': self.winner_changes,
+        }
+        if self.active_words is not None:
+            columns['active_words'] = self.active_words
+
+        return pd.DataFrame(columns)
+
+    # a plain text table: the deviations and winner changes on each cycle,
+    # followed by the overall largest deviation.
+    def summary(self):
+        lines = ['%-10s %16s %16s %15s' % ('timestep', 'letter deviation', 'word deviation', 'winner changes')]
+        for i in range(len(self.word_deviations)):
+            lines.append('%-10d %16.3g %16.3g %15d' % (i, self.letter_deviations[i], self.word_deviations[i], self.winner_changes[i]))
+
+        lines.append('')
+        lines.append('%s vs the float64 reference: max deviation %.3g, %d winner changes' % (self.name, self.max_deviation(), np.sum(self.winner_changes)))
+
+        return '\n'.join(lines)
+
+
+# run a model with a reduced precision dtype (float32 by default) side by side
+# with the float64 reference, from the same weights and on the same stimulus,
+# and report after every cycle how far the activations drifted apart and
+# whether any trial's winning word changed. the stimulus is a pair
+# (input_present, input_absence) like IAModel.run() takes, batched or not.
+# without one, every word in the lexicon is presented, one per trial, which is
+# the check to run before switching a lexicon and parameter set to float32.
+def check_precision(stimulus=None, cycles=40, dtype=np.float32, params=None, words_path=DEFAULT_WORDS_PATH):
+    reference = load_model(params, words_path)
+    model = load_model(params, words_path, dtype=dtype)
+
+    return compare_models(reference, model, stimulus, cycles, str(np.dtype(dtype)))
+
+
+# the same check for the approximate word update of IAModel.prune_margin: a
+# model pruned with the given margin against the exact one.
+def check_pruning(prune_margin, stimulus=None, cycles=40, params=None, words_path=DEFAULT_WORDS_PATH):
+    reference = load_model(params, words_path)
+    model = load_model(params, words_path, prune_margin=prune_margin)
+
+    return compare_models(reference, model, stimulus, cycles, "pruned (margin %g)" % prune_margin)
+
+
+# run model side by side with the reference model (two IAModels built from the
+# same lexicon) and compare them after every cycle, see check_precision.
+def compare_models(reference, model, stimulus=None, cycles=40, name="model"):
+    if stimulus is None:
+        stimulus = word_stimulus(reference.lexicon.words)
+    input_present, input_absence = np.asarray(stimulus[0]), np.asarray(stimulus[1])
+
+    # a batched stimulus needs batched models. they are run as copies, so
+    # the models that were passed in are left as they are.
+    batch_size = len(input_present) if input_present.ndim == 3 else None
+    reference = reference.with_batch_size(batch_size)
+    model = model.with_batch_size(batch_size)
+
+    letter_deviations = np.zeros(cycles)
+    word_deviations = np.zeros(cycles)
+    num_trials = 1 if reference.batch_size is None else reference.batch_size
+    reference_winners = np.zeros((cycles, num_trials), dtype=np.intp)
+    winners = np.zeros((cycles, num_trials), dtype=np.intp)
+    active_words = np.zeros(cycles, dtype=int) if model.prune_margin is not None else None
+
+    for i in range(cycles):
+        reference_letters, reference_words = reference.step(input_present, input_absence)
+        letters, words = model.step(input_present, input_absence)
+
+        letter_deviations[i] = np.max(np.abs(reference_letters - letters))
+        word_deviations[i] = np.max(np.abs(reference_words - words))
+        reference_winners[i] = np.argmax(reference_words, axis=-1)
+        winners[i] = np.argmax(words, axis=-1)
+        if active_words is not None:
+            active_words[i] = model.active_words
+
+    return PrecisionReport(name, reference.lexicon.words, letter_deviations, word_deviations, reference_winners, winners, active_words)
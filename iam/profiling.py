@@ -0,0 +1,132 @@
+import time
+import tracemalloc
+from collections import defaultdict
+
+import numpy as np
+
+
+# the profiler that is currently collecting, if any. IAPool.step and
+# IAModel.update check this once per call and only take their instrumented
+# path when it is set, so profiling costs next to nothing when it is off.
+active = None
+
+
+# collects per-phase timings and per-layer counters from IAPool and IAModel.
+# use it as a context manager around any run:
+#
+#   with Profiler() as profiler:
+#       model.run(stimulus, 40)
+#   print(profiler.summary())
+#
+# phases are timed with time.perf_counter. with track_allocations=True the
+# bytes allocated by each step are measured with tracemalloc too, which
+# slows everything down, so it is off by default.
+class Profiler:
+    def __init__(self, track_allocations=False):
+        self.track_allocations = track_allocations
+
+        # (scope, phase) -> [calls, seconds]
+        self.phases = defaultdict(lambda: [0, 0.0])
+        # (scope, counter) -> [steps, total]
+        self.counters = defaultdict(lambda: [0, 0])
+
+        self._previous = None
+        self._started_tracemalloc = False
+
+    def __enter__(self):
+        global active
+        self._previous = active
+        active = self
+
+        if self.track_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+        return self
+
+    def __exit__(self, *exc_info):
+        global active
+        active = self._previous
+
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    # time since `start` is added to a phase. returns the current time, so
+    # that consecutive phases can be timed as
+    #   t = profiler.now()
+    #   ...
+    #   t = profiler.lap(scope, 'first phase', t)
+    #   ...
+    #   t = profiler.lap(scope, 'second phase', t)
+    def now(self):
+        return time.perf_counter()
+
+    def lap(self, scope, phase, start):
+        end = time.perf_counter()
+        entry = self.phases[(scope, phase)]
+        entry[0] += 1
+        entry[1] += end - start
+
+        return end
+
+    def count(self, scope, counter, value):
+        entry = self.counters[(scope, counter)]
+        entry[0] += 1
+        entry[1] += value
+
+    # called around a whole step: starts measuring allocations (if enabled)
+    # and returns a token for end_step.
+    def begin_step(self):
+        if not self.track_allocations:
+            return None
+
+        tracemalloc.reset_peak()
+
+        return tracemalloc.get_traced_memory()[0]
+
+    # records the bytes allocated during a step under scope, and the number
+    # of positive units in each of the given (name, state) layers after it.
+    def end_step(self, token, scope, layers):
+        if token is not None:
+            self.count(scope, 'bytes allocated', tracemalloc.get_traced_memory()[1] - token)
+        for name, state in layers:
+            self.count(name, 'positive units', int(np.count_nonzero(state > 0)))
+
+    # everything collected as a list of rows:
+    # (scope, name, calls, total, mean) where total and mean are seconds for
+    # phases and plain values for counters.
+    def rows(self):
+        rows = []
+        for (scope, phase), (calls, seconds) in sorted(self.phases.items()):
+            rows.append((scope, phase, calls, seconds, seconds / calls))
+        for (scope, counter), (steps, total) in sorted(self.counters.items()):
+            rows.append((scope, counter, steps, total, total / steps))
+
+        return rows
+
+    def to_dataframe(self):
+        import pandas as pd
+
+        return pd.DataFrame(self.rows(), columns=['scope', 'name', 'calls', 'total', 'mean'])
+
+    # a plain text table: phases with their calls, total time, time per call
+    # and share of the scope's time, followed by the counters with their mean
+    # per step.
+    def summary(self):
+        scope_totals = defaultdict(float)
+        for (scope, phase), (calls, seconds) in self.phases.items():
+            scope_totals[scope] += seconds
+
+        lines = ['%-12s %-20s %10s %12s %12s %7s' % ('scope', 'phase', 'calls', 'total (ms)', 'per call (us)', 'share')]
+        for (scope, phase), (calls, seconds) in sorted(self.phases.items()):
+            share = seconds / scope_totals[scope] if scope_totals[scope] else 0.0
+            lines.append('%-12s %-20s %10d %12.3f %12.3f %6.1f%%' % (scope, phase, calls, seconds * 1e3, seconds / calls * 1e6, share * 100))
+
+        if self.counters:
+            lines.append('')
+            lines.append('%-12s %-20s %10s %12s' % ('scope', 'counter', 'steps', 'mean'))
+            for (scope, counter), (steps, total) in sorted(self.counters.items()):
+                lines.append('%-12s %-20s %10d %12.1f' % (scope, counter, steps, total / steps))
+
+        return '\n'.join(lines)
@@ -0,0 +1,63 @@
+import numpy as np
+
+from .constants import MASK_START
+from .stimulus import blank_stimulus, mask_stimulus
+
+
+# what is shown to the model on each cycle of a trial, as a list of segments
+# that follow each other: e.g. a word for 20 cycles and then the mask for 20
+# cycles. within a segment the input is constant, so the product of the
+# features with the feature->letter weights only has to be worked out once per
+# segment (see compile()) instead of on every cycle.
+class Schedule:
+    # segments: a list of (cycles, stimulus) pairs, shown in order. stimulus
+    # is an (input_present, input_absence) pair as used by IAModel.run(),
+    # with or without a batch dimension, or None for a blank display.
+    def __init__(self, segments):
+        if len(segments) == 0:
+            raise ValueError("a schedule needs at least one segment")
+
+        self.segments = [(int(cycles), stimulus) for cycles, stimulus in segments]
+        self.cycles = sum(cycles for cycles, stimulus in self.segments)
+
+    # the schedule of the masking experiments in the JS model: the stimulus
+    # until mask_start and the mask for the rest of the cycles.
+    @classmethod
+    def masked(cls, stimulus, cycles, mask_start=MASK_START):
+        positions = np.shape(stimulus[0])[-2]
+
+        return cls([(mask_start, stimulus), (cycles - mask_start, mask_stimulus(positions))])
+
+    # work out the feature input of every segment for a model, see
+    # CompiledSchedule.
+    def compile(self, model):
+        inputs = []
+        for cycles, stimulus in self.segments:
+            if stimulus is None:
+                stimulus = blank_stimulus(model.positions)
+            inputs.append(model.feature_input(*stimulus))
+
+        return CompiledSchedule([cycles for cycles, stimulus in self.segments], inputs)
+
+
+# a Schedule compiled for a model: the net input from the features to the
+# letters during each segment, with shape ([batch_size,] positions, 26).
+class CompiledSchedule:
+    def __init__(self, durations, inputs):
+        self.inputs = inputs
+        self.cycles = sum(durations)
+
+        # the index of the segment that each cycle belongs to.
+        self.segment_of_cycle = np.repeat(np.arange(len(durations)), durations)
+
+    # the feature input on a cycle (counting from 0). after the end of the
+    # schedule the last segment simply continues.
+    def input(self, cycle):
+        return self.inputs[self.segment(cycle)]
+
+    # the index of the segment that is shown on a cycle.
+    def segment(self, cycle):
+        if cycle >= self.cycles:
+            return len(self.inputs) - 1
+
+        return int(self.segment_of_cycle[cycle])
@@ -0,0 +1,457 @@
+# a local simulation service. clients send trial requests and get the
+# activations streamed back to them cycle by cycle, while the server runs all
+# the trials that share a lexicon and parameters as one batch, so many
+# clients cost little more than one. run it with
+#
+#   python -m iam.server --stdio             (JSON lines on stdin/stdout)
+#   python -m iam.server --http 8765         (POST /trials, streamed back)
+#   python -m iam.server --load-test 64      (throughput with 64 clients)
+#
+# every message is a JSON object on its own line. a client sends
+#
+#   {"type": "run", "id": "t1", "word": "work", "cycles": 40}
+#
+# with optional "params" (parameter overrides, see resolve_parameters),
+# "mask_start" (show the mask from this cycle on, see Schedule.masked),
+# "top_k" (the number of words to send on each cycle) and "top_letters" (the
+# number of letters per position), or a "stimulus" with "present" and
+# "absence" feature arrays instead of a "word". the server answers with one
+# message per cycle,
+#
+#   {"id": "t1", "cycle": 1, "words": [["work", 0.03], ...], "letters": [[["w", 0.05], ...], ...]}
+#
+# and finally {"id": "t1", "done": true}. {"type": "cancel", "id": "t1"}
+# stops a trial early (answered with {"id": "t1", "cancelled": true}), and
+# problems are reported as {"id": ..., "error": "..."}.
+import argparse
+import asyncio
+import json
+import math
+import sys
+import time
+
+import numpy as np
+
+from .constants import alphabet, letters, resolve_parameters
+from .lexicon import DEFAULT_WORDS_PATH
+from .model import load_model
+from .schedule import Schedule
+from .stimulus import word_stimulus
+
+# a client that has this many messages waiting to be sent has its trials
+# paused until it catches up (the other clients' trials carry on).
+DEFAULT_BACKLOG = 256
+
+
+# one connected client. the messages for it are queued here and written out
+# by the transport, which waits for each one to be sent (so a slow reader
+# fills up the queue).
+class Session:
+    def __init__(self, server, backlog=DEFAULT_BACKLOG):
+        self.server = server
+        self.backlog = backlog
+        self.queue = asyncio.Queue()
+        self.trials = {}
+
+        # set whenever the queue has room again, see SimulationServer.
+        self.space = asyncio.Event()
+        self.space.set()
+
+    # whether the client is behind, in which case its trials wait.
+    def full(self):
+        return self.queue.qsize() >= self.backlog
+
+    def put(self, message):
+        self.queue.put_nowait(message)
+        if self.full():
+            self.space.clear()
+
+    # the next message to send to the client.
+    async def get(self):
+        message = await self.queue.get()
+        if not self.full():
+            self.space.set()
+
+        return message
+
+    # handle one message from the client.
+    def receive(self, message):
+        if not isinstance(message, dict):
+            self.put({'id': None, 'error': "a message must be a JSON object"})
+            return
+
+        try:
+            if message.get('type', 'run') == 'cancel':
+                trial = self.trials.get(message.get('id'))
+                if trial is not None:
+                    trial.cancelled = True
+            else:
+                self.server.submit(self, message)
+        except (KeyError, TypeError, ValueError) as error:
+            self.put({'id': message.get('id'), 'error': str(error)})
+
+    # the client went away: stop all of its trials.
+    def close(self):
+        for trial in self.trials.values():
+            trial.cancelled = True
+
+
+# a trial that is being run for a session.
+class Trial:
+    def __init__(self, session, id, schedule, cycles, top_k, top_letters, letter_state, word_state):
+        self.session = session
+        self.id = id
+        self.schedule = schedule
+        self.cycles = cycles
+        self.top_k = top_k
+        self.top_letters = top_letters
+        self.letter_state = letter_state
+        self.word_state = word_state
+        self.cycle = 0
+        self.cancelled = False
+
+
+# the trials that share a lexicon and parameters, and the model they run on.
+class Group:
+    def __init__(self, model):
+        self.model = model
+        self.trials = []
+        self.task = None
+
+
+class SimulationServer:
+    def __init__(self, words_path=DEFAULT_WORDS_PATH, max_batch=512, backlog=DEFAULT_BACKLOG):
+        self.words_path = words_path
+        self.max_batch = max_batch
+        self.backlog = backlog
+        self.groups = {}
+
+        # counters for the throughput: batched steps taken and the number of
+        # trial cycles they covered.
+        self.steps = 0
+        self.trial_cycles = 0
+
+    def session(self):
+        return Session(self, self.backlog)
+
+    # start a trial for a "run" message. it joins the batch of its group on
+    # the next cycle.
+    def submit(self, session, message):
+        params = message.get('params')
+        if params is not None and not isinstance(params, dict):
+            raise ValueError("params must be an object of parameter values")
+        params = resolve_parameters(params)
+        for name, value in params.items():
+            if not _finite_number(value):
+                raise ValueError("%s must be a finite number" % name)
+
+        if 'word' in message:
+            if not isinstance(message['word'], str):
+                raise ValueError("word must be a string")
+            word = message['word'].lower()
+            if not all(letter in alphabet for letter in word):
+                raise ValueError("not a word: " + message['word'])
+            stimulus = word_stimulus(word)
+        else:
+            if not isinstance(message.get('stimulus'), dict):
+                raise ValueError("a trial needs a word or a stimulus")
+            stimulus = (np.asarray(message['stimulus']['present'], dtype=float), np.asarray(message['stimulus']['absence'], dtype=float))
+            if not all(np.all(np.isfinite(features)) for features in stimulus):
+                raise ValueError("the stimulus must only have finite numbers")
+
+        cycles = int(message.get('cycles', 40))
+        if cycles < 1:
+            raise ValueError("cycles must be at least 1")
+        top_k = int(message.get('top_k', 10))
+        top_letters = int(message.get('top_letters', 3))
+        if top_k < 1 or top_letters < 1:
+            raise ValueError("top_k and top_letters must be at least 1")
+
+        # the model is only loaded once the message is known to be good.
+        key = json.dumps(params, sort_keys=True)
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = Group(load_model(params, self.words_path))
+        model = group.model
+
+        shape = (model.positions, letters.shape[-1])
+        if np.shape(stimulus[0]) != shape or np.shape(stimulus[1]) != shape:
+            raise ValueError("the stimulus must have %d positions of %d features" % shape)
+
+        if 'mask_start' in message:
+            mask_start = int(message['mask_start'])
+            if not 0 <= mask_start <= cycles:
+                raise ValueError("mask_start must be between 0 and cycles")
+            schedule = Schedule.masked(stimulus, cycles, mask_start)
+        else:
+            schedule = Schedule([(cycles, stimulus)])
+
+        model.reset()
+        trial = Trial(session, message.get('id'), schedule.compile(model), cycles, top_k, top_letters, model.letter_state, model.word_state)
+        session.trials[trial.id] = trial
+        group.trials.append(trial)
+
+        if group.task is None:
+            group.task = asyncio.get_running_loop().create_task(self._run_group(group))
+
+    # step every trial of a group together until there are none left. the
+    # trials of a client that is behind are left out of the step until it
+    # catches up, and trials that are done or cancelled leave the batch. if a
+    # step fails, every trial of the group is ended with the error rather than
+    # left waiting.
+    async def _run_group(self, group):
+        model = group.model
+        try:
+            while group.trials:
+                for trial in [trial for trial in group.trials if trial.cancelled]:
+                    self._finish(group, trial, {'id': trial.id, 'cancelled': True})
+
+                ready = [trial for trial in group.trials if not trial.session.full()][:self.max_batch]
+                if not group.trials:
+                    break
+                if not ready:
+                    # wait for one of the clients to catch up (checking for
+                    # cancelled trials every now and then).
+                    waiters = [asyncio.ensure_future(trial.session.space.wait()) for trial in group.trials]
+                    await asyncio.wait(waiters, timeout=0.05, return_when=asyncio.FIRST_COMPLETED)
+                    for waiter in waiters:
+                        waiter.cancel()
+                    continue
+
+                letter_state = np.stack([trial.letter_state for trial in ready])
+                word_state = np.stack([trial.word_state for trial in ready])
+                feature_input = np.stack([trial.schedule.input(trial.cycle) for trial in ready])
+
+                # the step runs in a thread (numpy releases the GIL), so the
+                # server keeps reading and writing messages in the meantime.
+                letter_state, word_state = await asyncio.to_thread(model.update_from_input, letter_state, word_state, feature_input)
+                self.steps += 1
+                self.trial_cycles += len(ready)
+
+                self._send_cycle(model, ready, letter_state, word_state)
+                for trial in ready:
+                    if trial.cycle >= trial.cycles and not trial.cancelled:
+                        self._finish(group, trial, {'id': trial.id, 'done': True})
+        except Exception as error:
+            for trial in list(group.trials):
+                self._finish(group, trial, {'id': trial.id, 'error': str(error)})
+        finally:
+            group.task = None
+
+    # store the new states and send every trial its most active words and
+    # letters.
+    def _send_cycle(self, model, trials, letter_state, word_state):
+        words = model.lexicon.words
+        top_k = min(max(trial.top_k for trial in trials), model.num_words)
+        top_words = np.argpartition(word_state, -top_k, axis=-1)[:, -top_k:]
+        top_activations = np.take_along_axis(word_state, top_words, axis=-1)
+        letter_order = np.argsort(letter_state, axis=-1)[..., ::-1]
+
+        for i, trial in enumerate(trials):
+            trial.letter_state = letter_state[i]
+            trial.word_state = word_state[i]
+            trial.cycle += 1
+            if trial.cancelled:
+                continue
+
+            order = np.argsort(top_activations[i])[::-1][:trial.top_k]
+            trial.session.put({
+                'id': trial.id,
+                'cycle': trial.cycle,
+                'words': [[words[top_words[i, j]], float(top_activations[i, j])] for j in order],
+                'letters': [[[alphabet[letter], float(letter_state[i, position, letter])] for letter in letter_order[i, position, :trial.top_letters]] for position in range(model.positions)],
+            })
+
+    def _finish(self, group, trial, message):
+        group.trials.remove(trial)
+        trial.session.trials.pop(trial.id, None)
+        trial.session.put(message)
+
+
+# whether a parameter value from a message is a single finite number (python's
+# json reads NaN and Infinity, and integers of any size).
+def _finite_number(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return False
+    try:
+        return math.isfinite(value)
+    except OverflowError:
+        return False
+
+
+# serve one client over a pair of asyncio streams, one JSON message per line.
+async def serve_stream(server, reader, writer):
+    session = server.session()
+
+    async def write_messages():
+        while True:
+            message = await session.get()
+            writer.write((json.dumps(message) + '\n').encode())
+            await writer.drain()
+
+    writing = asyncio.ensure_future(write_messages())
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if line.strip():
+                try:
+                    session.receive(json.loads(line))
+                except json.JSONDecodeError as error:
+                    session.put({'id': None, 'error': str(error)})
+
+        # the client has sent everything: wait for its trials to finish.
+        while session.trials or not session.queue.empty():
+            await asyncio.sleep(0.01)
+    finally:
+        session.close()
+        writing.cancel()
+
+
+# stdin and stdout as asyncio streams. when they are regular files rather
+# than pipes or terminals, which asyncio can't watch, they are read and
+# written directly instead.
+async def serve_stdio(server):
+    loop = asyncio.get_running_loop()
+    try:
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    except ValueError:
+        reader = _FileStream(sys.stdin.buffer)
+    try:
+        transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, sys.stdout)
+        writer = asyncio.StreamWriter(transport, protocol, None, loop)
+    except ValueError:
+        writer = _FileStream(sys.stdout.buffer)
+
+    await serve_stream(server, reader, writer)
+
+
+# the parts of StreamReader and StreamWriter that serve_stream uses, for a
+# regular file.
+class _FileStream:
+    def __init__(self, file):
+        self.file = file
+
+    async def readline(self):
+        return await asyncio.to_thread(self.file.readline)
+
+    def write(self, data):
+        self.file.write(data)
+
+    async def drain(self):
+        self.file.flush()
+
+
+# a minimal HTTP front end: POST /trials with a "run" message as the body
+# answers with the trial's messages as a stream of JSON lines (chunked).
+# closing the connection cancels the trial.
+async def serve_http_client(server, reader, writer):
+    try:
+        request_line = (await reader.readline()).decode()
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode().strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if not request_line.startswith('POST /trials'):
+            writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n')
+            return
+        body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+        # a body that is not a message is refused before the stream starts.
+        try:
+            message = json.loads(body)
+        except json.JSONDecodeError as error:
+            message = str(error)
+        if not isinstance(message, dict):
+            error = (json.dumps({'id': None, 'error': message if isinstance(message, str) else "the body must be a JSON object"}) + '\n').encode()
+            writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n%s' % (len(error), error))
+            return
+
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nTransfer-Encoding: chunked\r\n\r\n')
+        session = server.session()
+        message.setdefault('id', 1)
+        session.receive(message)
+        try:
+            while True:
+                message = await session.get()
+                chunk = (json.dumps(message) + '\n').encode()
+                writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                await writer.drain()
+                if 'cycle' not in message:
+                    break
+            writer.write(b'0\r\n\r\n')
+        finally:
+            session.close()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_http(server, host='127.0.0.1', port=8765):
+    listener = await asyncio.start_server(lambda reader, writer: serve_http_client(server, reader, writer), host, port)
+    async with listener:
+        await listener.serve_forever()
+
+
+# run `clients` simultaneous in-process clients, each asking for one trial
+# of a different word, and return the number of trial cycles per second,
+# the number of batched steps it took, and the time the same trials take one
+# after the other with a loop per trial.
+async def load_test(clients=64, cycles=40, words_path=DEFAULT_WORDS_PATH):
+    server = SimulationServer(words_path)
+    model = load_model(None, words_path)
+    words = [model.lexicon.words[i % len(model.lexicon)] for i in range(clients)]
+
+    async def client(i):
+        session = server.session()
+        session.receive({'id': i, 'word': words[i], 'cycles': cycles, 'top_k': 5})
+        while 'cycle' in await session.get():
+            pass
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(i) for i in range(clients)])
+    seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for word in words:
+        model.run(word_stimulus(word), cycles)
+    sequential_seconds = time.perf_counter() - start
+
+    return {
+        'clients': clients,
+        'trial_cycles_per_second': server.trial_cycles / seconds,
+        'batched_steps': server.steps,
+        'seconds': seconds,
+        'sequential_seconds': sequential_seconds,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="serve the interactive activation model")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument('--stdio', action='store_true', help="JSON lines on stdin and stdout")
+    mode.add_argument('--http', type=int, metavar='PORT', help="serve POST /trials on this port")
+    mode.add_argument('--load-test', type=int, metavar='CLIENTS', help="measure the throughput with this many clients")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--words', default=DEFAULT_WORDS_PATH, help="the words file")
+    args = parser.parse_args(argv)
+
+    if args.load_test:
+        print(json.dumps(asyncio.run(load_test(args.load_test, words_path=args.words)), indent=2))
+    elif args.stdio:
+        asyncio.run(serve_stdio(SimulationServer(args.words)))
+    else:
+        asyncio.run(serve_http(SimulationServer(args.words), args.host, args.http))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,55 @@
+import numpy as np
+
+
+# the full state of an IAModel at some cycle: the letter states of every
+# position and the word states, with a batch dimension if the model was
+# batched. take one with IAModel.snapshot() and go back to it with
+# IAModel.restore(), or start many different continuations from it at once
+# with IAModel.fork(), so a prefix that several conditions share (e.g. the
+# stimulus before the mask) only has to be simulated once.
+class Snapshot:
+    def __init__(self, letter_state, word_state, cycle=0):
+        self.letter_state = letter_state
+        self.word_state = word_state
+
+        # the number of cycles the model had run when the snapshot was taken.
+        self.cycle = cycle
+
+    # None for a single trial, otherwise the number of trials.
+    @property
+    def batch_size(self):
+        if self.word_state.ndim == 1:
+            return None
+
+        return self.word_state.shape[0]
+
+    @property
+    def dtype(self):
+        return self.word_state.dtype
+
+    # write the snapshot to a .npy file holding a single record with the
+    # cycle and the raw states, so load_snapshot() can memory-map it.
+    def save(self, path):
+        record_dtype = np.dtype([
+            ('cycle', np.int64),
+            ('letter_state', self.dtype, self.letter_state.shape),
+            ('word_state', self.dtype, self.word_state.shape),
+        ])
+
+        record = np.zeros(1, dtype=record_dtype)
+        record['cycle'] = self.cycle
+        record['letter_state'] = self.letter_state
+        record['word_state'] = self.word_state
+
+        np.save(path, record)
+
+
+# read a snapshot written by Snapshot.save(). by default the file is
+# memory-mapped read-only, so the states are views of the file rather than
+# copies: any number of worker processes can load the same snapshot and the
+# operating system keeps a single copy of it in memory. restoring it into a
+# model (or forking from it) copies the states into the model.
+def load_snapshot(path, mmap=True):
+    record = np.load(path, mmap_mode='r' if mmap else None)
+
+    return Snapshot(record['letter_state'][0], record['word_state'][0], int(record['cycle'][0]))
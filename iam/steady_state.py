@@ -0,0 +1,193 @@
+import numpy as np
+
+from .core import per_trial
+
+
+# the results of solve_steady_state, one entry per trial:
+#   letter_state and word_state: the settled states, shaped like the model's
+#     states.
+#   iterations[t]: the number of model updates it took.
+#   converged[t]: whether the trial settled within max_iterations.
+#   residuals[t]: the largest change of any unit in the last update (below
+#     the tolerance for a trial that converged).
+#   fallbacks[t]: how often an accelerated step made things worse and was
+#     replaced by a plain update.
+# residual_history holds the largest residual over the trials that were
+# still running on each iteration.
+class SteadyStateResult:
+    def __init__(self, letter_state, word_state, iterations, converged, residuals, fallbacks, residual_history):
+        self.letter_state = letter_state
+        self.word_state = word_state
+        self.iterations = iterations
+        self.converged = converged
+        self.residuals = residuals
+        self.fallbacks = fallbacks
+        self.residual_history = residual_history
+
+    # one row per trial.
+    def to_dataframe(self):
+        import pandas as pd
+
+        return pd.DataFrame({
+            'iterations': np.atleast_1d(self.iterations),
+            'converged': np.atleast_1d(self.converged),
+            'residual': np.atleast_1d(self.residuals),
+            'fallbacks': np.atleast_1d(self.fallbacks),
+        })
+
+    # a plain text summary of the convergence of all the trials.
+    def summary(self):
+        iterations = np.atleast_1d(self.iterations)
+        lines = [
+            '%d of %d trials converged' % (np.sum(self.converged), iterations.size),
+            'iterations: mean %.1f, max %d' % (np.mean(iterations), np.max(iterations)),
+            'largest final residual: %.3g' % np.max(self.residuals),
+            'fallbacks to plain updates: %d' % np.sum(self.fallbacks),
+        ]
+
+        return '\n'.join(lines)
+
+
+# find the state that the model settles into when a stimulus is shown for
+# ever, i.e. the fixed point of the update (the states for which one more
+# cycle changes no unit by more than tolerance), without running the model
+# cycle by cycle until it gets there. the letter and word states of each
+# trial are treated as one vector x, and the update as a function G(x).
+# plain iteration, x = G(x), converges only slowly, by the decay rate on
+# every cycle. Anderson acceleration instead takes as the next x the
+# combination of the last memory + 1 updates whose residual G(x) - x is the
+# smallest (by least squares), which usually settles in a fraction of the
+# cycles. the update is only piecewise linear (units are clipped at 0 and
+# at the bounds), so an accelerated step can make things worse: when the
+# residual of a trial grows, its history is thrown away and it takes a plain
+# update instead (counted in fallbacks). a trial that has fallen back
+# max_fallbacks times only takes plain updates from then on, and
+# accelerate=False only does plain updates.
+# the stimulus is a pair (input_present, input_absence), batched when the
+# model is. the search starts from the resting state and the settled states
+# are left in the model. see SteadyStateResult.
+def solve_steady_state(model, stimulus, tolerance=1e-6, max_iterations=500, memory=5, regularization=1e-10, max_fallbacks=10, accelerate=True):
+    if not accelerate:
+        memory = 0
+
+    model.reset()
+    feature_input = model.feature_input(*stimulus)
+
+    # a single trial is solved as a batch of one.
+    batched = model.batch_size is not None
+    letter_shape = model.letter_state.shape[-2:]
+    num_letter_units = model.positions * model.num_letters
+    x = np.concatenate([model.letter_state.reshape(-1, num_letter_units), model.word_state.reshape(-1, model.num_words)], axis=-1)
+    num_trials, size = x.shape
+
+    def update(x, trials):
+        letter_state = x[:, :num_letter_units].reshape((len(trials),) + letter_shape)
+        word_state = x[:, num_letter_units:]
+        trial_input = feature_input[trials] if feature_input.ndim == 3 else feature_input
+        letter_state, word_state = model.subset(trials).update_from_input(letter_state, word_state, trial_input)
+
+        return np.concatenate([letter_state.reshape(len(trials), -1), word_state], axis=-1)
+
+    iterations = np.zeros(num_trials, dtype=int)
+    converged = np.zeros(num_trials, dtype=bool)
+    residuals = np.full(num_trials, np.inf)
+    fallbacks = np.zeros(num_trials, dtype=int)
+    residual_history = []
+
+    # the differences between the successive updates G(x) and between the
+    # successive residuals of the last memory iterations, as a ring buffer
+    # per trial, and the dot products of the residual differences with each
+    # other (their gram matrix), which only changes in one row and column
+    # per iteration. count is how many differences have been recorded (0
+    # after a restart).
+    update_differences = np.zeros((num_trials, memory, size), dtype=x.dtype)
+    residual_differences = np.zeros((num_trials, memory, size), dtype=x.dtype)
+    grams = np.zeros((num_trials, memory, memory), dtype=x.dtype)
+    count = np.zeros(num_trials, dtype=int)
+    previous_update = np.zeros_like(x)
+    previous_residual = np.zeros_like(x)
+    was_positive = x > 0
+
+    active = np.arange(num_trials)
+    for iteration in range(max_iterations):
+        current = x[active]
+        updated = update(current, active)
+        residual = updated - current
+        largest = np.max(np.abs(residual), axis=-1)
+        iterations[active] += 1
+        residual_history.append(np.max(largest))
+
+        # an accelerated step that made the residual larger counts as a
+        # fallback: the trial's history is thrown away (below) and it goes on
+        # with a plain update from where it is.
+        worse = (count[active] > 1) & (largest > residuals[active])
+        fallbacks[active[worse]] += 1
+        residuals[active] = largest
+
+        done = largest < tolerance
+        converged[active[done]] = True
+        x[active[done]] = updated[done]
+
+        running = ~done
+        active, current, updated, residual = active[running], current[running], updated[running], residual[running]
+        if len(active) == 0:
+            break
+
+        if memory == 0:
+            x[active] = updated
+            continue
+
+        # the history is also thrown away when a unit crosses 0, because the
+        # update is a different (linear) function on the other side.
+        positive = updated > 0
+        restart = worse[running] | np.any(positive != was_positive[active], axis=-1) | (fallbacks[active] >= max_fallbacks)
+        was_positive[active] = positive
+        count[active[restart]] = 0
+        update_differences[active[restart]] = 0
+        residual_differences[active[restart]] = 0
+        grams[active[restart]] = 0
+
+        # record the differences to the last iteration. a trial that has just
+        # (re)started has nothing to compare with yet, so its new
+        # differences are left at 0.
+        has_previous = count[active] > 0
+        slot = count[active] % memory
+        record = active[has_previous]
+        update_differences[record, slot[has_previous]] = updated[has_previous] - previous_update[record]
+        new_differences = np.where(has_previous[:, np.newaxis], residual - previous_residual[active], 0)
+        residual_differences[active, slot] = new_differences
+        differences = residual_differences[active]
+        products = np.matmul(differences, new_differences[:, :, np.newaxis])[:, :, 0]
+        grams[active, slot, :] = products
+        grams[active, :, slot] = products
+        count[active] = np.where(has_previous, count[active] + 1, 1)
+        previous_update[active] = updated
+        previous_residual[active] = residual
+
+        # the least squares weights gamma of the recorded differences, from
+        # the regularized normal equations. slots that are not filled in
+        # are all zero, so they get a weight of 0.
+        gram = grams[active]
+        trace = np.trace(gram, axis1=1, axis2=2)
+        ridge = np.where(trace > 0, regularization * trace / memory, 1.0)
+        gram += ridge[:, np.newaxis, np.newaxis] * np.eye(memory)
+        gamma = np.linalg.solve(gram, np.matmul(differences, residual[:, :, np.newaxis]))
+
+        # the accelerated step corrects the plain update by the same
+        # combination of past updates, and is kept inside the bounds of the
+        # activations.
+        correction = np.matmul(gamma.transpose(0, 2, 1), update_differences[active])[:, 0]
+        bounds = model.subset(active)
+        x[active] = np.clip(updated - correction, per_trial(bounds.min_value), per_trial(bounds.max_value))
+
+    letter_state = x[:, :num_letter_units].reshape((num_trials,) + letter_shape)
+    word_state = x[:, num_letter_units:]
+    if not batched:
+        letter_state, word_state = letter_state[0], word_state[0]
+        iterations, converged, residuals, fallbacks = iterations[0], converged[0], residuals[0], fallbacks[0]
+
+    model.letter_state = letter_state.copy()
+    model.word_state = word_state.copy()
+    model.cycle = int(np.max(iterations))
+
+    return SteadyStateResult(letter_state, word_state, iterations, converged, residuals, fallbacks, np.array(residual_history))
@@ -0,0 +1,34 @@
+import numpy as np
+
+from .constants import MASK, letter_to_index, letters
+
+
+# the feature input for a word: input_present holds the features of each
+# letter and input_absence the features each letter does not have. given a
+# single word both have shape (positions, 14); given a list of words they
+# have shape (num_words, positions, 14), one stimulus per batch trial.
+def word_stimulus(words):
+    if isinstance(words, str):
+        input_present = letters[[letter_to_index[letter] for letter in words]]
+    else:
+        input_present = np.array([letters[[letter_to_index[letter] for letter in word]] for word in words])
+
+    input_absence = 1 - input_present
+
+    return input_present, input_absence
+
+
+# the mask at every position: its features are present and all the other
+# features are absent. both arrays have shape (positions, 14).
+def mask_stimulus(positions=4):
+    input_present = np.tile(MASK, (positions, 1))
+
+    return input_present, 1 - input_present
+
+
+# a blank display: no feature is known to be present or absent, so the
+# letters get no input from the features at all.
+def blank_stimulus(positions=4):
+    input_present = np.zeros((positions, len(MASK)), dtype=int)
+
+    return input_present, input_present.copy()
@@ -0,0 +1,227 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .constants import resolve_parameters
+from .lexicon import DEFAULT_WORDS_PATH, Lexicon
+from .model import IAModel
+from .stimulus import word_stimulus
+from .weights import compile_weights
+
+
+# every combination of the values in a parameter grid, e.g.
+#   parameter_grid({"DECAY_RATE": [0.05, 0.07], "REST_GAIN": [0.05, 0.1]})
+# gives the 4 configurations as a list of dictionaries.
+def parameter_grid(grid):
+    names = list(grid)
+
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+# the read-only arrays every worker needs (the lexicon and the stimuli) are
+# copied into shared memory once by the parent process. the workers attach to
+# the same memory instead of receiving a pickled copy with every task.
+class SharedArrays:
+    def __init__(self, arrays):
+        self.blocks = []
+        self.spec = {}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            self.blocks.append(block)
+            self.spec[name] = (block.name, array.shape, array.dtype.str)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+
+
+# the arrays described by a SharedArrays spec, as seen from a worker. the
+# SharedMemory handles are returned too, since the arrays are only valid
+# while they are open.
+def attach_shared_arrays(spec):
+    blocks = []
+    arrays = {}
+    for name, (block_name, shape, dtype) in spec.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        arrays[name].flags.writeable = False
+
+    return arrays, blocks
+
+
+# the state of a worker process, set up once by _init_worker.
+_worker = {}
+
+
+def _init_worker(spec):
+    arrays, blocks = attach_shared_arrays(spec)
+    _worker['blocks'] = blocks
+    _worker['arrays'] = arrays
+    _worker['lexicon'] = Lexicon(arrays['words'].tolist(), arrays['frequencies'], arrays['word_letters'])
+
+
+# run one chunk of stimuli with one configuration. returns the index of the
+# configuration and of the first stimulus along with the results, so the
+# parent can put them in the right place.
+def _run_task(task):
+    config_index, params, start, stop, cycles, threshold, dtype = task
+    arrays = _worker['arrays']
+
+    weights = compile_weights(_worker['lexicon'], params, dtype)
+    model = IAModel.from_weights(weights, batch_size=stop - start)
+    stimulus = (arrays['input_present'][start:stop], arrays['input_absence'][start:stop])
+    targets = arrays['targets'][start:stop] if 'targets' in arrays else None
+
+    target_activations = None
+    if targets is not None:
+        target_activations = np.zeros((stop - start, cycles))
+
+    # latencies are taken from the same run: the first cycle on which the
+    # target (or any word, without targets) reaches the threshold.
+    latencies = None
+    if threshold is not None:
+        latencies = np.full(stop - start, cycles)
+
+    # the stimulus stays the same for the whole trial, so its input to the
+    # letters is only worked out once.
+    feature_input = model.feature_input(*stimulus)
+    model.reset()
+    for i in range(cycles):
+        model.step_from_input(feature_input)
+        if targets is not None:
+            target_activations[:, i] = model.word_state[np.arange(stop - start), targets]
+        if threshold is not None:
+            reached = target_activations[:, i] if targets is not None else np.max(model.word_state, axis=-1)
+            latencies[(latencies == cycles) & (reached >= threshold)] = i + 1
+
+    winners = np.argmax(model.word_state, axis=-1)
+    winner_activations = model.word_state[np.arange(stop - start), winners]
+
+    return config_index, start, winners, winner_activations, target_activations, latencies
+
+
+# the results of a sweep, one entry per configuration and stimulus:
+#   winners[c, s]: index of the most active word after the last cycle.
+#   winner_activations[c, s]: its activation.
+#   target_activations[c, s, t]: activation of the stimulus' target word on
+#     each cycle (only when there are targets).
+#   latencies[c, s]: the cycle on which the target (or any word without
+#     targets) reached the threshold, or the number of cycles if it never
+#     did (only when a threshold was given).
+class SweepResult:
+    def __init__(self, configurations, stimuli, words, winners, winner_activations, target_activations, latencies):
+        self.configurations = configurations
+        self.stimuli = stimuli
+        self.words = words
+        self.winners = winners
+        self.winner_activations = winner_activations
+        self.target_activations = target_activations
+        self.latencies = latencies
+
+    # one row per configuration and stimulus, with a column for every
+    # parameter that was swept.
+    def to_dataframe(self):
+        import pandas as pd
+
+        num_configurations, num_stimuli = self.winners.shape
+        names = sorted({name for configuration in self.configurations for name in configuration})
+        resolved = [resolve_parameters(configuration) for configuration in self.configurations]
+
+        columns = {name: np.repeat([params[name] for params in resolved], num_stimuli) for name in names}
+        columns['stimulus'] = np.tile(np.array(self.stimuli, dtype=object), num_configurations)
+        columns['winner'] = np.array(self.words, dtype=object)[self.winners.ravel()]
+        columns['winner_activation'] = self.winner_activations.ravel()
+        if self.target_activations is not None:
+            columns['target_activation'] = self.target_activations[..., -1].ravel()
+        if self.latencies is not None:
+            columns['latency'] = self.latencies.ravel()
+
+        return pd.DataFrame(columns)
+
+
+# run every stimulus with every configuration, spread over a pool of
+# processes.
+#   configurations: a list of parameter dictionaries (see parameter_grid).
+#   stimuli: a list of words, or a (input_present, input_absence) pair of
+#     (num_stimuli, positions, 14) arrays.
+#   targets: the word each stimulus is expected to activate. defaults to the
+#     stimuli themselves when they are words.
+#   threshold: if given, also measure the cycle on which the target reaches
+#     this activation.
+#   batch_size: the number of stimuli each task runs as one batch.
+#   processes: the number of worker processes (defaults to the number of
+#     cores).
+#   dtype: the floating point type the models compute in (see IAModel).
+def run_sweep(configurations, stimuli, cycles, targets=None, threshold=None, words_path=DEFAULT_WORDS_PATH, batch_size=256, processes=None, dtype=np.float64):
+    configurations = [dict(configuration) for configuration in configurations]
+    for configuration in configurations:
+        resolve_parameters(configuration)
+
+    lexicon = Lexicon.from_csv(words_path)
+
+    if isinstance(stimuli, tuple):
+        input_present, input_absence = stimuli
+        stimulus_names = list(range(len(input_present)))
+    else:
+        input_present, input_absence = word_stimulus(list(stimuli))
+        stimulus_names = list(stimuli)
+        if targets is None:
+            targets = stimulus_names
+
+    shared = {
+        'words': np.array(lexicon.words, dtype=str),
+        'frequencies': lexicon.frequencies,
+        'word_letters': lexicon.word_letters,
+        'input_present': np.asarray(input_present, dtype=float),
+        'input_absence': np.asarray(input_absence, dtype=float),
+    }
+    if targets is not None:
+        shared['targets'] = np.array([lexicon.index(target) for target in targets], dtype=np.intp)
+
+    num_stimuli = len(shared['input_present'])
+    tasks = [
+        (config_index, configuration, start, min(start + batch_size, num_stimuli), cycles, threshold, dtype)
+        for config_index, configuration in enumerate(configurations)
+        for start in range(0, num_stimuli, batch_size)
+    ]
+
+    winners = np.zeros((len(configurations), num_stimuli), dtype=np.intp)
+    winner_activations = np.zeros((len(configurations), num_stimuli))
+    target_activations = np.zeros((len(configurations), num_stimuli, cycles)) if targets is not None else None
+    latencies = np.zeros((len(configurations), num_stimuli), dtype=int) if threshold is not None else None
+
+    def collect(result):
+        config_index, start, chunk_winners, chunk_winner_activations, chunk_target_activations, chunk_latencies = result
+        stop = start + len(chunk_winners)
+        winners[config_index, start:stop] = chunk_winners
+        winner_activations[config_index, start:stop] = chunk_winner_activations
+        if target_activations is not None:
+            target_activations[config_index, start:stop] = chunk_target_activations
+        if latencies is not None:
+            latencies[config_index, start:stop] = chunk_latencies
+
+    if processes is None:
+        processes = os.cpu_count()
+
+    with SharedArrays(shared) as arrays:
+        if processes == 1:
+            _init_worker(arrays.spec)
+            for task in tasks:
+                collect(_run_task(task))
+            _worker.clear()
+        else:
+            with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(arrays.spec,)) as executor:
+                for result in executor.map(_run_task, tasks):
+                    collect(result)
+
+    return SweepResult(configurations, stimulus_names, lexicon.words, winners, winner_activations, target_activations, latencies)
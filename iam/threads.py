@@ -0,0 +1,80 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .stimulus import word_stimulus
+
+
+# run trials on a pool of threads that all share one model. the model is only
+# read: every trial's states live in the thread that runs it and are stepped
+# with IAModel.update_from_input(), which (like pool_step for an IAPool)
+# works out the next states without changing the model. so the weights, the
+# connectivity and the resting states are in memory once however many threads
+# there are, and numpy's large array operations (the matrix products, the
+# clipping and the updates), which release the GIL, overlap across threads.
+# python itself still runs one thread at a time, so the gain depends on how
+# much of a cycle is spent in numpy: larger batches spend more of it there.
+#   threads: the number of threads (defaults to the number of cores).
+#   batch_size: the number of trials each task runs as one batch.
+# use it as a context manager, or call close() when done.
+class ThreadedRunner:
+    def __init__(self, model, threads=None, batch_size=64):
+        if model.parameters_vary:
+            raise ValueError("the threaded runner does not support parameters that vary per trial")
+
+        self.model = model
+        self.threads = threads if threads is not None else os.cpu_count()
+        self.batch_size = batch_size
+        self._executor = ThreadPoolExecutor(max_workers=self.threads)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown()
+
+    # start running one batch of trials in the background: stimulus is a
+    # (input_present, input_absence) pair of (num_trials, positions, 14)
+    # arrays, shown for the given number of cycles from the resting state.
+    # returns a Future of the final (letter_state, word_state), with shapes
+    # (num_trials, positions, 26) and (num_trials, num_words).
+    def submit(self, stimulus, cycles):
+        return self._executor.submit(run_trials, self.model, stimulus, cycles)
+
+    # run any number of trials, batch_size at a time, spread over the
+    # threads. stimuli is a list of words, or a (input_present,
+    # input_absence) pair of (num_trials, positions, 14) arrays. returns the
+    # final letter and word states of every trial, as for submit().
+    def run(self, stimuli, cycles):
+        if isinstance(stimuli, tuple):
+            input_present, input_absence = stimuli
+        else:
+            input_present, input_absence = word_stimulus(list(stimuli))
+
+        futures = [
+            self.submit((input_present[start:start + self.batch_size], input_absence[start:start + self.batch_size]), cycles)
+            for start in range(0, len(input_present), self.batch_size)
+        ]
+        results = [future.result() for future in futures]
+
+        return np.concatenate([letter_state for letter_state, _ in results]), np.concatenate([word_state for _, word_state in results])
+
+
+# run a batch of trials with a model without changing it (see
+# ThreadedRunner.submit), so it can be called from any number of threads at
+# once.
+def run_trials(model, stimulus, cycles):
+    input_present, input_absence = stimulus
+    num_trials = len(input_present)
+
+    feature_input = model.feature_input(input_present, input_absence)
+    letter_state = np.zeros((num_trials, model.positions, model.num_letters), dtype=model.dtype)
+    word_state = np.broadcast_to(model.word_resting_state, (num_trials, model.num_words)).copy()
+    for _ in range(cycles):
+        letter_state, word_state = model.update_from_input(letter_state, word_state, feature_input)
+
+    return letter_state, word_state
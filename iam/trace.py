@@ -0,0 +1,111 @@
+import os
+
+import numpy as np
+
+from .constants import alphabet, letter_to_index
+
+
+# records the activations of selected word and letter units on every cycle of
+# a run. the storage is allocated once up front as (cycles, [batch_size,]
+# units) arrays and the unit names are turned into indices once, so recording
+# a cycle is a single np.take per layer. pass a recorder to IAModel.run().
+class TraceRecorder:
+    # lexicon: the Lexicon of the model being recorded.
+    # cycles: the number of cycles that will be recorded.
+    # words: the words to record. None records every word.
+    # letters: the letter units to record as (position, letter) pairs, e.g.
+    #   [(3, "r"), (3, "k")]. None records every letter at every position.
+    # batch_size: the batch size of the model, or None for a single trial.
+    # path: if given, a directory to stream the trace into. the activations
+    #   are then stored in memory-mapped .npy files (words.npy and
+    #   letters.npy) instead of in memory, so traces larger than RAM can be
+    #   recorded.
+    # dtype: the floating point type the activations are stored as.
+    def __init__(self, lexicon, cycles, words=None, letters=None, batch_size=None, path=None, dtype=float):
+        self.lexicon = lexicon
+        self.dtype = np.dtype(dtype)
+        self.cycles = cycles
+        self.batch_size = batch_size
+        self.path = path
+
+        if words is None:
+            words = lexicon.words
+        self.words = list(words)
+        self.word_indices = np.array([lexicon.index(word) for word in self.words], dtype=np.intp)
+
+        # letter units are looked up in the flattened (positions x 26) letter
+        # layer.
+        if letters is None:
+            letters = [(position, letter) for position in range(lexicon.positions) for letter in alphabet]
+        self.letters = list(letters)
+        self.letter_indices = np.array([position * len(alphabet) + letter_to_index[letter] for position, letter in self.letters], dtype=np.intp)
+
+        batch_shape = () if batch_size is None else (batch_size,)
+        self.word_activations = self._allocate('words', (cycles,) + batch_shape + (len(self.words),))
+        self.letter_activations = self._allocate('letters', (cycles,) + batch_shape + (len(self.letters),))
+
+        # the number of cycles recorded so far
+        self.recorded = 0
+
+    def _allocate(self, name, shape):
+        if self.path is None:
+            return np.zeros(shape, dtype=self.dtype)
+
+        os.makedirs(self.path, exist_ok=True)
+
+        return np.lib.format.open_memmap(os.path.join(self.path, name + '.npy'), mode='w+', dtype=self.dtype, shape=shape)
+
+    # store the states after one cycle. called by IAModel.run(). the word
+    # state only needs a take() method like an array's (a pruned model passes
+    # its words that are behind, see IAModel.advance, so only the recorded
+    # ones are brought up to date).
+    def record(self, cycle, letter_state, word_state):
+        letter_state = letter_state.reshape(letter_state.shape[:-2] + (-1,))
+
+        # take can only write into an array of the same type, so states of
+        # another dtype (e.g. a float32 model recorded as float64) are picked
+        # out first and converted as they are stored.
+        if word_state.dtype == self.dtype and letter_state.dtype == self.dtype:
+            word_state.take(self.word_indices, axis=-1, out=self.word_activations[cycle])
+            letter_state.take(self.letter_indices, axis=-1, out=self.letter_activations[cycle])
+        else:
+            self.word_activations[cycle] = word_state.take(self.word_indices, axis=-1)
+            self.letter_activations[cycle] = letter_state.take(self.letter_indices, axis=-1)
+
+        self.recorded = cycle + 1
+
+    # make sure everything recorded so far has been written to disk.
+    def flush(self):
+        if self.path is not None:
+            self.word_activations.flush()
+            self.letter_activations.flush()
+
+    # the word activations as a long-format DataFrame with one row per word
+    # per cycle (and per trial, when batched), in the same format as the
+    # data frames built by the scripts: word, timestep, activation.
+    def to_dataframe(self):
+        return self._long_format(self.word_activations, {'word': np.array(self.words)})
+
+    # the letter activations in the same long format, with position, letter,
+    # timestep and activation columns.
+    def letters_to_dataframe(self):
+        positions = np.array([position for position, letter in self.letters], dtype=int)
+        letters = np.array([letter for position, letter in self.letters])
+
+        return self._long_format(self.letter_activations, {'position': positions, 'letter': letters})
+
+    def _long_format(self, activations, unit_columns):
+        # pandas is only needed here, so it is only imported here.
+        import pandas as pd
+
+        activations = np.asarray(activations[:self.recorded])
+        num_units = activations.shape[-1]
+        num_rows = activations.size // num_units
+
+        columns = {name: np.tile(values, num_rows) for name, values in unit_columns.items()}
+        if self.batch_size is not None:
+            columns['trial'] = np.tile(np.repeat(np.arange(self.batch_size), num_units), self.recorded)
+        columns['timestep'] = np.repeat(np.arange(self.recorded), activations[0].size)
+        columns['activation'] = activations.ravel()
+
+        return pd.DataFrame(columns)
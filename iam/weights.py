@@ -0,0 +1,436 @@
+import copy
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from .constants import alphabet, letters, parameter_batch_size, resolve_parameters
+from .core import per_trial
+from .lexicon import DEFAULT_WORDS_PATH, Lexicon, append_rows, delete_rows
+
+
+# bump this whenever the layout of the cached files changes, so that old
+# caches are not picked up by mistake.
+CACHE_VERSION = 1
+
+# letters_to_words and words_to_letters only visit the units that are above 0
+# when less than this fraction of them are (see LexiconConnectivity). the
+# value is where the two ways take about the same time.
+SPARSE_DENSITY = 0.1
+
+
+# the connections between the letter and word layers only ever take two
+# values: a word is excited by the letter it contains at a position, and
+# inhibited by every other letter at that position (and the same in the
+# other direction). so instead of storing dense (positions, 26, num_words)
+# weight arrays we only store which letter each word has at each position,
+# as a (num_words, positions) array of letter indices, plus the excitation
+# and inhibition constants. memory then grows with
+# num_words x positions rather than num_words x 26 x positions.
+class LexiconConnectivity:
+    def __init__(self, word_letters, letter_word_excitation, letter_word_inhibition, word_letter_excitation, word_letter_inhibition, num_letters=26, sparse_density=SPARSE_DENSITY):
+        # word_letters[i, j] is the index of the letter that word i has at
+        # position j.
+        self.word_letters = np.asarray(word_letters, dtype=np.intp)
+        self.num_words, self.positions = self.word_letters.shape
+        self.num_letters = num_letters
+
+        # the connection strengths are single numbers, or arrays with one
+        # value per trial of a batch (see per_trial).
+        self.letter_word_excitation = letter_word_excitation
+        self.letter_word_inhibition = letter_word_inhibition
+        self.word_letter_excitation = word_letter_excitation
+        self.word_letter_inhibition = word_letter_inhibition
+
+        # each (word, position) pair as a single index into the flattened
+        # (positions x num_letters) letter layer. used to scatter the word
+        # activations back onto the letters.
+        self.flat_letter_index = np.arange(self.positions) * num_letters + self.word_letters
+
+        # the words that have each letter at each position, see letter_words().
+        self._letter_words = None
+
+        # the arrays that word_letters and flat_letter_index are views of once
+        # words have been added or removed (see add_words). word_letters may
+        # be shared with the lexicon, so it is only copied then.
+        self._buffers = None
+
+        # when less than this fraction of the input units are above 0,
+        # letters_to_words and words_to_letters skip the ones that are not
+        # (None always uses the dense way). the sparse ways add up the same
+        # numbers in the same order, so the result is identical to the last
+        # bit either way; only the time it takes changes.
+        self.sparse_density = sparse_density
+
+    # build the connectivity for a Lexicon using the connection strengths in
+    # params (see resolve_parameters).
+    @classmethod
+    def from_lexicon(cls, lexicon, params=None):
+        params = resolve_parameters(params)
+
+        return cls(lexicon.word_letters, params["LETTER_WORD_EXCITATION"], params["LETTER_WORD_INHIBITION"], params["WORD_LETTER_EXCITATION"], params["WORD_LETTER_INHIBITION"], num_letters=len(alphabet))
+
+    # the net input to every word from the (already clipped) letter
+    # activations, which have shape ([batch_size,] positions, num_letters).
+    # each word gets excitation from the letters it contains and inhibition
+    # from all the other letters at the same positions:
+    #   excitation * matched - inhibition * (total - matched)
+    def letters_to_words(self, clipped_letters):
+        # gather the activation of each word's letter at each position and add
+        # them up across positions. when only a few letters are active, only
+        # the words that contain them are visited.
+        if self._is_sparse(clipped_letters):
+            batch_shape = clipped_letters.shape[:-2]
+            matched = self.sparse_letters_to_words(clipped_letters.reshape((-1, self.positions, self.num_letters))).reshape(batch_shape + (self.num_words,))
+        else:
+            # (added up in float64 like np.bincount does in the sparse way,
+            # so float32 letters give the same result both ways too.)
+            matched = np.sum(clipped_letters[..., np.arange(self.positions), self.word_letters], axis=-1, dtype=np.float64).astype(clipped_letters.dtype, copy=False)
+        total = np.sum(clipped_letters, axis=(-2, -1))[..., np.newaxis]
+        excitation, inhibition = self._strengths(self.letter_word_excitation, self.letter_word_inhibition, 1, matched.dtype)
+
+        return (excitation + inhibition) * matched - inhibition * total
+
+    # the net input to every letter at every position from the (already
+    # clipped) word activations, which have shape ([batch_size,] num_words).
+    # the result has shape ([batch_size,] positions, num_letters).
+    def words_to_letters(self, clipped_words):
+        batch_shape = clipped_words.shape[:-1]
+        batch_size = int(np.prod(batch_shape))
+        layer_size = self.positions * self.num_letters
+
+        # after clipping most words are usually 0, and then only the ones
+        # above 0 are scattered.
+        if self._is_sparse(clipped_words):
+            positive = np.flatnonzero(clipped_words)
+            trials, words = np.divmod(positive, self.num_words)
+            net_input = self.sparse_words_to_letters(trials, words, clipped_words.reshape(-1)[positive], batch_size)
+
+            return net_input.reshape(batch_shape + (self.positions, self.num_letters))
+
+        # scatter-add each word's activation onto the letters it contains. the
+        # batch is handled by giving each trial its own block of layer_size
+        # bins.
+        offsets = (np.arange(batch_size) * layer_size)[:, np.newaxis, np.newaxis]
+        bins = (offsets + self.flat_letter_index).ravel()
+        weights = np.repeat(clipped_words.reshape(batch_size, self.num_words), self.positions, axis=-1).ravel()
+        matched = np.bincount(bins, weights=weights, minlength=batch_size * layer_size)
+        # np.bincount always adds up in float64, so convert back to the dtype
+        # of the words.
+        matched = matched.reshape(batch_shape + (self.positions, self.num_letters)).astype(clipped_words.dtype, copy=False)
+
+        # every word has exactly one letter at the first position, so adding
+        # up those bins gives the total of all the words. (this is what makes
+        # the total the same to the last bit in sparse_words_to_letters.)
+        total = np.sum(matched[..., 0, :], axis=-1)[..., np.newaxis, np.newaxis]
+        excitation, inhibition = self._strengths(self.word_letter_excitation, self.word_letter_inhibition, 2, matched.dtype)
+
+        return (excitation + inhibition) * matched - inhibition * total
+
+    # an index from letters to words: the words that have the letter with
+    # flat index i (position * num_letters + letter) are
+    # words[starts[i]:starts[i + 1]]. it is built the first time it is needed.
+    def letter_words(self):
+        if self._letter_words is None:
+            # flat_letter_index.T lists every (position, word) pair position by
+            # position, so entry k belongs to word k % num_words. a stable sort
+            # keeps the words of each letter in order.
+            flat = self.flat_letter_index.T.ravel()
+            order = np.argsort(flat, kind='stable')
+            starts = np.concatenate([[0], np.cumsum(np.bincount(flat, minlength=self.positions * self.num_letters))])
+            self._letter_words = (order % self.num_words, starts)
+
+        return self._letter_words
+
+    # the sum of the active letters of every word, for (clipped) letter
+    # activations of shape (num_trials, positions, num_letters), as a
+    # (num_trials, num_words) array. it is worked out from the index in
+    # letter_words(), so the work grows with the number of words that share
+    # a letter with the input rather than with num_words x positions. the
+    # net input of the words is then
+    #   (letter_word_excitation + letter_word_inhibition) * matched - letter_word_inhibition * total
+    # as in letters_to_words().
+    def sparse_letters_to_words(self, clipped_letters):
+        num_trials = len(clipped_letters)
+        keys, values = self._active_letter_words(clipped_letters)
+        matched = np.bincount(keys, weights=values, minlength=num_trials * self.num_words)
+
+        return matched.reshape(num_trials, self.num_words).astype(clipped_letters.dtype, copy=False)
+
+    # sparse_letters_to_words() for only the words that have any of the
+    # active letters, so that nothing is done for the others at all: returns
+    # their indices in the flattened (num_trials, num_words) word layer
+    # (trial * num_words + word, in order) and their sums of active letters
+    # (the same as in sparse_letters_to_words()).
+    def matched_words(self, clipped_letters):
+        keys, values = self._active_letter_words(clipped_letters)
+
+        # when the letters are shared by a good part of the lexicon, adding
+        # them up over the whole word layer is quicker than sorting the keys.
+        # (the active letters are above 0, so every word that has any of them
+        # has a sum above 0.)
+        size = len(clipped_letters) * self.num_words
+        if len(keys) > size // 8:
+            matched = np.bincount(keys, weights=values, minlength=size)
+            words = np.flatnonzero(matched)
+            matched = matched[words]
+        else:
+            words, inverse = np.unique(keys, return_inverse=True)
+            matched = np.bincount(inverse, weights=values, minlength=len(words))
+
+        return words, matched.astype(clipped_letters.dtype, copy=False)
+
+    # every (word, active letter) pair, as the word's index in the flattened
+    # word layer and the letter's activation.
+    def _active_letter_words(self, clipped_letters):
+        flat_letters = clipped_letters.reshape(len(clipped_letters), -1)
+        trials, letters = np.nonzero(flat_letters > 0)
+        words, starts = self.letter_words()
+
+        # list the words of every active letter one after the other: entry j
+        # of the list is word offsets[j] of the letter segment[j] belongs to.
+        counts = starts[letters + 1] - starts[letters]
+        segment = np.repeat(np.arange(len(letters)), counts)
+        offsets = np.arange(len(segment)) - np.repeat(np.cumsum(counts) - counts, counts)
+        keys = trials[segment] * self.num_words + words[starts[letters][segment] + offsets]
+
+        return keys, flat_letters[trials, letters][segment]
+
+    # whether less than sparse_density of the (clipped) units are above 0.
+    def _is_sparse(self, clipped):
+        if self.sparse_density is None:
+            return False
+
+        return np.count_nonzero(clipped) < self.sparse_density * clipped.size
+
+    # words_to_letters for only the given words: word words[k] of trial
+    # trials[k] has (clipped) activation values[k], and every other word is
+    # at or below 0. the result has shape (num_trials, positions, num_letters)
+    # and equals words_to_letters() of the full word layer.
+    def sparse_words_to_letters(self, trials, words, values, num_trials):
+        layer_size = self.positions * self.num_letters
+
+        bins = (trials[:, np.newaxis] * layer_size + self.flat_letter_index[words]).ravel()
+        matched = np.bincount(bins, weights=np.repeat(values, self.positions), minlength=num_trials * layer_size)
+        matched = matched.reshape(num_trials, self.positions, self.num_letters).astype(values.dtype, copy=False)
+        total = np.sum(matched[:, 0, :], axis=-1)[:, np.newaxis, np.newaxis]
+        excitation, inhibition = self._strengths(self.word_letter_excitation, self.word_letter_inhibition, 2, matched.dtype)
+
+        return (excitation + inhibition) * matched - inhibition * total
+
+    # add words at the end, given their letters as a (num_new_words,
+    # positions) array of letter indices, or remove the words with the given
+    # indices, moving the words after them up. the letter indices are updated
+    # in place (see append_rows and delete_rows) rather than built again for
+    # the whole lexicon; the letter_words() index is built again the next
+    # time it is needed.
+    def add_words(self, word_letters):
+        word_letters = np.asarray(word_letters, dtype=np.intp)
+        letter_buffer, flat_buffer = self._writable_buffers()
+
+        flat_letter_index = np.arange(self.positions) * self.num_letters + word_letters
+        self._buffers = (append_rows(letter_buffer, self.num_words, word_letters), append_rows(flat_buffer, self.num_words, flat_letter_index))
+        self._update_views(self.num_words + len(word_letters))
+
+    def remove_words(self, indices):
+        letter_buffer, flat_buffer = self._writable_buffers()
+
+        delete_rows(letter_buffer, self.num_words, indices)
+        self._update_views(delete_rows(flat_buffer, self.num_words, indices))
+
+    # a copy of the connectivity that can be changed without changing this
+    # one. the arrays are only copied once the copy is changed.
+    def copy(self):
+        connectivity = copy.copy(self)
+        connectivity._buffers = None
+
+        return connectivity
+
+    def _writable_buffers(self):
+        if self._buffers is None:
+            self._buffers = (self.word_letters.copy(), self.flat_letter_index.copy())
+
+        return self._buffers
+
+    def _update_views(self, num_words):
+        letter_buffer, flat_buffer = self._buffers
+        self.num_words = num_words
+        self.word_letters = letter_buffer[:num_words]
+        self.flat_letter_index = flat_buffer[:num_words]
+        self._letter_words = None
+
+    # a pair of connection strengths, shaped to broadcast against a layer
+    # with unit_dims axes of units when they have one value per trial, and in
+    # the dtype of the activations.
+    def _strengths(self, excitation, inhibition, unit_dims, dtype):
+        return per_trial(excitation, unit_dims, dtype), per_trial(inhibition, unit_dims, dtype)
+
+    # the connectivity of a subset of the trials of a batch: the same
+    # connections, with the strengths that have one value per trial narrowed
+    # down to the given trials.
+    def subset(self, trials):
+        connectivity = copy.copy(self)
+        for name in ('letter_word_excitation', 'letter_word_inhibition', 'word_letter_excitation', 'word_letter_inhibition'):
+            value = getattr(self, name)
+            if np.ndim(value) > 0:
+                setattr(connectivity, name, np.asarray(value)[trials])
+
+        return connectivity
+
+    # the equivalent dense weight arrays, for use with IAPool:
+    # w_from_letters_to_words with shape (positions, num_letters, num_words)
+    # and w_from_words_to_letters with shape (positions, num_words, num_letters)
+    def dense(self):
+        one_hot = np.zeros((self.positions, self.num_letters, self.num_words))
+        one_hot[np.arange(self.positions), self.word_letters, np.arange(self.num_words)[:, np.newaxis]] = 1
+
+        # with strengths that vary per trial, both get a leading batch
+        # dimension.
+        w_from_letters_to_words = np.where(one_hot == 1, per_trial(self.letter_word_excitation, 3), -per_trial(self.letter_word_inhibition, 3))
+        w_from_words_to_letters = np.where(one_hot.transpose(0, 2, 1) == 1, per_trial(self.word_letter_excitation, 3), -per_trial(self.word_letter_inhibition, 3))
+
+        return w_from_letters_to_words, w_from_words_to_letters
+
+
+# the weights from the features to the letters. w_from_features_to_letters is
+# used for the features that are present in the input and
+# w_from_features_to_letters_absence for the features that are absent. both
+# have shape (14, 26), with the given floating point dtype, or
+# (batch_size, 14, 26) when the feature parameters have one value per trial.
+def compile_feature_weights(params=None, dtype=np.float64):
+    params = resolve_parameters(params)
+
+    w_from_features_to_letters = letters.transpose()
+    w_from_features_to_letters_absence = 1 - w_from_features_to_letters
+
+    excitation = per_trial(params["FEATURE_LETTER_EXCITATION"], 2)
+    inhibition = per_trial(params["FEATURE_LETTER_INHIBITION"], 2)
+    w_from_features_to_letters = np.where(w_from_features_to_letters == 1, excitation, -inhibition)
+    w_from_features_to_letters_absence = np.where(w_from_features_to_letters_absence == 1, excitation, -inhibition)
+
+    return w_from_features_to_letters.astype(dtype, copy=False), w_from_features_to_letters_absence.astype(dtype, copy=False)
+
+
+# everything the model needs that can be worked out before it runs: the
+# lexicon, the feature weights, the letter<->word connectivity and the
+# resting states of the words, together with the parameters they were
+# built from.
+class CompiledWeights:
+    def __init__(self, params, lexicon, w_from_features_to_letters, w_from_features_to_letters_absence, word_resting_state):
+        self.params = params
+        self.lexicon = lexicon
+        self.w_from_features_to_letters = w_from_features_to_letters
+        self.w_from_features_to_letters_absence = w_from_features_to_letters_absence
+        self.word_resting_state = word_resting_state
+        self.connectivity = LexiconConnectivity.from_lexicon(lexicon, params)
+
+    # the floating point type of the weights and resting states.
+    @property
+    def dtype(self):
+        return self.w_from_features_to_letters.dtype
+
+    # the number of parameter sets the weights were compiled for, when the
+    # parameters have one value per trial (see compile_weights), or None.
+    @property
+    def batch_size(self):
+        return parameter_batch_size(self.params)
+
+    # the same weights converted to another floating point type, e.g.
+    # np.float32. the connectivity only holds letter indices and constants, so
+    # only the feature weights and the resting states are converted.
+    def astype(self, dtype):
+        if np.dtype(dtype) == self.dtype:
+            return self
+
+        return CompiledWeights(self.params, self.lexicon, self.w_from_features_to_letters.astype(dtype), self.w_from_features_to_letters_absence.astype(dtype), self.word_resting_state.astype(dtype))
+
+
+# compile the weights for a lexicon. every parameter can also be given as a
+# list or array with one value per trial of a batch (all of the same length),
+# e.g. {"DECAY_RATE": [0.05, 0.07, 0.09]}: the weights and resting states
+# that depend on it then get a leading batch dimension and the model built
+# from them runs each trial with its own parameters.
+def compile_weights(lexicon, params=None, dtype=np.float64):
+    params = resolve_parameters(params)
+    parameter_batch_size(params)
+    w_from_features_to_letters, w_from_features_to_letters_absence = compile_feature_weights(params, dtype)
+    word_resting_state = lexicon.resting_state(per_trial(params["REST_GAIN"], 1))
+
+    return CompiledWeights(params, lexicon, w_from_features_to_letters, w_from_features_to_letters_absence, word_resting_state.astype(dtype, copy=False))
+
+
+# compiled weights are cached in this directory, unless IAM_CACHE_DIR says
+# otherwise.
+def default_cache_dir():
+    return os.environ.get("IAM_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "iam"))
+
+
+# the name of the cache entry for a words file and a set of parameters. it
+# changes whenever the contents of the file or any parameter value changes.
+def cache_key(words_path, params):
+    digest = hashlib.sha256()
+    with open(words_path, 'rb') as f:
+        digest.update(f.read())
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    digest.update(str(CACHE_VERSION).encode())
+
+    return digest.hexdigest()
+
+
+# the arrays that make up a cache entry. each one is saved as its own .npy
+# file so that it can be memory-mapped when it is loaded again.
+def _save_cached(weights, path):
+    cache_dir = os.path.dirname(path)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # write everything to a temporary directory first and then rename it, so
+    # that another process never sees a half-written cache entry.
+    tmp = tempfile.mkdtemp(dir=cache_dir)
+    np.save(os.path.join(tmp, 'words.npy'), np.array(weights.lexicon.words, dtype=str))
+    np.save(os.path.join(tmp, 'frequencies.npy'), weights.lexicon.frequencies)
+    np.save(os.path.join(tmp, 'word_letters.npy'), weights.lexicon.word_letters)
+    np.save(os.path.join(tmp, 'word_resting_state.npy'), weights.word_resting_state)
+    np.save(os.path.join(tmp, 'w_from_features_to_letters.npy'), weights.w_from_features_to_letters)
+    np.save(os.path.join(tmp, 'w_from_features_to_letters_absence.npy'), weights.w_from_features_to_letters_absence)
+
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # another process wrote the same entry first.
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _load_cached(path, params):
+    def load(name):
+        return np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+
+    lexicon = Lexicon(load('words').tolist(), load('frequencies'), load('word_letters'))
+
+    return CompiledWeights(params, lexicon, load('w_from_features_to_letters'), load('w_from_features_to_letters_absence'), load('word_resting_state'))
+
+
+# load the compiled weights for a words file and a set of parameters. the
+# first time a combination is seen the weights are compiled and saved to the
+# cache. after that they are memory-mapped straight from disk, which avoids
+# parsing the csv and rebuilding the weights on every start. the cache always
+# holds float64 weights, which are converted when another dtype is asked for.
+def load_weights(words_path=DEFAULT_WORDS_PATH, params=None, cache_dir=None, use_cache=True, dtype=np.float64):
+    params = resolve_parameters(params)
+    # parameters with one value per trial are not cached.
+    if not use_cache or parameter_batch_size(params) is not None:
+        return compile_weights(Lexicon.from_csv(words_path), params, dtype)
+
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    path = os.path.join(cache_dir, cache_key(words_path, params))
+
+    if os.path.isdir(path):
+        return _load_cached(path, params).astype(dtype)
+
+    weights = compile_weights(Lexicon.from_csv(words_path), params)
+    _save_cached(weights, path)
+
+    return weights.astype(dtype)
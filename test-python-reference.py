@@ -1,38 +1,22 @@
 import numpy as np
-import pandas as pd
 
-# Import the reference implementation
-exec(open('iam-python-ref.py').read())
+from iam import IAPool, letter_to_index, letters, load_weights
+from iam.constants import DECAY_RATE, LETTER_LETTER_INHIBITION, MIN_ACTIVATION, WORD_WORD_INHIBITION
 
-# Load word data
-word_data = pd.read_csv('words.csv')
-words = word_data['word'].str.lower().tolist()
-resting = word_data['frequency'].values
+# Load the compiled weights (cached on disk after the first run)
+weights = load_weights()
+words = weights.lexicon.words
+w_from_features_to_letters = weights.w_from_features_to_letters
+w_from_features_to_letters_absence = weights.w_from_features_to_letters_absence
+w_from_letters_to_words, w_from_words_to_letters = weights.connectivity.dense()
 
-# Create letter-to-index mapping
-alphabet = 'abcdefghijklmnopqrstuvwxyz'
-letter_to_index = {letter: index for index, letter in enumerate(alphabet)}
+# Create layers (in_place=True: each pool steps in preallocated, double-buffered state)
+letters_layer_first_letter = IAPool(26, weights=[w_from_features_to_letters, w_from_features_to_letters_absence, w_from_words_to_letters[0]], decay_rate=DECAY_RATE, min_value = MIN_ACTIVATION, inhibition_strength=LETTER_LETTER_INHIBITION, in_place=True)
+letters_layer_second_letter = IAPool(26, weights=[w_from_features_to_letters, w_from_features_to_letters_absence, w_from_words_to_letters[1]], decay_rate=DECAY_RATE, min_value = MIN_ACTIVATION, inhibition_strength=LETTER_LETTER_INHIBITION, in_place=True)
+letters_layer_third_letter = IAPool(26, weights=[w_from_features_to_letters, w_from_features_to_letters_absence, w_from_words_to_letters[2]], decay_rate=DECAY_RATE, min_value = MIN_ACTIVATION, inhibition_strength=LETTER_LETTER_INHIBITION, in_place=True)
+letters_layer_fourth_letter = IAPool(26, weights=[w_from_features_to_letters, w_from_features_to_letters_absence, w_from_words_to_letters[3]], decay_rate=DECAY_RATE, min_value = MIN_ACTIVATION, inhibition_strength=LETTER_LETTER_INHIBITION, in_place=True)
 
-# Create one-hot encoded representations for letter-to-word weights
-w_from_letters_to_words = np.zeros((4, 26, len(words)))
-for i, word in enumerate(words):
-    for j, letter in enumerate(word):
-        index = letter_to_index[letter]
-        w_from_letters_to_words[j, index, i] = 1
-
-w_from_words_to_letters = w_from_letters_to_words.transpose(0, 2, 1)
-
-# Apply weight mapping
-w_from_letters_to_words = np.where(w_from_letters_to_words==1, LETTER_WORD_EXCITATION, -LETTER_WORD_INHIBITION)
-w_from_words_to_letters = np.where(w_from_words_to_letters==1, WORD_LETTER_EXCITATION, -WORD_LETTER_INHIBITION)
-
-# Create layers
-letters_layer_first_letter = IAPool(26, weights=[w_from_features_to_letters, w_from_features_to_letters_absence, w_from_words_to_letters[0]], decay_rate=DECAY_RATE, min_value = MIN_ACTIVATION, inhibition_strength=LETTER_LETTER_INHIBITION)
-letters_layer_second_letter = IAPool(26, weights=[w_from_features_to_letters, w_from_features_to_letters_absence, w_from_words_to_letters[1]], decay_rate=DECAY_RATE, min_value = MIN_ACTIVATION, inhibition_strength=LETTER_LETTER_INHIBITION)
-letters_layer_third_letter = IAPool(26, weights=[w_from_features_to_letters, w_from_features_to_letters_absence, w_from_words_to_letters[2]], decay_rate=DECAY_RATE, min_value = MIN_ACTIVATION, inhibition_strength=LETTER_LETTER_INHIBITION)
-letters_layer_fourth_letter = IAPool(26, weights=[w_from_features_to_letters, w_from_features_to_letters_absence, w_from_words_to_letters[3]], decay_rate=DECAY_RATE, min_value = MIN_ACTIVATION, inhibition_strength=LETTER_LETTER_INHIBITION)
-
-words_layer = IAPool(len(words), weights=w_from_letters_to_words, decay_rate=DECAY_RATE, min_value=MIN_ACTIVATION, inhibition_strength=WORD_WORD_INHIBITION, resting_state=resting*REST_GAIN)
+words_layer = IAPool(len(words), weights=w_from_letters_to_words, decay_rate=DECAY_RATE, min_value=MIN_ACTIVATION, inhibition_strength=WORD_WORD_INHIBITION, resting_state=weights.word_resting_state, in_place=True)
 
 # Test with WORK
 input_present = [
@@ -64,12 +48,14 @@ print()
 
 # Run for 20 cycles
 for i in range(20):
-    # Save states
-    l_0_s = letters_layer_first_letter.state.copy()
-    l_1_s = letters_layer_second_letter.state.copy()
-    l_2_s = letters_layer_third_letter.state.copy()
-    l_3_s = letters_layer_fourth_letter.state.copy()
-    w_s = words_layer.state.copy()
+    # Grab the states at the start of the cycle. The pools are double-buffered
+    # (in_place=True), so these stay valid while the pools are stepped and
+    # no copies are needed
+    l_0_s = letters_layer_first_letter.state
+    l_1_s = letters_layer_second_letter.state
+    l_2_s = letters_layer_third_letter.state
+    l_3_s = letters_layer_fourth_letter.state
+    w_s = words_layer.state
 
     # Update letter layers
     letters_layer_first_letter.step([input_present[0], input_absence[0], w_s])
@@ -95,11 +81,11 @@ letters_layer_fourth_letter.reset()
 words_layer.reset()
 
 for i in range(10):
-    l_0_s = letters_layer_first_letter.state.copy()
-    l_1_s = letters_layer_second_letter.state.copy()
-    l_2_s = letters_layer_third_letter.state.copy()
-    l_3_s = letters_layer_fourth_letter.state.copy()
-    w_s = words_layer.state.copy()
+    l_0_s = letters_layer_first_letter.state
+    l_1_s = letters_layer_second_letter.state
+    l_2_s = letters_layer_third_letter.state
+    l_3_s = letters_layer_fourth_letter.state
+    w_s = words_layer.state
 
     letters_layer_first_letter.step([input_present[0], input_absence[0], w_s])
     letters_layer_second_letter.step([input_present[1], input_absence[1], w_s])
@@ -10,10 +10,11 @@ def compute_net_input(list_of_inputs, list_of_excitatory_weights, inhibition_str
         clipped_input = np.clip(list_of_inputs[i], 0, None)
         input_signal += np.dot(clipped_input, list_of_excitatory_weights[i])
 
+    if inhibition_strength == 0:
+        return input_signal
+
     clipped_state = np.clip(current_activation, 0, None)
-    inhibitory_weights = np.full((num_units, num_units), -inhibition_strength)
-    np.fill_diagonal(inhibitory_weights, 0)
-    inhibitory_signal = np.dot(clipped_state, inhibitory_weights)
+    inhibitory_signal = -inhibition_strength * (np.sum(clipped_state) - clipped_state)
 
     total_input = input_signal + inhibitory_signal
     return total_input
@@ -0,0 +1,193 @@
+# checks of the invariants the iam package relies on. run them with
+#
+#   python -m pytest -q
+#
+# from the top of the repository.
+import numpy as np
+
+from iam.core import IAPool, propagate
+from iam.lexicon import DEFAULT_WORDS_PATH, Lexicon
+from iam.model import IAModel, load_model
+from iam.montecarlo import MonteCarloResult, run_monte_carlo
+from iam.precision import check_precision
+from iam.schedule import Schedule
+from iam.stimulus import mask_stimulus, word_stimulus
+from iam.weights import compile_weights, load_weights
+
+
+# the sparse way of propagate() leaves out the inputs that are 0, and only
+# differs from the full product in how BLAS rounds the rest.
+def test_propagate_sparse_matches_dense():
+    rng = np.random.default_rng(0)
+    eps = np.finfo(np.float64).eps
+
+    for _ in range(200):
+        weights = rng.uniform(-1, 1, (300, int(rng.integers(1, 30))))
+        clipped_input = np.clip(rng.uniform(-1, 0.1, (int(rng.integers(1, 5)), 300)), 0, None)
+
+        sparse = propagate(clipped_input, weights, sparse_density=0.5)
+        dense = np.dot(clipped_input, weights)
+        scale = np.dot(np.abs(clipped_input), np.abs(weights))
+        assert np.all(np.abs(sparse - dense) <= 8 * eps * scale)
+
+    # mostly active inputs take the full product.
+    clipped_input = rng.uniform(0, 1, (4, 300))
+    assert np.array_equal(propagate(clipped_input, weights, sparse_density=0.5), np.dot(clipped_input, weights))
+
+
+# a pool keeps its weights C-contiguous however they are given, and its
+# sparse steps stay within rounding of the dense ones.
+def test_pool_sparse_density():
+    rng = np.random.default_rng(1)
+    weights = np.asfortranarray(rng.uniform(-1, 1, (400, 50)))
+    inputs = [np.clip(rng.uniform(-1, 0.05, (3, 400)), 0, None)]
+
+    dense = IAPool(50, weights=[weights], batch_size=3, inhibition_strength=0.2)
+    sparse = IAPool(50, weights=[weights.T.T], batch_size=3, inhibition_strength=0.2, sparse_density=0.2)
+    assert sparse.weights[0].flags.c_contiguous
+
+    for _ in range(10):
+        assert np.allclose(dense.step(inputs), sparse.step(inputs), rtol=0, atol=1e-12)
+
+
+# a pruned model stepping its own states leaves the inactive words behind
+# and catches them up later, which only rounds differently from updating
+# them on every cycle.
+def test_pruned_words_caught_up():
+    model = load_model(batch_size=3, prune_margin=0.05)
+    feature_input = model.feature_input(*word_stimulus(['work', 'cave', 'that']))
+    letter_state, word_state = model.letter_state, model.word_state
+
+    for cycle in range(60):
+        model.advance(feature_input)
+        letter_state, word_state = model.update_from_input(letter_state, word_state, feature_input)
+        if cycle % 20 == 19:
+            assert np.allclose(model.word_state, word_state, rtol=0, atol=1e-14)
+            assert np.allclose(model.letter_state, letter_state, rtol=0, atol=1e-14)
+
+
+# IAModel against the hand-written loop over one IAPool per letter position
+# and one for the words, as in test-python-reference.py.
+def test_model_matches_pool_loop():
+    weights = load_weights()
+    params = weights.params
+    w_from_letters_to_words, w_from_words_to_letters = weights.connectivity.dense()
+    letter_pools = [IAPool(26, weights=[weights.w_from_features_to_letters, weights.w_from_features_to_letters_absence, w_from_words_to_letters[position]], decay_rate=params["DECAY_RATE"], min_value=params["MIN_ACTIVATION"], inhibition_strength=params["LETTER_LETTER_INHIBITION"]) for position in range(4)]
+    word_pool = IAPool(len(weights.lexicon), weights=w_from_letters_to_words, decay_rate=params["DECAY_RATE"], min_value=params["MIN_ACTIVATION"], inhibition_strength=params["WORD_WORD_INHIBITION"], resting_state=weights.word_resting_state)
+
+    input_present, input_absence = word_stimulus('work')
+    letter_trace, word_trace = IAModel.from_weights(weights).run((input_present, input_absence), 30)
+
+    for cycle in range(30):
+        letter_states = [pool.state for pool in letter_pools]
+        word_state = word_pool.state
+        for position, pool in enumerate(letter_pools):
+            pool.step([input_present[position], input_absence[position], word_state])
+        word_pool.step(letter_states)
+
+        assert np.allclose(letter_trace[cycle], [pool.state for pool in letter_pools], rtol=0, atol=1e-12)
+        assert np.allclose(word_trace[cycle], word_pool.state, rtol=0, atol=1e-12)
+
+
+# trials run as one batch give the same activations as run one at a time.
+def test_batched_matches_sequential():
+    words = ['work', 'cave', 'that', 'wore']
+    letter_traces, word_traces = load_model(batch_size=len(words)).run(word_stimulus(words), 30)
+
+    model = load_model()
+    for i, word in enumerate(words):
+        letter_trace, word_trace = model.run(word_stimulus(word), 30)
+        assert np.array_equal(letter_traces[:, i], letter_trace)
+        assert np.array_equal(word_traces[:, i], word_trace)
+
+
+# the sparse gathers and scatters of the connectivity give exactly the
+# activations of the dense ones.
+def test_sparse_connectivity_matches_dense():
+    weights = load_weights()
+    sparse = IAModel.from_weights(weights, batch_size=3)
+    dense = IAModel.from_weights(weights, batch_size=3)
+    dense.connectivity = dense.connectivity.copy()
+    dense.connectivity.sparse_density = None
+
+    stimulus = Schedule.masked(word_stimulus(['work', 'able', 'zone']), 40, 15)
+    for expected, actual in zip(dense.run(stimulus), sparse.run(stimulus)):
+        assert np.array_equal(expected, actual)
+
+
+# forking several masked continuations from a snapshot gives the same
+# activations as running each masked trial from the start.
+def test_fork_matches_straight_run():
+    model = load_model()
+    stimulus = word_stimulus('work')
+    onsets = [10, 14, 22]
+
+    model.run(stimulus, 10)
+    snapshot = model.snapshot()
+    continuations = [Schedule([(onset - 10, stimulus), (40 - onset, mask_stimulus())]) for onset in onsets]
+    letter_traces, word_traces = model.fork(snapshot, continuations)
+
+    for i, onset in enumerate(onsets):
+        letter_trace, word_trace = model.run(Schedule.masked(stimulus, 40, onset))
+        assert np.array_equal(letter_traces[:, i], letter_trace[10:])
+        assert np.array_equal(word_traces[:, i], word_trace[10:])
+
+    # and carrying on from the snapshot with run() does too.
+    letter_trace, word_trace = model.run(Schedule.masked(stimulus, 30, 4), start=snapshot)
+    assert np.array_equal(word_trace, word_traces[:, 1])
+
+
+# the noise of every replication only depends on the seed and the
+# replication's number, so splitting the replications into other batches or
+# separate runs gives the same results.
+def test_monte_carlo_split_replications():
+    model = load_model()
+    stimulus = word_stimulus('work')
+    options = dict(noise=0.05, feature_noise=0.2, threshold=0.6, target='work', seed=7)
+
+    whole = run_monte_carlo(model, stimulus, 48, 40, batch_size=48, **options)
+    batched = run_monte_carlo(model, stimulus, 48, 40, batch_size=5, **options)
+    combined = MonteCarloResult.combine([
+        run_monte_carlo(model, stimulus, 20, 40, first_replication=28, **options),
+        run_monte_carlo(model, stimulus, 28, 40, **options),
+    ])
+
+    for result in (batched, combined):
+        assert np.array_equal(whole.responses, result.responses)
+        assert np.array_equal(whole.latencies, result.latencies, equal_nan=True)
+
+
+# changing the words of a model in place gives exactly the model built from
+# the changed lexicon.
+def test_edited_words_match_rebuilt_lexicon():
+    lexicon = Lexicon.from_csv(DEFAULT_WORDS_PATH)
+    model = load_model()
+    model.remove_words(['word', 'fork'])
+    model.add_words(['zzzx', 'qqqq'], [-0.1, -0.5])
+    model.set_frequencies(['work'], [-0.3])
+
+    frequencies = dict(zip(lexicon.words, lexicon.frequencies))
+    frequencies.update(zzzx=-0.1, qqqq=-0.5, work=-0.3)
+    words = [word for word in lexicon.words if word not in ('word', 'fork')] + ['zzzx', 'qqqq']
+    rebuilt = IAModel.from_weights(compile_weights(Lexicon(words, np.array([frequencies[word] for word in words]))))
+
+    assert model.lexicon.words == rebuilt.lexicon.words
+    for expected, actual in zip(rebuilt.run(word_stimulus('work'), 30), model.run(word_stimulus('work'), 30)):
+        assert np.array_equal(expected, actual)
+
+    # the weights the model was loaded from keep the words they had.
+    assert load_model().lexicon.words == lexicon.words
+
+
+# a float32 model stays within the deviation check_precision reports for it,
+# which is small enough not to change any word's winner.
+def test_float32_within_reported_deviation():
+    report = check_precision(cycles=30)
+    assert report.equivalent(tolerance=1e-6)
+
+    words = ['work', 'cave', 'that']
+    reference = load_model(batch_size=3).run(word_stimulus(words), 30)
+    single = load_model(batch_size=3, dtype=np.float32).run(word_stimulus(words), 30)
+    assert single[1].dtype == np.float32
+    for expected, actual in zip(reference, single):
+        assert np.max(np.abs(expected - actual)) <= report.max_deviation()